@@ -12,6 +12,8 @@ LOG_DIR="/var/log/gameservers"
 LOG_FILE="${LOG_DIR}/setup.log"
 STEAMCMD_DIR="/opt/steamcmd"
 STEAMCMD_URL="https://steamcdn-a.akamaihd.net/client/installer/steamcmd_linux.tar.gz"
+# Node-local depot cache bind-mounted by the deployer (see proxmox-deployer)
+STEAM_DEPOT_CACHE="${STEAM_DEPOT_CACHE:-/mnt/depot-cache}"
 
 # =============================================================================
 # COLOR DEFINITIONS
@@ -183,6 +185,38 @@ install_steamcmd() {
     return 0
 }
 
+# Copy game files from the depot cache into an empty install directory
+restore_depot_cache() {
+    local install_dir="$1"
+
+    if [[ ! -f "${STEAM_DEPOT_CACHE}/.complete" ]] || [[ -n "$(ls -A "$install_dir" 2>/dev/null)" ]]; then
+        return 0
+    fi
+
+    log_info "Copying game files from depot cache ${STEAM_DEPOT_CACHE}..."
+    mkdir -p "$install_dir"
+    if ! cp -a --reflink=auto "${STEAM_DEPOT_CACHE}/." "$install_dir/"; then
+        log_warn "Depot cache copy failed, SteamCMD will download instead"
+        return 0
+    fi
+    rm -f "${install_dir}/.complete" "${install_dir}/.lock"
+}
+
+# Seed the depot cache from a finished install (first install on the node only)
+seed_depot_cache() {
+    local install_dir="$1"
+
+    if [[ ! -d "$STEAM_DEPOT_CACHE" ]] || [[ -f "${STEAM_DEPOT_CACHE}/.complete" ]]; then
+        return 0
+    fi
+
+    (
+        flock -n 9 || exit 0
+        log_info "Seeding depot cache ${STEAM_DEPOT_CACHE}..."
+        cp -a --reflink=auto "${install_dir}/." "${STEAM_DEPOT_CACHE}/" && touch "${STEAM_DEPOT_CACHE}/.complete"
+    ) 9>"${STEAM_DEPOT_CACHE}/.lock" || log_warn "Could not seed depot cache"
+}
+
 # Run SteamCMD to install/update a game server
 run_steamcmd() {
     local install_dir="$1"
@@ -191,6 +225,8 @@ run_steamcmd() {
     log_info "Updating game files (App ID: ${app_id})..."
     log_info "Install directory: ${install_dir}"
 
+    restore_depot_cache "$install_dir"
+
     if ! "${STEAMCMD_DIR}/steamcmd.sh" \
         +force_install_dir "$install_dir" \
         +login anonymous \
@@ -200,6 +236,8 @@ run_steamcmd() {
         return 1
     fi
 
+    seed_depot_cache "$install_dir"
+
     log_success "Game files updated successfully"
     return 0
 }
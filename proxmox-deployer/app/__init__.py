@@ -7,6 +7,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import os
 
+from app.database import normalize_database_url, engine_options, configure_engine
+
 db = SQLAlchemy()
 
 
@@ -16,21 +18,112 @@ def create_app(config_class=None):
 
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(os.environ.get(
         'DATABASE_URL',
         'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deployer.db')
-    )
+    ))
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['EVENT_BATCH_SIZE'] = int(os.environ.get('EVENT_BATCH_SIZE', 100))
+    app.config['EVENT_FLUSH_INTERVAL'] = float(os.environ.get('EVENT_FLUSH_INTERVAL', 1.0))
+    app.config['RETENTION_DAYS'] = int(os.environ.get('RETENTION_DAYS', 180))
+    app.config['RETENTION_STATUSES'] = os.environ.get('RETENTION_STATUSES', 'failed,provision_failed,gone').split(',')
+    app.config['RETENTION_INTERVAL'] = float(os.environ.get('RETENTION_INTERVAL', 0))
+    app.config['ARCHIVE_DIR'] = os.environ.get(
+        'ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'archive')
+    )
+    app.config['VACUUM_FREE_RATIO'] = float(os.environ.get('VACUUM_FREE_RATIO', 0.1))
+    app.config['TASK_NODE_LIMIT'] = int(os.environ.get('TASK_NODE_LIMIT', 4))
+    app.config['TASK_STORAGE_LIMIT'] = int(os.environ.get('TASK_STORAGE_LIMIT', 2))
+    app.config['TASK_THROTTLE_ADAPTIVE'] = os.environ.get('TASK_THROTTLE_ADAPTIVE', 'true').lower() in ('1', 'true', 'yes')
+    app.config['TASK_SLOT_TIMEOUT'] = float(os.environ.get('TASK_SLOT_TIMEOUT', 1800))
+    app.config['LEASE_TTL'] = float(os.environ.get('LEASE_TTL', 60))
+    app.config['LEASE_WAIT'] = float(os.environ.get('LEASE_WAIT', 0))
+    app.config['IDEMPOTENCY_TTL'] = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+    app.config['IDEMPOTENCY_WAIT'] = float(os.environ.get('IDEMPOTENCY_WAIT', 300))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+    app.config['CATALOG_DIR'] = os.environ.get('CATALOG_DIR')
+    app.config['CATALOG_RELOAD_INTERVAL'] = float(os.environ.get('CATALOG_RELOAD_INTERVAL', 5))
+    app.config['WARM_POOL_INTERVAL'] = float(os.environ.get('WARM_POOL_INTERVAL', 0))
+    app.config['DEPOT_CACHE'] = os.environ.get('DEPOT_CACHE', '').lower() in ('1', 'true', 'yes')
+    app.config['LXC_TEMPLATES'] = os.environ.get('LXC_TEMPLATES', 'debian-12-standard').split(',')
+    app.config['TEMPLATE_PREFETCH_INTERVAL'] = float(os.environ.get('TEMPLATE_PREFETCH_INTERVAL', 0))
 
     # Initialize extensions
     db.init_app(app)
 
+    # Limit concurrent creates, clones and deletes per node and storage
+    from app.task_throttle import configure_task_throttle
+    configure_task_throttle(
+        app.config['TASK_NODE_LIMIT'], app.config['TASK_STORAGE_LIMIT'],
+        app.config['TASK_THROTTLE_ADAPTIVE'], app.config['TASK_SLOT_TIMEOUT']
+    )
+
     # Register blueprints
     from app.routes import main_bp
     app.register_blueprint(main_bp)
 
-    # Create database tables
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+
+    # Load external catalog files and watch them for changes
+    if app.config['CATALOG_DIR']:
+        from app.catalog_files import CatalogReloader
+        reloader = CatalogReloader(app.config['CATALOG_DIR'], app.config['CATALOG_RELOAD_INTERVAL'])
+        reloader.reload()
+        app.extensions['catalog_reloader'] = reloader
+        app.before_request(reloader.check)
+
+    # Create database tables and bring existing ones up to date
     with app.app_context():
-        db.create_all()
+        configure_engine(db.engine, app.config)
+
+        # Serialized across processes, so concurrently starting workers upgrade once
+        from app.migrations import run_migrations
+        run_migrations(db.engine, db.metadata)
+
+        # Builds whose worker stopped will never finish
+        from app.golden_templates import fail_interrupted_builds
+        fail_interrupted_builds()
+
+        # Keep dashboard counts current on every deployment write
+        from app.aggregates import track_deployment_counts
+        track_deployment_counts()
+
+        # Store each distinct deployment config once
+        from app.config_blobs import track_config_blobs
+        track_config_blobs()
+
+        # Append deployment events to the log in batches
+        from app.events import start_event_writer
+        start_event_writer(db.engine, app.config['EVENT_BATCH_SIZE'], app.config['EVENT_FLUSH_INTERVAL'])
+
+    # Keep warm pools topped up in the background
+    if app.config['WARM_POOL_INTERVAL'] > 0:
+        from app.warm_pool import WarmPoolManager
+        manager = WarmPoolManager(app, app.config['WARM_POOL_INTERVAL'])
+        manager.start()
+        app.extensions['warm_pool'] = manager
+
+    # Download missing OS templates to every node ahead of deploys
+    if app.config['TEMPLATE_PREFETCH_INTERVAL'] > 0:
+        from app.template_prefetch import TemplatePrefetcher
+        prefetcher = TemplatePrefetcher(app, app.config['TEMPLATE_PREFETCH_INTERVAL'])
+        prefetcher.start()
+        app.extensions['template_prefetch'] = prefetcher
+
+    # Archive and compact old deployment history, then vacuum
+    if app.config['RETENTION_INTERVAL'] > 0:
+        from app.retention import RetentionManager
+        retention = RetentionManager(app, app.config['RETENTION_INTERVAL'])
+        retention.start()
+        app.extensions['retention'] = retention
 
     return app
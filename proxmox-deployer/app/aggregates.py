@@ -0,0 +1,175 @@
+"""
+Dashboard Aggregates
+Deployment counts per status, kept in the deployment_counts table and
+updated in the same transaction as every deployment insert, status change
+and delete, so the dashboard never has to count the history.
+"""
+
+from collections import Counter
+from typing import Dict, Any
+
+from sqlalchemy import event, inspect, select, func, delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Deployment, DeploymentCount
+
+# Dimensions counted, besides the overall 'all'
+DIMENSIONS = ('server_key', 'node', 'connection_id')
+TRACKED_FIELDS = ('status',) + DIMENSIONS
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _keys(values: Dict[str, Any]):
+    """Every count row a deployment with these values contributes to."""
+    status = values['status'] or 'pending'
+    yield 'all', '', status
+    for dimension in DIMENSIONS:
+        yield dimension, str(values[dimension] if values[dimension] is not None else ''), status
+
+
+def _values(deployment: Deployment, original: bool) -> Dict[str, Any]:
+    """Current tracked values, or the ones loaded from the database."""
+    state = inspect(deployment)
+    values = {}
+    for field in TRACKED_FIELDS:
+        history = state.attrs[field].history
+        if original and history.deleted:
+            values[field] = history.deleted[0]
+        else:
+            values[field] = getattr(deployment, field)
+    return values
+
+
+def _apply(conn, deltas: Counter):
+    """Add deltas to the count rows, creating missing ones."""
+    table = DeploymentCount.__table__
+    insert = _UPSERT_DIALECTS.get(conn.dialect.name)
+    for (dimension, value, status), delta in deltas.items():
+        if not delta:
+            continue
+        if insert:
+            stmt = insert(table).values(dimension=dimension, value=value, status=status, count=delta)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['dimension', 'value', 'status'],
+                set_={'count': table.c.count + delta}
+            ))
+            continue
+        result = conn.execute(
+            update(table)
+            .where(table.c.dimension == dimension, table.c.value == value, table.c.status == status)
+            .values(count=table.c.count + delta)
+        )
+        if not result.rowcount:
+            conn.execute(table.insert().values(dimension=dimension, value=value, status=status, count=delta))
+
+
+def _track_flush(session, flush_context, instances):
+    """
+    Turn the deployments about to be written into count deltas.
+
+    Runs before the flush, while deleted rows can still be loaded; the
+    deltas are written after it, in the same transaction.
+    """
+    deltas = Counter()
+    for deployment in session.new:
+        if isinstance(deployment, Deployment):
+            deltas.update(_keys(_values(deployment, original=False)))
+    for deployment in session.deleted:
+        if isinstance(deployment, Deployment):
+            deltas.subtract(_keys(_values(deployment, original=True)))
+    for deployment in session.dirty:
+        if not isinstance(deployment, Deployment) or deployment in session.deleted:
+            continue
+        state = inspect(deployment)
+        if not any(state.attrs[field].history.has_changes() for field in TRACKED_FIELDS):
+            continue
+        deltas.subtract(_keys(_values(deployment, original=True)))
+        deltas.update(_keys(_values(deployment, original=False)))
+    if any(deltas.values()):
+        session.info.setdefault('deployment_count_deltas', Counter()).update(deltas)
+
+
+def _write_counts(session, flush_context):
+    deltas = session.info.pop('deployment_count_deltas', None)
+    if deltas:
+        _apply(session.connection(), deltas)
+
+
+def _drop_counts(session, *args):
+    session.info.pop('deployment_count_deltas', None)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def track_deployment_counts():
+    """Keep deployment_counts in step with every ORM write to deployments."""
+    if event.contains(Session, 'before_flush', _track_flush):
+        return
+    # Load the previous value when a tracked field is set, even if it was expired
+    for field in TRACKED_FIELDS:
+        event.listen(getattr(Deployment, field), 'set', _load_old_value, active_history=True, retval=True)
+    event.listen(Session, 'before_flush', _track_flush)
+    event.listen(Session, 'after_flush', _write_counts)
+    event.listen(Session, 'after_rollback', _drop_counts)
+
+
+def subtract_deployments(conn, rows):
+    """
+    Take deployments deleted with bulk SQL out of the counts.
+
+    Args:
+        conn: Connection in the transaction that deleted them
+        rows: Mappings with the deleted rows' status, server_key, node and connection_id
+    """
+    deltas = Counter()
+    for row in rows:
+        deltas.subtract(_keys(row))
+    _apply(conn, deltas)
+
+
+def rebuild_deployment_counts(conn):
+    """
+    Recount deployment_counts from the deployments table.
+
+    Needed once for existing databases and after bulk SQL that bypasses
+    the ORM without calling subtract_deployments.
+    """
+    table = DeploymentCount.__table__
+    deployments = Deployment.__table__
+    conn.execute(delete(table))
+    status = func.coalesce(deployments.c.status, 'pending')
+    groups = [('all', None)] + [(dimension, deployments.c[dimension]) for dimension in DIMENSIONS]
+    for dimension, column in groups:
+        columns = [status] if column is None else [column, status]
+        for row in conn.execute(select(*columns, func.count()).group_by(*columns)).all():
+            value = '' if column is None else ('' if row[0] is None else str(row[0]))
+            conn.execute(table.insert().values(
+                dimension=dimension, value=value, status=row[-2], count=row[-1]
+            ))
+
+
+def get_deployment_counts() -> Dict[str, Any]:
+    """
+    Read the maintained counts.
+
+    Returns:
+        Dict with total, by_status, and per server_key, node and connection
+        a {value: {status: count, 'total': count}} breakdown
+    """
+    counts = {'total': 0, 'by_status': {}}
+    for dimension in DIMENSIONS:
+        counts[f'by_{dimension}'] = {}
+
+    for row in DeploymentCount.query.filter(DeploymentCount.count != 0).all():
+        if row.dimension == 'all':
+            counts['by_status'][row.status] = row.count
+            counts['total'] += row.count
+            continue
+        entry = counts[f'by_{row.dimension}'].setdefault(row.value, {'total': 0})
+        entry[row.status] = row.count
+        entry['total'] += row.count
+    return counts
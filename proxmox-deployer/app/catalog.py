@@ -0,0 +1,220 @@
+"""
+Game Server Catalog Index
+Precomputed lookup tables and ranked fuzzy search over the game server catalog.
+"""
+
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple
+
+# Relative weight of a term match depending on which field it came from
+FIELD_WEIGHTS = {
+    'key': 4,
+    'name': 4,
+    'tags': 2,
+    'linuxgsm_name': 2,
+    'description': 1,
+}
+
+# Quality multiplier for each kind of term match
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.75
+FUZZY_MATCH = 0.5
+SUBSTRING_MATCH = 0.25
+
+# Terms shorter than this are never fuzzy-matched (too many false hits)
+MIN_FUZZY_LENGTH = 4
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def _tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric tokens."""
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def _trigrams(token: str) -> set:
+    """Get the padded trigrams of a token."""
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_typos(term: str) -> int:
+    """Get the number of edits tolerated for a search term."""
+    if len(term) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Edit distance between two strings (adjacent transpositions count as one
+    edit), bailing out early once it exceeds a limit.
+
+    Returns:
+        The distance, or limit + 1 if it exceeds the limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current.append(value)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class CatalogIndex:
+    """Read-only index over a game server catalog, built once at load time."""
+
+    def __init__(self, servers: Dict[str, Any]):
+        """
+        Build all lookup tables for a catalog.
+
+        Args:
+            servers: Mapping of server key to server definition
+        """
+        self.servers = servers
+        self.by_category: Dict[str, Dict[str, Any]] = {}
+        self.by_tag: Dict[str, Dict[str, Any]] = {}
+        self.by_port: Dict[int, Dict[str, Any]] = {}
+
+        # token -> {server_key: best field weight}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # trigram -> set of vocabulary tokens (for typo tolerance)
+        self._token_trigrams: Dict[str, set] = {}
+        # trigram -> set of server keys (for substring matches)
+        self._text_trigrams: Dict[str, set] = {}
+        # server_key -> lowercased "key name description" text
+        self._haystacks: Dict[str, str] = {}
+        # catalog position, used to break ranking ties
+        self._order: Dict[str, int] = {}
+
+        for position, (key, server) in enumerate(servers.items()):
+            self._order[key] = position
+            self.by_category.setdefault(server.get('category'), {})[key] = server
+            for tag in server.get('tags') or ():
+                self.by_tag.setdefault(tag, {})[key] = server
+            for port in server.get('ports') or ():
+                self.by_port.setdefault(port, {})[key] = server
+
+            self._index_field(key, 'key', key)
+            for field in ('name', 'description', 'linuxgsm_name'):
+                if server.get(field):
+                    self._index_field(key, field, server.get(field))
+            for tag in server.get('tags') or ():
+                self._index_field(key, 'tags', tag)
+
+            haystack = ' '.join((key, server.get('name', ''), server.get('description', ''))).lower()
+            self._haystacks[key] = haystack
+            for i in range(len(haystack) - 2):
+                self._text_trigrams.setdefault(haystack[i:i + 3], set()).add(key)
+
+        self._vocabulary = sorted(self._postings)
+        for token in self._vocabulary:
+            for gram in _trigrams(token):
+                self._token_trigrams.setdefault(gram, set()).add(token)
+
+        self.category_counts = {cat: len(entries) for cat, entries in self.by_category.items()}
+        self._search_keys = lru_cache(maxsize=1024)(self._rank)
+
+    def _index_field(self, key: str, field: str, text: str):
+        """Add the tokens of one server field to the postings."""
+        weight = FIELD_WEIGHTS[field]
+        for token in _tokenize(text):
+            postings = self._postings.setdefault(token, {})
+            if postings.get(key, 0) < weight:
+                postings[key] = weight
+
+    def _match_term(self, term: str) -> Dict[str, float]:
+        """Score every server matching a single search term."""
+        scores: Dict[str, float] = {}
+
+        def add(token, quality):
+            for key, weight in self._postings[token].items():
+                score = weight * quality
+                if score > scores.get(key, 0):
+                    scores[key] = score
+
+        # Exact and prefix matches via the sorted vocabulary
+        start = bisect_left(self._vocabulary, term)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            add(token, EXACT_MATCH if token == term else PREFIX_MATCH)
+
+        # Typo-tolerant matches via shared trigrams
+        max_typos = _max_typos(term)
+        if max_typos:
+            candidates = set()
+            for gram in _trigrams(term):
+                candidates |= self._token_trigrams.get(gram, set())
+            for token in candidates:
+                if token.startswith(term):
+                    continue
+                if _edit_distance(term, token, max_typos) <= max_typos:
+                    add(token, FUZZY_MATCH)
+
+        return scores
+
+    def _substring_matches(self, query: str) -> set:
+        """Find servers whose key, name or description contain the query."""
+        if len(query) >= 3:
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            candidates = set.intersection(*(self._text_trigrams.get(g, set()) for g in grams))
+        else:
+            candidates = self._haystacks.keys()
+        return {key for key in candidates if query in self._haystacks[key]}
+
+    def _rank(self, query: str) -> Tuple[str, ...]:
+        """Rank server keys for a normalized query (memoized per index)."""
+        scores: Dict[str, float] = {}
+
+        # Every term must match (exactly, by prefix or within typo distance)
+        terms = _tokenize(query)
+        if terms:
+            term_scores = [self._match_term(term) for term in terms]
+            matched = set(term_scores[0]).intersection(*term_scores[1:])
+            for key in matched:
+                scores[key] = sum(ts[key] for ts in term_scores)
+
+        # Plain substring matches are always included
+        for key in self._substring_matches(query):
+            scores[key] = scores.get(key, 0) + SUBSTRING_MATCH * FIELD_WEIGHTS['key']
+
+        if query in self.servers:
+            scores[query] = scores.get(query, 0) + 10
+
+        return tuple(sorted(scores, key=lambda k: (-scores[k], self._order[k])))
+
+    def search(self, query: str, limit: int = None) -> Dict[str, Any]:
+        """
+        Search the catalog, best matches first.
+
+        Args:
+            query: Free-text search query
+            limit: Maximum number of results to return (at least 1)
+
+        Returns:
+            Ordered dict of server key to server definition
+
+        Raises:
+            ValueError: If limit is less than 1
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be at least 1')
+        query = ' '.join(str(query).lower().split())
+        if not query:
+            return {}
+        keys = self._search_keys(query)
+        if limit is not None:
+            keys = keys[:limit]
+        return {key: self.servers[key] for key in keys}
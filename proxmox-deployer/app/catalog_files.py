@@ -0,0 +1,233 @@
+"""
+External Catalog Files
+Loads extra game definitions and install recipes from JSON files in a directory,
+validates them and hot-reloads on change.
+
+Each ``*.json`` file may contain any of these top-level keys:
+
+    {
+        "categories": {"horror": {"name": "Horror", "icon": "moon", "color": "#111111"}},
+        "servers": {"mygame": {"name": "My Game", "hostname": "mygame-server",
+                               "description": "...", "category": "survival",
+                               "ports": [7777], "steam_app_id": 123456}},
+        "install_scripts": {"mygame": {"name": "My Game", "type": "linuxgsm",
+                                       "linuxgsm_name": "mygameserver"}}
+    }
+
+File entries are layered over the built-in catalog in filename order, so a file
+can add new games or override built-in ones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, Tuple
+
+from app import game_servers, install_scripts
+from app.game_servers import _server
+
+logger = logging.getLogger(__name__)
+
+SERVER_FIELDS = {
+    'name': str, 'hostname': str, 'description': str, 'category': str,
+    'steam_app_id': int, 'cores': int, 'memory': int, 'disk_size': int,
+    'ports': list, 'protocol': str, 'tags': list, 'icon': str,
+    'linuxgsm_name': str, 'deployment_type': str, 'env_vars': list,
+}
+REQUIRED_SERVER_FIELDS = ('name', 'hostname', 'description', 'category')
+CATEGORY_FIELDS = ('name', 'icon', 'color')
+SCRIPT_REQUIREMENTS = {
+    'linuxgsm': ('linuxgsm_name',),
+    'docker': ('docker_compose',),
+    'custom': ('script',),
+}
+
+
+class CatalogError(ValueError):
+    """Raised when a catalog file is missing fields or has invalid values."""
+
+
+def _fingerprint(directory: str) -> Tuple[Tuple[str, int, int], ...]:
+    """Cheap change detector: name, mtime and size of every catalog file."""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(entries))
+
+
+def _validate_server(source: str, key: str, entry: Any, categories: dict):
+    """Check a server entry against the fields accepted by _server()."""
+    where = f'{source}: servers.{key}'
+    if not isinstance(entry, dict):
+        raise CatalogError(f'{where} must be an object')
+    for field in REQUIRED_SERVER_FIELDS:
+        if not entry.get(field):
+            raise CatalogError(f'{where} is missing required field: {field}')
+    for field, value in entry.items():
+        if field not in SERVER_FIELDS:
+            raise CatalogError(f'{where} has unknown field: {field}')
+        expected = SERVER_FIELDS[field]
+        if value is not None and (not isinstance(value, expected) or isinstance(value, bool)):
+            raise CatalogError(f'{where}.{field} must be of type {expected.__name__}')
+    if entry['category'] not in categories:
+        raise CatalogError(f"{where} has unknown category: {entry['category']}")
+    if entry.get('deployment_type', 'lxc') not in ('lxc', 'vm'):
+        raise CatalogError(f'{where}.deployment_type must be "lxc" or "vm"')
+    for field in ('cores', 'memory', 'disk_size'):
+        if field in entry and entry[field] <= 0:
+            raise CatalogError(f'{where}.{field} must be positive')
+    for port in entry.get('ports') or ():
+        if not isinstance(port, int) or not 0 < port < 65536:
+            raise CatalogError(f'{where}.ports contains an invalid port: {port!r}')
+    if not all(isinstance(tag, str) for tag in entry.get('tags') or ()):
+        raise CatalogError(f'{where}.tags must be a list of strings')
+    for env in entry.get('env_vars') or ():
+        if not isinstance(env, dict) or not env.get('name'):
+            raise CatalogError(f'{where}.env_vars entries must be objects with a name')
+
+
+def _validate_script(source: str, key: str, entry: Any):
+    """Check an install recipe has the fields its type needs."""
+    where = f'{source}: install_scripts.{key}'
+    if not isinstance(entry, dict):
+        raise CatalogError(f'{where} must be an object')
+    if not entry.get('name'):
+        raise CatalogError(f'{where} is missing required field: name')
+    script_type = entry.get('type')
+    if script_type not in SCRIPT_REQUIREMENTS:
+        raise CatalogError(f'{where}.type must be one of: {", ".join(SCRIPT_REQUIREMENTS)}')
+    for field in SCRIPT_REQUIREMENTS[script_type]:
+        if not isinstance(entry.get(field), str) or not entry[field]:
+            raise CatalogError(f'{where} is missing required field: {field}')
+
+
+def parse_catalog_dir(directory: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse and validate every catalog file in a directory.
+
+    Args:
+        directory: Directory containing *.json catalog files
+
+    Returns:
+        Dict with merged 'categories', 'servers' and 'install_scripts' entries
+
+    Raises:
+        CatalogError: If any file is malformed
+    """
+    merged = {'categories': {}, 'servers': {}, 'install_scripts': {}}
+    for name, _, _ in _fingerprint(directory):
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise CatalogError(f'{name}: {e}')
+        if not isinstance(data, dict):
+            raise CatalogError(f'{name}: top level must be an object')
+        unknown = set(data) - set(merged)
+        if unknown:
+            raise CatalogError(f'{name}: unknown sections: {", ".join(sorted(unknown))}')
+
+        for key, category in (data.get('categories') or {}).items():
+            if not isinstance(category, dict) or not all(category.get(f) for f in CATEGORY_FIELDS):
+                raise CatalogError(f'{name}: categories.{key} needs {", ".join(CATEGORY_FIELDS)}')
+            merged['categories'][key] = category
+
+        categories = {**game_servers.CATEGORIES, **merged['categories']}
+        for key, entry in (data.get('servers') or {}).items():
+            _validate_server(name, key, entry, categories)
+            merged['servers'][key] = entry
+
+        for key, entry in (data.get('install_scripts') or {}).items():
+            _validate_script(name, key, entry)
+            merged['install_scripts'][key] = entry
+
+    return merged
+
+
+def load_catalog_dir(directory: str) -> Tuple[dict, tuple]:
+    """
+    Load and validate catalog files.
+
+    Returns:
+        Tuple of (validated catalog data, fingerprint of the files it came from)
+    """
+    fingerprint = _fingerprint(directory)
+    return parse_catalog_dir(directory), fingerprint
+
+
+class CatalogReloader:
+    """Keeps the live catalog in sync with a directory of catalog files."""
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        """
+        Args:
+            directory: Directory containing *.json catalog files
+            interval: Minimum seconds between change checks
+        """
+        self.directory = directory
+        self.interval = interval
+        self.fingerprint = None
+        self.last_error = None
+        self._seen_fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self) -> Dict[str, Any]:
+        """Load the files and swap in the new catalog; keep the old one on error."""
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                data, fingerprint = load_catalog_dir(self.directory)
+            except (CatalogError, OSError) as e:
+                self.last_error = str(e)
+                logger.error('Catalog reload failed, keeping current catalog: %s', e)
+                return self.status()
+
+            categories = {**game_servers.CATEGORIES, **data['categories']}
+            servers = dict(game_servers.GAME_SERVERS)
+            for key, entry in data['servers'].items():
+                servers[key] = _server(**entry)
+            scripts = {**install_scripts.INSTALL_SCRIPTS, **data['install_scripts']}
+            version = hashlib.sha256(repr(fingerprint).encode()).hexdigest()[:16]
+
+            # Build everything first, then swap both references back to back
+            game_servers.set_catalog(servers, categories, version)
+            install_scripts.set_install_scripts(scripts)
+            self.fingerprint = self._seen_fingerprint = fingerprint
+            self.last_error = None
+            logger.info('Loaded catalog %s (%d servers, %d install scripts)',
+                        version, len(servers), len(scripts))
+            return self.status()
+
+    def check(self):
+        """Reload if the files changed; rate-limited and safe to call on every request."""
+        if time.monotonic() - self._last_check < self.interval or self._lock.locked():
+            return
+        self._last_check = time.monotonic()
+        try:
+            current = _fingerprint(self.directory)
+        except OSError as e:
+            logger.error('Cannot read catalog directory %s: %s', self.directory, e)
+            return
+        # Only retry a broken catalog once its files change again
+        if current != self._seen_fingerprint:
+            self._seen_fingerprint = current
+            self.reload()
+
+    def status(self) -> Dict[str, Any]:
+        """Describe the loaded catalog."""
+        return {
+            'directory': self.directory,
+            'version': game_servers.get_catalog_version(),
+            'files': [name for name, _, _ in self.fingerprint or ()],
+            'servers': len(game_servers.get_all_servers()),
+            'install_scripts': len(install_scripts.get_install_scripts()),
+            'error': self.last_error,
+        }
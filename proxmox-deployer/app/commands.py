@@ -0,0 +1,258 @@
+"""
+Flask CLI commands for the Game Server Deployer
+Run with: flask --app run <command>
+"""
+
+import click
+
+from app.models import ProxmoxConnection
+
+
+def _get_connection(name):
+    """Look up a connection by name, or the default connection."""
+    if name:
+        connection = ProxmoxConnection.query.filter_by(name=name).first()
+    else:
+        connection = ProxmoxConnection.query.filter_by(is_default=True).first()
+    if not connection:
+        raise click.ClickException(f'Connection not found: {name or "(default)"}')
+    return connection
+
+
+def register_commands(app):
+    """Attach the deployer's CLI commands to the app."""
+
+    @app.cli.command('build-golden-templates')
+    @click.option('--connection', 'connection_name', help='Connection name (default connection if omitted)')
+    @click.option('--node', required=True, help='Proxmox node to build on')
+    @click.option('--template', 'base_template', required=True, help='Base OS template volid')
+    @click.option('--server-key', 'server_keys', multiple=True,
+                  help='Game to build (repeatable); defaults to every LXC game with an install script')
+    @click.option('--storage', default='local-lvm', show_default=True, help='Build container storage')
+    @click.option('--backup-storage', default='local', show_default=True, help='Archive storage')
+    @click.option('--bridge', default='vmbr0', show_default=True)
+    @click.option('--keep', default=2, show_default=True, help='Ready versions to keep per game')
+    def build_golden_templates(connection_name, node, base_template, server_keys, storage,
+                               backup_storage, bridge, keep):
+        """Build pre-provisioned golden LXC templates."""
+        from app.game_servers import get_server
+        from app.golden_templates import build_golden_template
+        from app.install_scripts import get_install_scripts
+
+        connection = _get_connection(connection_name)
+        if not server_keys:
+            server_keys = [
+                key for key in get_install_scripts()
+                if get_server(key) and get_server(key).deployment_type == 'lxc'
+            ]
+
+        failed = 0
+        for server_key in server_keys:
+            click.echo(f'Building {server_key} on {node}...')
+            template = build_golden_template(
+                connection, node, server_key, base_template,
+                storage=storage, backup_storage=backup_storage, bridge=bridge, keep=keep
+            )
+            if template is None:
+                failed += 1
+                click.echo(f'  skipped: {server_key} is already being built on {node}', err=True)
+            elif template.status == 'ready':
+                click.echo(f'  v{template.version} ready: {template.volid} ({template.build_seconds}s)')
+            else:
+                failed += 1
+                click.echo(f'  failed: {template.error_message}', err=True)
+
+        if failed:
+            raise click.ClickException(f'{failed} of {len(server_keys)} builds failed')
+
+    @app.cli.command('migrate')
+    @click.option('--status', 'show_status', is_flag=True, help='Only list migrations and when they ran')
+    def migrate(show_status):
+        """Apply pending schema migrations."""
+        from app import db
+        from app.migrations import get_migration_status, run_migrations
+
+        if not show_status:
+            applied = run_migrations(db.engine, db.metadata)
+            click.echo(f'Applied {len(applied)} migration(s)')
+        for migration in get_migration_status(db.engine):
+            state = f"applied {migration['applied_at']}" if migration['applied_at'] else 'pending'
+            click.echo(f"{migration['version']:>4}  {migration['description']} ({state})")
+
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts():
+        """Recount the dashboard's deployment aggregates from the deployments table."""
+        from app import db
+        from app.aggregates import rebuild_deployment_counts, get_deployment_counts
+
+        with db.engine.begin() as conn:
+            rebuild_deployment_counts(conn)
+        counts = get_deployment_counts()
+        click.echo(f"{counts['total']} deployments: " +
+                   ', '.join(f'{count} {status}' for status, count in sorted(counts['by_status'].items())))
+
+    @app.cli.command('retention')
+    @click.option('--days', type=int, help='Override RETENTION_DAYS')
+    @click.option('--dry-run', is_flag=True, help='Only count what would be compacted')
+    @click.option('--no-vacuum', is_flag=True, help='Skip the vacuum after compacting')
+    def retention(days, dry_run, no_vacuum):
+        """Archive and compact old terminal deployments, then vacuum the database."""
+        from flask import current_app
+        from app.retention import run_retention
+
+        report = run_retention(current_app.config, days=days, dry_run=dry_run, vacuum=not no_vacuum)
+        for name, result in report['gone'].items():
+            if result['success']:
+                click.echo(f"{name}: {len(result['marked'])} deployment(s) marked gone")
+            else:
+                click.echo(f"{name}: could not list guests ({result['error']})", err=True)
+
+        compaction = report['compaction']
+        click.echo(f"{compaction['candidates']} deployment(s) unchanged since {compaction['cutoff'][:10]}: " +
+                   (', '.join(f'{count} {status}' for status, count in sorted(compaction['by_status'].items()))
+                    or 'none'))
+        if compaction.get('archive'):
+            click.echo(f"Archived {compaction['archived']} to {compaction['archive']}, "
+                       f"deleted {compaction['deleted']}, skipped {compaction['skipped']}")
+
+        vacuum = report.get('vacuum')
+        if vacuum and vacuum['vacuumed'] and 'bytes_after' in vacuum:
+            click.echo(f"Vacuumed: {vacuum['bytes_before'] // 1024} KiB -> {vacuum['bytes_after'] // 1024} KiB "
+                       f"in {vacuum['seconds']}s")
+        elif vacuum and vacuum['vacuumed']:
+            click.echo(f"Vacuumed in {vacuum['seconds']}s")
+        elif vacuum:
+            click.echo(f"Vacuum skipped ({vacuum.get('free_ratio', 0):.0%} free)")
+
+    @app.cli.command('benchmark-queries')
+    @click.option('--rows', default=100000, show_default=True, help='Synthetic deployments to generate')
+    @click.option('--repeat', default=20, show_default=True, help='Timed runs per query')
+    def benchmark_queries(rows, repeat):
+        """Time deployment queries before and after the migration indexes."""
+        from app.db_benchmark import run_query_benchmark
+
+        result = run_query_benchmark(rows=rows, repeat=repeat)
+        click.echo(f"{result['rows']} deployments (seeded in {result['seed_seconds']}s), "
+                   f"{result['repeat']} runs per query")
+        click.echo(f"{'query':<24}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+        for name, timing in result['queries'].items():
+            click.echo(f"{name:<24}{timing['before_ms']:>12.3f}{timing['after_ms']:>12.3f}"
+                       f"{timing['speedup']:>9}x")
+        stats = result['api_stats']
+        click.echo(f"/api/stats: {stats['before_ms']:.3f} ms -> {stats['after_ms']:.3f} ms "
+                   f"({stats['speedup']}x)")
+
+    @app.cli.command('benchmark-throttle')
+    @click.option('--tasks', default=24, show_default=True, help='Creates in the batch')
+    @click.option('--seconds', default=0.2, show_default=True, help='Duration of one create on an idle storage')
+    @click.option('--lanes', default=3, show_default=True, help='Creates the storage runs at full speed at once')
+    @click.option('--contention', default=0.15, show_default=True,
+                  help='Extra slowdown per create beyond the lanes')
+    def benchmark_throttle(tasks, seconds, lanes, contention):
+        """Time a batch of creates on a simulated storage with and without throttling."""
+        from app.task_throttle import simulate_batch
+
+        result = simulate_batch(tasks=tasks, seconds_alone=seconds, lanes=lanes, contention=contention)
+        click.echo(f"{result['tasks']} creates, ideal {result['ideal_seconds']}s")
+        click.echo(f"unthrottled:     {result['unthrottled_seconds']}s")
+        click.echo(f"fixed limit:     {result['fixed_limit_seconds']}s")
+        click.echo(f"adaptive limit:  {result['adaptive_seconds']}s (settled at {result['adaptive_limit']})")
+
+    @app.cli.command('benchmark-concurrency')
+    @click.option('--workers', default=4, show_default=True, help='Concurrent worker processes')
+    @click.option('--seconds', default=10.0, show_default=True, help='Duration per mode')
+    @click.option('--write-ratio', default=0.2, show_default=True, help='Fraction of operations that write')
+    @click.option('--postgres-url', help='Scratch PostgreSQL database to include')
+    @click.option('--mode', 'modes', multiple=True, help='Only this mode (repeatable)')
+    def benchmark_concurrency(workers, seconds, write_ratio, postgres_url, modes):
+        """Compare SQLite journaling modes and PostgreSQL under concurrent writers."""
+        from app.db_benchmark import CONCURRENCY_MODES, run_concurrency_benchmark
+
+        unknown = [mode for mode in modes if mode not in CONCURRENCY_MODES]
+        if unknown:
+            raise click.ClickException(f"Unknown mode(s): {', '.join(unknown)}")
+        if 'postgresql' in modes and not postgres_url:
+            raise click.ClickException('--postgres-url is required for the postgresql mode')
+
+        report = run_concurrency_benchmark(postgres_url, workers=workers, seconds=seconds,
+                                           write_ratio=write_ratio, modes=list(modes) or None)
+        click.echo(f"{workers} workers, {seconds}s per mode, {int(write_ratio * 100)}% writes")
+        click.echo(f"{'mode':<16}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for mode, result in report['modes'].items():
+            click.echo(f"{mode:<16}{result['ops_per_second']:>10}{result['p50_ms']:>10}"
+                       f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['errors']:>8}")
+            for message, count in result['error_messages'].items():
+                click.echo(f'    {count} x {message}')
+        if not modes and 'postgresql' not in report['modes']:
+            click.echo(f"{'postgresql':<16}skipped, pass --postgres-url to compare against PostgreSQL")
+
+    @app.cli.command('prefetch-templates')
+    @click.option('--connection', 'connection_name', help='Connection name (default connection if omitted)')
+    @click.option('--template', 'templates', multiple=True,
+                  help='Template file name or package (repeatable); defaults to every template in use')
+    @click.option('--node', 'nodes', multiple=True, help='Only this node (repeatable)')
+    @click.option('--storage', help='Template storage (default: local)')
+    @click.option('--no-verify', is_flag=True, help='Skip checksum verification')
+    def prefetch_templates_command(connection_name, templates, nodes, storage, no_verify):
+        """Download missing LXC OS templates to every node in parallel."""
+        from flask import current_app
+        from app.template_prefetch import required_templates, prefetch_templates
+
+        connection = _get_connection(connection_name)
+        names = list(templates) or required_templates(current_app.config['LXC_TEMPLATES'], connection.id)
+        if not names:
+            raise click.ClickException('No templates to prefetch')
+
+        report = prefetch_templates(connection, names, nodes=list(nodes), storage=storage, verify=not no_verify)
+        if report is None:
+            raise click.ClickException(f'A prefetch for {connection.name} is already running')
+        for node, results in report['nodes'].items():
+            for result in results:
+                line = f"{node} {result.get('template', result['name'])}: {result['status']}"
+                if result.get('verified') is not None:
+                    line += ', checksum ok' if result['verified'] else ', checksum mismatch'
+                    if result.get('unchanged'):
+                        line += ' (unchanged since last check)'
+                if result.get('error'):
+                    line += f" ({result['error']})"
+                click.echo(line, err=result['status'] == 'failed')
+        click.echo(f"{report['downloaded']} downloaded, {report['present']} present, "
+                   f"{report['failed']} failed in {report['seconds']}s")
+
+        if report['failed']:
+            raise click.ClickException(f"{report['failed']} templates could not be prefetched")
+
+    @app.cli.command('update-fleet')
+    @click.option('--connection', 'connection_name', help='Only this connection')
+    @click.option('--steam-app-id', help='Only this Steam app')
+    @click.option('--server-key', help='Only this game')
+    @click.option('--wave-size', default=5, show_default=True, help='Servers per wave')
+    @click.option('--concurrency', default=2, show_default=True, help='Parallel updates within a wave')
+    @click.option('--max-failures', default=0, show_default=True, help='Failures per wave before halting')
+    @click.option('--dry-run', is_flag=True, help='Only show the plan')
+    def update_fleet(connection_name, steam_app_id, server_key, wave_size, concurrency, max_failures, dry_run):
+        """Roll a Steam update out to running LinuxGSM servers in waves."""
+        from app.fleet_updates import plan_fleet_updates, create_fleet_updates, run_fleet_update
+
+        connection_id = _get_connection(connection_name).id if connection_name else None
+        groups = plan_fleet_updates(connection_id, steam_app_id, server_key)
+        for group in groups:
+            click.echo(f"{group['node']} app {group['steam_app_id']}: {len(group['deployments'])} servers")
+        if dry_run or not groups:
+            return
+
+        halted = 0
+        for update in create_fleet_updates(groups, wave_size=wave_size, concurrency=concurrency):
+            run_fleet_update(update, max_failures=max_failures)
+            report = update.report or {}
+            stage = report.get('stage') or {}
+            click.echo(f"{update.node} app {update.steam_app_id}: {update.status}, "
+                       f"staged in {stage.get('seconds', 0)}s")
+            for wave in report.get('waves', []):
+                click.echo(f"  wave {wave['wave']}: {wave['succeeded']} ok, {wave['failed']} failed "
+                           f"({wave['seconds']}s)")
+            if update.status != 'done':
+                halted += 1
+
+        if halted:
+            raise click.ClickException(f'{halted} of {len(groups)} updates did not finish')
@@ -0,0 +1,219 @@
+"""
+Content-Addressed Config Snapshots
+Deployment configs are normalized (sorted keys, JSON types) and stored once
+per distinct content in config_blobs, keyed by their SHA-256. A batch of
+identical deploys shares one blob, two deployments with the same hash have
+the same config, and finding every deployment with a config is an indexed
+lookup on deployments.config_hash.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Tuple
+
+from sqlalchemy import event, inspect, select, delete, update, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Deployment, ConfigBlob
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def normalize_config(config: Dict[str, Any]) -> Tuple[str, Dict[str, Any], int]:
+    """
+    Normalize a config and hash it.
+
+    Returns:
+        (SHA-256 hex digest, normalized config, size in bytes of its JSON)
+    """
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    encoded = canonical.encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest(), json.loads(canonical), len(encoded)
+
+
+def store_blobs(conn, blobs: Dict[str, Tuple[Dict[str, Any], int]]):
+    """
+    Insert blobs that do not exist yet and mark existing ones as used.
+
+    Args:
+        conn: Connection in the writing transaction
+        blobs: {hash: (normalized config, size)}
+    """
+    table = ConfigBlob.__table__
+    now = datetime.utcnow()
+    insert = _UPSERT_DIALECTS.get(conn.dialect.name)
+    for config_hash, (data, size) in blobs.items():
+        values = {'hash': config_hash, 'data': data, 'size': size, 'created_at': now, 'last_used_at': now}
+        if insert:
+            # Updating last_used_at also locks the row against a concurrent cleanup
+            conn.execute(insert(table).values(**values).on_conflict_do_update(
+                index_elements=['hash'], set_={'last_used_at': now}
+            ))
+            continue
+        result = conn.execute(update(table).where(table.c.hash == config_hash).values(last_used_at=now))
+        if not result.rowcount:
+            conn.execute(table.insert().values(**values))
+
+
+def _store_flush(session, flush_context, instances):
+    """Write the blobs of deployments whose config changed, ahead of the deployment rows."""
+    blobs = {}
+    for deployment in list(session.new) + list(session.dirty):
+        if not isinstance(deployment, Deployment):
+            continue
+        pending = deployment.__dict__.get('_pending_config')
+        if not pending or pending[0] != deployment.config_hash:
+            continue
+        if deployment in session.dirty and not inspect(deployment).attrs.config_hash.history.has_changes():
+            continue
+        blobs[pending[0]] = (pending[1], pending[2])
+    if blobs:
+        store_blobs(session.connection(), blobs)
+
+
+def track_config_blobs():
+    """Store config blobs on every ORM flush of deployments."""
+    if not event.contains(Session, 'before_flush', _store_flush):
+        event.listen(Session, 'before_flush', _store_flush)
+
+
+def get_config_blob(config_hash: str) -> Optional[ConfigBlob]:
+    return db.session.get(ConfigBlob, config_hash)
+
+
+def _flatten(value: Any, prefix: str = '') -> Dict[str, Any]:
+    """Flatten nested dicts into dotted paths; lists and scalars are leaves."""
+    if not isinstance(value, dict) or not value:
+        return {prefix: value} if prefix else {}
+    flat = {}
+    for key, item in value.items():
+        flat.update(_flatten(item, f'{prefix}.{key}' if prefix else str(key)))
+    return flat
+
+
+def diff_configs(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compare two configs key by key.
+
+    Returns:
+        Dict with added and removed {path: value}, and changed
+        {path: {'from': old, 'to': new}}, using dotted paths for nested keys
+    """
+    old_flat, new_flat = _flatten(old or {}), _flatten(new or {})
+    return {
+        'added': {path: new_flat[path] for path in sorted(new_flat.keys() - old_flat.keys())},
+        'removed': {path: old_flat[path] for path in sorted(old_flat.keys() - new_flat.keys())},
+        'changed': {
+            path: {'from': old_flat[path], 'to': new_flat[path]}
+            for path in sorted(old_flat.keys() & new_flat.keys())
+            if old_flat[path] != new_flat[path]
+        },
+    }
+
+
+def diff_deployments(old: Deployment, new: Deployment) -> Dict[str, Any]:
+    """
+    Diff two deployments' configs.
+
+    Equal hashes mean equal configs, so identical ones are answered without
+    loading either blob.
+    """
+    result = {'from': {'id': old.id, 'config_hash': old.config_hash},
+              'to': {'id': new.id, 'config_hash': new.config_hash}}
+    if old.config_hash == new.config_hash:
+        result.update(identical=True, added={}, removed={}, changed={})
+        return result
+    result.update(identical=False, **diff_configs(old.config_snapshot, new.config_snapshot))
+    return result
+
+
+def get_blob_stats() -> Dict[str, Any]:
+    """
+    Measure how much deduplication saves.
+
+    Returns:
+        Dict with blob count and bytes, deployments with a config, and the
+        bytes those configs would take stored one per deployment
+    """
+    blobs, blob_bytes = db.session.query(
+        func.count(ConfigBlob.hash), func.coalesce(func.sum(ConfigBlob.size), 0)
+    ).one()
+    deployments, logical_bytes = db.session.query(
+        func.count(Deployment.id), func.coalesce(func.sum(ConfigBlob.size), 0)
+    ).join(ConfigBlob, ConfigBlob.hash == Deployment.config_hash).one()
+    return {
+        'blobs': blobs,
+        'blob_bytes': blob_bytes,
+        'deployments': deployments,
+        'undeduplicated_bytes': logical_bytes,
+        'dedup_ratio': round(logical_bytes / blob_bytes, 2) if blob_bytes else None,
+    }
+
+
+def remove_unused_blobs(conn, unused_for: timedelta = timedelta(days=1)) -> int:
+    """
+    Delete blobs no deployment references.
+
+    Only blobs unused for a while are removed, so a deploy writing the same
+    config at that moment keeps its blob.
+
+    Returns:
+        Blobs deleted
+    """
+    table = ConfigBlob.__table__
+    referenced = select(Deployment.__table__.c.config_hash).where(Deployment.__table__.c.config_hash.isnot(None))
+    return conn.execute(delete(table).where(
+        table.c.last_used_at < datetime.utcnow() - unused_for,
+        table.c.hash.not_in(referenced)
+    )).rowcount
+
+
+def move_snapshots_to_blobs(conn, batch_size: int = 1000) -> int:
+    """
+    Move inline config_snapshot JSON of an existing deployments table into
+    config_blobs, then drop the old column.
+
+    Returns:
+        Deployments converted
+    """
+    columns = {column['name'] for column in inspect(conn).get_columns('deployments')}
+    if 'config_hash' not in columns:
+        conn.exec_driver_sql('ALTER TABLE deployments ADD COLUMN config_hash VARCHAR(64) '
+                             'REFERENCES config_blobs (hash)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_deployments_config_hash ON deployments (config_hash)')
+    if 'config_snapshot' not in columns:
+        return 0
+
+    converted, last_id = 0, 0
+    while True:
+        rows = conn.exec_driver_sql(
+            'SELECT id, config_snapshot FROM deployments '
+            f'WHERE id > {last_id} AND config_snapshot IS NOT NULL ORDER BY id LIMIT {batch_size}'
+        ).all()
+        if not rows:
+            break
+        blobs, hashes = {}, {}
+        for deployment_id, snapshot in rows:
+            config = json.loads(snapshot) if isinstance(snapshot, str) else snapshot
+            if config is None:
+                continue
+            config_hash, data, size = normalize_config(config)
+            blobs[config_hash] = (data, size)
+            hashes[deployment_id] = config_hash
+        store_blobs(conn, blobs)
+        table = Deployment.__table__
+        for deployment_id, config_hash in hashes.items():
+            conn.execute(update(table).where(table.c.id == deployment_id).values(config_hash=config_hash))
+        converted += len(hashes)
+        last_id = rows[-1][0]
+
+    try:
+        with conn.begin_nested():
+            conn.exec_driver_sql('ALTER TABLE deployments DROP COLUMN config_snapshot')
+    except Exception:
+        # SQLite before 3.35 cannot drop columns; free the space instead
+        conn.exec_driver_sql('UPDATE deployments SET config_snapshot = NULL')
+    return converted
@@ -0,0 +1,107 @@
+"""
+Database Engine Tuning
+SQLite is opened in WAL mode with a busy timeout, so gunicorn workers and
+background threads can read while one of them writes. PostgreSQL gets a
+sized, health-checked connection pool.
+"""
+
+from typing import Dict, Any
+
+from sqlalchemy import event
+
+SQLITE_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def normalize_database_url(url: str) -> str:
+    """
+    Accept the 'postgres://' scheme some hosts hand out, and use psycopg2
+    (from requirements.txt) for PostgreSQL URLs that name no driver; newer
+    SQLAlchemy releases would otherwise pick psycopg 3.
+    """
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith('sqlite')
+
+
+def engine_options(url: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    SQLAlchemy engine options for a database URL.
+
+    Args:
+        url: Database URL
+        config: App config with the SQLITE_* and DB_POOL_* settings
+
+    Returns:
+        Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS)
+    """
+    if is_sqlite(url):
+        # The driver's own lock wait; PRAGMA busy_timeout below covers the rest
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def configure_sqlite(engine, journal_mode: str = 'WAL', busy_timeout: int = 5000,
+                     synchronous: str = 'NORMAL'):
+    """
+    Apply SQLite pragmas to every new connection of an engine.
+
+    Args:
+        engine: SQLAlchemy engine for a SQLite database
+        journal_mode: 'WAL' lets readers run while one writer commits
+        busy_timeout: Milliseconds to wait for a lock before 'database is locked'
+        synchronous: 'NORMAL' is durable across app crashes in WAL mode and
+            only risks the last transactions on power loss
+    """
+    synchronous = synchronous.upper()
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f'Unknown SQLite synchronous mode: {synchronous}')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.close()
+
+
+def configure_engine(engine, config: Dict[str, Any]):
+    """Apply the configured tuning to the app's engine."""
+    if engine.dialect.name == 'sqlite':
+        configure_sqlite(
+            engine,
+            journal_mode=config['SQLITE_JOURNAL_MODE'],
+            busy_timeout=config['SQLITE_BUSY_TIMEOUT'],
+            synchronous=config['SQLITE_SYNCHRONOUS']
+        )
+
+
+def database_info(engine) -> Dict[str, Any]:
+    """Report the backend and its effective settings."""
+    info = {'backend': engine.dialect.name}
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            for pragma in ('journal_mode', 'busy_timeout', 'synchronous'):
+                info[pragma] = conn.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+            info['synchronous'] = SQLITE_SYNCHRONOUS_MODES[info['synchronous']]
+        else:
+            info['server_version'] = '.'.join(str(part) for part in engine.dialect.server_version_info or ())
+    pool = engine.pool
+    if hasattr(pool, 'size'):
+        info['pool'] = {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(0, pool.overflow()),
+        }
+    return info
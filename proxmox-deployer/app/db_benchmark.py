@@ -0,0 +1,313 @@
+"""
+Database Benchmarks
+Times the dashboard and lookup queries against a synthetic deployment
+history, before and after the indexes from the schema migrations, and
+measures throughput with several worker processes reading and writing at
+once. Runs on scratch databases, never the app's own.
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Callable, List
+
+from sqlalchemy import (
+    create_engine, select, func, update, MetaData, Table, Column, Integer, String, DateTime, JSON
+)
+
+from app.models import Deployment
+from app.migrations import create_deployment_indexes
+from app.database import configure_sqlite, normalize_database_url
+
+STATUS_WEIGHTS = {'running': 45, 'stopped': 25, 'deleted': 20, 'failed': 7, 'provision_failed': 3}
+
+
+def _seed(engine, table, rows: int, server_keys, nodes: int, rng: random.Random):
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    start = datetime.utcnow() - timedelta(days=365)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            server_key = rng.choice(server_keys)
+            batch.append({
+                'connection_id': 1,
+                'server_key': server_key,
+                'server_name': server_key,
+                'deployment_type': 'lxc',
+                'node': f'pve{i % nodes + 1}',
+                'vmid': 100 + i,
+                'status': rng.choices(statuses, weights)[0],
+                'created_at': start + timedelta(seconds=i * 315),
+            })
+            if len(batch) == 10000:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+
+
+def _time(engine, query: Callable, repeat: int) -> float:
+    """Average milliseconds per call of query(conn)."""
+    with engine.connect() as conn:
+        query(conn)  # warm up
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query(conn)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def run_query_benchmark(rows: int = 100000, repeat: int = 20, nodes: int = 8,
+                        seed: int = 1) -> Dict[str, Any]:
+    """
+    Benchmark deployment queries on a synthetic history.
+
+    Args:
+        rows: Deployments to generate
+        repeat: Timed runs per query
+        nodes: Distinct node names
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        Dict with per-query milliseconds before and after indexing, and the
+        /api/stats query as it was (four counts, no indexes) against as it
+        is now (one GROUP BY, indexed)
+    """
+    from app.game_servers import get_all_servers
+
+    rng = random.Random(seed)
+    table = Deployment.__table__
+    engine = create_engine('sqlite://')
+    table.create(engine)
+    with engine.begin() as conn:
+        for index in table.indexes:
+            index.drop(conn)
+
+    server_keys = sorted(get_all_servers())
+    seed_started = time.perf_counter()
+    _seed(engine, table, rows, server_keys, nodes, rng)
+    seed_seconds = time.perf_counter() - seed_started
+
+    lookups = [(f'pve{i % nodes + 1}', 100 + i) for i in rng.sample(range(rows), min(rows, 50))]
+    hot_key = server_keys[0]
+
+    def separate_counts(conn):
+        conn.execute(select(func.count()).select_from(table)).scalar()
+        for status in ('running', 'stopped', 'failed'):
+            conn.execute(select(func.count()).select_from(table).where(table.c.status == status)).scalar()
+
+    def group_by_status(conn):
+        conn.execute(select(table.c.status, func.count()).group_by(table.c.status)).all()
+
+    def vmid_lookup(conn):
+        for node, vmid in lookups:
+            conn.execute(select(table.c.id).where(table.c.vmid == vmid, table.c.node == node).limit(1)).first()
+
+    def recent_page(conn):
+        conn.execute(select(table).order_by(table.c.created_at.desc()).limit(50)).all()
+
+    def server_key_count(conn):
+        conn.execute(select(func.count()).select_from(table).where(table.c.server_key == hot_key)).scalar()
+
+    queries = {
+        'stats_separate_counts': separate_counts,
+        'stats_group_by': group_by_status,
+        f'vmid_lookup_x{len(lookups)}': vmid_lookup,
+        'recent_page': recent_page,
+        'server_key_count': server_key_count,
+    }
+
+    before = {name: _time(engine, query, repeat) for name, query in queries.items()}
+    with engine.begin() as conn:
+        create_deployment_indexes(conn)
+        conn.exec_driver_sql('ANALYZE')
+    after = {name: _time(engine, query, repeat) for name, query in queries.items()}
+    engine.dispose()
+
+    def speedup(old, new):
+        return round(old / new, 1) if new else None
+
+    return {
+        'rows': rows,
+        'repeat': repeat,
+        'seed_seconds': round(seed_seconds, 2),
+        'api_stats': {
+            'before_ms': round(before['stats_separate_counts'], 3),
+            'after_ms': round(after['stats_group_by'], 3),
+            'speedup': speedup(before['stats_separate_counts'], after['stats_group_by']),
+        },
+        'queries': {
+            name: {
+                'before_ms': round(before[name], 3),
+                'after_ms': round(after[name], 3),
+                'speedup': speedup(before[name], after[name]),
+            }
+            for name in queries
+        },
+    }
+
+
+# Stand-in for the deployments table, so a shared PostgreSQL database is never touched
+_bench_metadata = MetaData()
+bench_deployments = Table(
+    'bench_deployments', _bench_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('server_key', String(100), nullable=False, index=True),
+    Column('node', String(100), nullable=False),
+    Column('vmid', Integer),
+    Column('status', String(50), index=True),
+    Column('config_snapshot', JSON),
+    Column('created_at', DateTime, index=True),
+)
+
+# Concurrency benchmark modes: (engine options, SQLite pragmas or None)
+CONCURRENCY_MODES = {
+    # Python's sqlite3 defaults: rollback journal, 5 s lock wait, synchronous=FULL
+    'sqlite-default': ({'connect_args': {'timeout': 5}}, None),
+    'sqlite-wal': ({'connect_args': {'timeout': 5}},
+                   {'journal_mode': 'WAL', 'busy_timeout': 5000, 'synchronous': 'NORMAL'}),
+    'postgresql': ({'pool_size': 2, 'max_overflow': 0, 'pool_pre_ping': True}, None),
+}
+
+
+def _bench_row(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {
+        'server_key': rng.choice(('valheim', 'rust', 'counterstrike2', 'minecraft', 'ark')),
+        'node': f'pve{i % 4 + 1}',
+        'vmid': 100 + i,
+        'status': rng.choice(list(STATUS_WEIGHTS)),
+        'config_snapshot': {'cores': 4, 'memory': 8192, 'env_vars': {'SERVER_NAME': f'server {i}'}},
+        'created_at': datetime.utcnow(),
+    }
+
+
+def _engine(url: str, mode: str):
+    options, pragmas = CONCURRENCY_MODES[mode]
+    engine = create_engine(url, **options)
+    if pragmas:
+        configure_sqlite(engine, **pragmas)
+    return engine
+
+
+def _concurrency_worker(url: str, mode: str, seconds: float, write_ratio: float, seed: int, results):
+    """One process: mixed dashboard reads and deployment writes until time runs out."""
+    rng = random.Random(seed)
+    engine = _engine(url, mode)
+    table = bench_deployments
+    latencies, reads, writes, errors = [], 0, 0, {}
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        write = rng.random() < write_ratio
+        try:
+            if write:
+                with engine.begin() as conn:
+                    if rng.random() < 0.5:
+                        conn.execute(table.insert(), [_bench_row(rng, rng.randrange(100000))])
+                    else:
+                        conn.execute(update(table).where(table.c.id == rng.randrange(1, 5000))
+                                     .values(status=rng.choice(list(STATUS_WEIGHTS))))
+                writes += 1
+            else:
+                with engine.connect() as conn:
+                    conn.execute(select(table.c.status, func.count()).group_by(table.c.status)).all()
+                    conn.execute(select(table.c.id, table.c.server_key, table.c.status)
+                                 .order_by(table.c.created_at.desc()).limit(50)).all()
+                reads += 1
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            message = str(getattr(e, 'orig', e)).splitlines()[0][:80]
+            errors[message] = errors.get(message, 0) + 1
+
+    engine.dispose()
+    results.put({'reads': reads, 'writes': writes, 'latencies': latencies, 'errors': errors})
+
+
+def _run_mode(url: str, mode: str, workers: int, seconds: float, write_ratio: float,
+              rows: int) -> Dict[str, Any]:
+    engine = _engine(url, mode)
+    _bench_metadata.drop_all(engine)
+    _bench_metadata.create_all(engine)
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        conn.execute(bench_deployments.insert(), [_bench_row(rng, i) for i in range(rows)])
+    engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=_concurrency_worker, args=(url, mode, seconds, write_ratio, seed, results))
+        for seed in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    engine = _engine(url, mode)
+    _bench_metadata.drop_all(engine)
+    engine.dispose()
+
+    latencies = sorted(l for outcome in outcomes for l in outcome['latencies'])
+    errors = {}
+    for outcome in outcomes:
+        for message, count in outcome['errors'].items():
+            errors[message] = errors.get(message, 0) + count
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    operations = sum(o['reads'] + o['writes'] for o in outcomes)
+    return {
+        'operations': operations,
+        'ops_per_second': round(operations / seconds, 1),
+        'reads': sum(o['reads'] for o in outcomes),
+        'writes': sum(o['writes'] for o in outcomes),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'errors': sum(errors.values()),
+        'error_messages': errors,
+    }
+
+
+def run_concurrency_benchmark(postgres_url: str = None, workers: int = 4, seconds: float = 10,
+                              write_ratio: float = 0.2, rows: int = 10000,
+                              modes: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Compare database modes under concurrent worker processes.
+
+    Each worker process (like a gunicorn worker) loops over dashboard reads
+    and deployment inserts/updates for a fixed time.
+
+    Args:
+        postgres_url: Scratch PostgreSQL database; its bench_deployments
+            table is created and dropped (PostgreSQL is skipped without it)
+        workers: Concurrent processes
+        seconds: Duration per mode
+        write_ratio: Fraction of operations that write
+        rows: Rows in the table before the run
+        modes: Subset of CONCURRENCY_MODES to run
+
+    Returns:
+        Dict of per-mode throughput, latency percentiles and errors
+    """
+    modes = modes or [mode for mode in CONCURRENCY_MODES if mode != 'postgresql' or postgres_url]
+    report = {'workers': workers, 'seconds': seconds, 'write_ratio': write_ratio, 'modes': {}}
+    scratch = tempfile.mkdtemp(prefix='deployer-bench-')
+    try:
+        for mode in modes:
+            if mode == 'postgresql':
+                url = normalize_database_url(postgres_url)
+            else:
+                url = f"sqlite:///{os.path.join(scratch, mode + '.db')}"
+            report['modes'][mode] = _run_mode(url, mode, workers, seconds, write_ratio, rows)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return report
@@ -0,0 +1,160 @@
+"""
+Deployment Listing
+Filtered, keyset-paginated deployment queries with optional field
+selection, shared by the deployments page, the API and the NDJSON export.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+
+from sqlalchemy import or_, and_
+
+from app.models import Deployment, ConfigBlob
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+# Every field of Deployment.to_dict(), in order
+DEPLOYMENT_FIELDS = (
+    'id', 'connection_id', 'server_key', 'server_name', 'deployment_type', 'node', 'vmid',
+    'ip_address', 'status', 'error_message', 'config_hash', 'game_layer_id', 'config_snapshot',
+    'created_at', 'updated_at'
+)
+
+# Filters accepted from query strings (comma-separated values match any)
+FILTER_FIELDS = ('status', 'node', 'server_key', 'connection_id', 'deployment_type', 'config_hash',
+                 'game_layer_id')
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """
+    Parse a 'fields' parameter into Deployment field names.
+
+    Raises:
+        ValueError: If a field does not exist
+    """
+    if not value:
+        return list(DEPLOYMENT_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in DEPLOYMENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def filter_deployments(args) -> Any:
+    """
+    Build a deployment query from request arguments.
+
+    Raises:
+        ValueError: If connection_id is not a number
+    """
+    query = Deployment.query
+    for field in FILTER_FIELDS:
+        if not args.get(field):
+            continue
+        values = [value for value in str(args[field]).split(',') if value]
+        if field == 'connection_id':
+            if not all(value.strip().isdigit() for value in values):
+                raise ValueError('connection_id must be a number or comma-separated numbers')
+            values = [int(value) for value in values]
+        query = query.filter(getattr(Deployment, field).in_(values))
+    return query
+
+
+def encode_cursor(created_at: datetime, deployment_id: int) -> str:
+    """Opaque cursor pointing after a row in (created_at desc, id desc) order."""
+    raw = json.dumps([created_at.isoformat() if created_at else None, deployment_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """
+    Decode a cursor from encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, deployment_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(deployment_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def _after(query, cursor: Optional[str]):
+    """Order newest first and skip everything up to the cursor."""
+    query = query.order_by(Deployment.created_at.desc().nulls_last(), Deployment.id.desc())
+    if not cursor:
+        return query
+    created_at, deployment_id = decode_cursor(cursor)
+    if created_at is None:
+        # Rows without a timestamp sort last; only the id decides among them
+        return query.filter(Deployment.created_at.is_(None), Deployment.id < deployment_id)
+    return query.filter(or_(
+        Deployment.created_at < created_at,
+        and_(Deployment.created_at == created_at, Deployment.id < deployment_id),
+        Deployment.created_at.is_(None)
+    ))
+
+
+def page_deployments(query, limit: int = DEFAULT_PAGE_SIZE,
+                     cursor: str = None) -> Tuple[List[Deployment], Optional[str]]:
+    """
+    Get one page of deployment models; config snapshots load on first access.
+
+    Returns:
+        (deployments, cursor for the next page or None on the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = _after(query, cursor).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.created_at, last.id)
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def page_deployment_dicts(query, fields: List[str], limit: int = DEFAULT_PAGE_SIZE,
+                          cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get one page of deployments as dicts holding only the requested fields.
+
+    Only the selected columns are read from the database, so leaving out
+    config_snapshot skips joining the config blobs entirely.
+
+    Returns:
+        (rows, cursor for the next page or None on the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = list(dict.fromkeys(fields + ['id', 'created_at']))
+    entities = [
+        ConfigBlob.data.label(c) if c == 'config_snapshot' else getattr(Deployment, c) for c in columns
+    ]
+    query = query.with_entities(*entities)
+    if 'config_snapshot' in columns:
+        query = query.outerjoin(ConfigBlob, ConfigBlob.hash == Deployment.config_hash)
+    rows = _after(query, cursor).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [{field: _serialize(getattr(row, field)) for field in fields} for row in rows], next_cursor
+
+
+def iter_deployment_dicts(query, fields: List[str], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yield every matching deployment, fetching one keyset page at a time."""
+    cursor = None
+    while True:
+        rows, cursor = page_deployment_dicts(query, fields, batch_size, cursor)
+        yield from rows
+        if not cursor:
+            return
@@ -0,0 +1,75 @@
+"""
+Node-local SteamCMD Depot Cache
+One directory per Steam app on each Proxmox node, bind-mounted into game
+containers on that node. The first install of an app on a node seeds it; every later
+install copies it into place instead of downloading the depot again.
+"""
+
+from typing import Dict, Any, List
+
+from app.proxmox_client import ProxmoxClient
+
+DEPOT_CACHE_ROOT = '/var/lib/gameserver-depots'
+DEPOT_MOUNT_POINT = '/mnt/depot-cache'
+
+# Root inside an unprivileged container is this uid/gid on the host
+UNPRIVILEGED_ROOT_ID = 100000
+
+
+def depot_path(steam_app_id: str) -> str:
+    """Host directory holding the cached depot for a Steam app."""
+    return f'{DEPOT_CACHE_ROOT}/{int(steam_app_id)}'
+
+
+def depot_mount(steam_app_id: str) -> Dict[str, str]:
+    """Bind mount entry for create_lxc's 'mounts' config."""
+    return {'source': depot_path(steam_app_id), 'target': DEPOT_MOUNT_POINT}
+
+
+def prepare_depot_cache(client: ProxmoxClient, node: str, steam_app_id: str,
+                        privileged: bool = False) -> Dict[str, Any]:
+    """
+    Create a node's directory for an app's depot, writable by container root.
+
+    Args:
+        client: ProxmoxClient for the node's connection (needs password auth)
+        node: Node the container will run on
+        steam_app_id: Steam app ID from the game definition
+        privileged: Whether the containers mounting it are privileged
+    """
+    path = depot_path(steam_app_id)
+    owner = 0 if privileged else UNPRIVILEGED_ROOT_ID
+    return client.exec_on_node(node, f'mkdir -p {path} && chown {owner}:{owner} {path}')
+
+
+def list_depot_caches(client: ProxmoxClient, node: str) -> Dict[str, Any]:
+    """
+    List the depots cached on a node.
+
+    Returns:
+        Dict with a 'depots' list of app ID, size in bytes and whether it is complete
+    """
+    script = (
+        f'for d in {DEPOT_CACHE_ROOT}/*/; do [ -d "$d" ] || continue; '
+        'printf "%s %s %s\\n" "$(basename "$d")" "$(du -sb "$d" | cut -f1)" '
+        '"$([ -f "$d/.complete" ] && echo 1 || echo 0)"; done'
+    )
+    result = client.exec_on_node(node, script)
+    if not result['success']:
+        return result
+
+    depots: List[Dict[str, Any]] = []
+    for line in (result.get('output') or '').splitlines():
+        parts = line.split()
+        if len(parts) == 3:
+            depots.append({
+                'steam_app_id': parts[0],
+                'size': int(parts[1]),
+                'complete': parts[2] == '1',
+            })
+    return {'success': True, 'depots': depots, 'total_size': sum(d['size'] for d in depots)}
+
+
+def purge_depot_cache(client: ProxmoxClient, node: str, steam_app_id: str) -> Dict[str, Any]:
+    """Delete a node's cached depot; the next install of the app there re-seeds it."""
+    return client.exec_on_node(node, f'rm -rf {depot_path(steam_app_id)}')
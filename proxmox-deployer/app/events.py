@@ -0,0 +1,246 @@
+"""
+Deployment Event Log
+Every deployment status transition, plus explicit events such as create and
+provision results, appended to the deployment_events table. Events are
+queued in memory and written in batches by a background thread, so hot
+paths never pay for an extra commit. Whatever is still queued is written
+when the process exits.
+"""
+
+import atexit
+import logging
+import queue
+import signal
+import sys
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Deployment, DeploymentEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EventWriter:
+    """
+    Background thread that inserts queued events in batches.
+
+    A batch that fails to insert is logged and tried once more on the next
+    flush, then dropped and counted in dropped. close() writes what is left
+    at exit.
+    """
+
+    def __init__(self, engine, batch_size: int = 100, interval: float = 1.0):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._retry = []
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+            _exit_on_sigterm()
+
+    def enqueue(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write(self, rows: List[Dict[str, Any]], retry: bool = True) -> bool:
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(DeploymentEvent.__table__.insert(), rows)
+        except Exception as e:
+            if retry:
+                logger.warning('Writing %d deployment events failed, will retry: %s', len(rows), e)
+                self._retry.append(rows)
+            else:
+                logger.error('Writing %d deployment events failed again, dropping them: %s', len(rows), e)
+                self.dropped += len(rows)
+            return False
+        self.written += len(rows)
+        self.batches += 1
+        return True
+
+    def flush(self):
+        """Write everything queued so far (e.g. before reading the log)."""
+        with self._lock:
+            retry, self._retry = self._retry, []
+            for rows in retry:
+                self._write(rows, retry=False)
+            while True:
+                rows = self._drain(self.batch_size)
+                # Leave the rest queued while the database is failing
+                if not rows or not self._write(rows):
+                    return
+
+    def close(self):
+        """Write everything still queued before the process exits."""
+        self.flush()
+        # There is no next flush, so failed batches get their retry now
+        if self._retry:
+            self.flush()
+        unwritten = self.stats()['queued']
+        if unwritten:
+            logger.error('Exiting with %d deployment events unwritten', unwritten)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self._queue.qsize() + sum(len(rows) for rows in self._retry),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+        }
+
+
+_writer: Optional[EventWriter] = None
+
+
+def _exit_on_sigterm():
+    """
+    Turn SIGTERM into a normal exit, so atexit handlers (and the writer's
+    close) run. Servers that handle SIGTERM themselves, like gunicorn, are
+    left alone; their workers already exit normally.
+    """
+    if threading.current_thread() is threading.main_thread() \
+            and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def start_event_writer(engine, batch_size: int = 100, interval: float = 1.0) -> EventWriter:
+    """Start the process-wide event writer and record status transitions through it."""
+    global _writer
+    if _writer is None:
+        _writer = EventWriter(engine, batch_size, interval)
+        _writer.start()
+        event.listen(Session, 'before_flush', _capture_transitions)
+        event.listen(Session, 'after_flush', _resolve_ids)
+        event.listen(Session, 'after_commit', _publish)
+        event.listen(Session, 'after_rollback', _discard)
+    return _writer
+
+
+def get_event_writer() -> Optional[EventWriter]:
+    return _writer
+
+
+def _row(deployment_id: int, name: str, from_status: str = None, to_status: str = None,
+         message: str = None, payload: Dict[str, Any] = None) -> Dict[str, Any]:
+    return {
+        'deployment_id': deployment_id,
+        'event': name,
+        'from_status': from_status,
+        'to_status': to_status,
+        'message': message,
+        'payload': payload or None,
+        'created_at': datetime.utcnow(),
+    }
+
+
+def record_event(deployment_id: int, name: str, message: str = None, **payload):
+    """Queue an explicit event for a deployment."""
+    if _writer:
+        _writer.enqueue([_row(deployment_id, name, message=message, payload=payload)])
+
+
+def record_status(deployment: Deployment, status: str, vmid: int = None):
+    """
+    Queue a status change without writing it to the deployment, for requests
+    that pass through several statuses but save the deployment once at the end.
+    """
+    if _writer:
+        _writer.enqueue([_row(deployment.id, 'status', deployment.status, status,
+                              payload={'vmid': vmid} if vmid else None)])
+
+
+def _transition(deployment: Deployment, old: Optional[str], new: str) -> Dict[str, Any]:
+    row = _row(deployment.id, 'status', old, new, message=deployment.error_message,
+               payload={'vmid': deployment.vmid} if deployment.vmid else None)
+    row['deployment'] = deployment
+    return row
+
+
+def _capture_transitions(session, flush_context, instances):
+    """Note each deployment whose status is about to change (before deleted rows are gone)."""
+    pending = session.info.setdefault('deployment_transitions', [])
+    for deployment in session.new:
+        if isinstance(deployment, Deployment):
+            pending.append(_transition(deployment, None, deployment.status or 'pending'))
+    for deployment in session.deleted:
+        if isinstance(deployment, Deployment):
+            pending.append(_transition(deployment, deployment.status, 'deleted'))
+    for deployment in session.dirty:
+        if not isinstance(deployment, Deployment) or deployment in session.deleted:
+            continue
+        history = inspect(deployment).attrs.status.history
+        old = history.deleted[0] if history.deleted else None
+        if history.has_changes() and old != deployment.status:
+            pending.append(_transition(deployment, old, deployment.status))
+
+
+def _resolve_ids(session, flush_context):
+    """Fill in the IDs of deployments inserted by the flush."""
+    rows = session.info.setdefault('deployment_events', [])
+    for row in session.info.pop('deployment_transitions', []):
+        deployment = row.pop('deployment')
+        if row['deployment_id'] is None:
+            row['deployment_id'] = deployment.id
+        rows.append(row)
+
+
+def _publish(session):
+    rows = session.info.pop('deployment_events', None)
+    if rows and _writer:
+        _writer.enqueue(rows)
+
+
+def _discard(session):
+    session.info.pop('deployment_transitions', None)
+    session.info.pop('deployment_events', None)
+
+
+def get_events(deployment_id: int = None, after_id: int = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Read the event log, oldest first.
+
+    Args:
+        deployment_id: Only this deployment's events
+        after_id: Only events after this one (for tailing the log)
+        limit: Maximum events
+    """
+    if _writer:
+        _writer.flush()
+    query = DeploymentEvent.query
+    if deployment_id:
+        query = query.filter_by(deployment_id=deployment_id)
+    if after_id:
+        query = query.filter(DeploymentEvent.id > after_id)
+    return [e.to_dict() for e in query.order_by(DeploymentEvent.id).limit(max(1, min(limit, 1000))).all()]
@@ -0,0 +1,244 @@
+"""
+Fleet Updates
+Rolls a Steam patch out to every LinuxGSM deployment of a game on a node:
+one container downloads the build and stages it in the node's depot cache,
+then the rest copy it from there in waves, with a concurrency limit and a
+health check after each server.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List
+
+from app import db
+from app.models import Deployment, FleetUpdate
+from app.proxmox_client import ProxmoxClient, detached_connection
+from app.game_servers import get_server
+from app.install_scripts import get_install_scripts
+
+LGSM = 'sudo -u gameserver /home/gameserver/{name}'
+
+# Stager: download the patch, then refresh the node's depot cache from it
+STAGE_COMMAND = (
+    "bash -c '" + LGSM + " update && "
+    "if [ -d /mnt/depot-cache ]; then "
+    "cp -a --reflink=auto -u /home/gameserver/serverfiles/. /mnt/depot-cache/ && "
+    "touch /mnt/depot-cache/.complete; fi'"
+)
+
+# Containers with the depot cache mounted copy the staged build, so the
+# LinuxGSM update only validates; others download it themselves
+STAGED_UPDATE_COMMAND = (
+    "bash -c '" + LGSM + " stop; "
+    "cp -a --reflink=auto -u /mnt/depot-cache/. /home/gameserver/serverfiles/ && "
+    "rm -f /home/gameserver/serverfiles/.complete /home/gameserver/serverfiles/.lock && "
+    "chown -R gameserver:gameserver /home/gameserver/serverfiles && "
+    + LGSM + " update && " + LGSM + " start'"
+)
+DIRECT_UPDATE_COMMAND = "bash -c '" + LGSM + " update'"
+
+HEALTH_COMMAND = LGSM + ' monitor'
+
+
+def _linuxgsm_name(server_key: str):
+    """LinuxGSM script name for games installed with a LinuxGSM recipe."""
+    recipe = get_install_scripts().get(server_key) or {}
+    return recipe.get('linuxgsm_name') if recipe.get('type') == 'linuxgsm' else None
+
+
+def plan_fleet_updates(connection_id: int = None, steam_app_id: str = None,
+                       server_key: str = None) -> List[Dict[str, Any]]:
+    """
+    Group running LinuxGSM deployments by node and Steam app.
+
+    Returns:
+        List of groups: connection_id, node, steam_app_id and deployment IDs
+    """
+    query = Deployment.query.filter_by(deployment_type='lxc', status='running')
+    if connection_id:
+        query = query.filter_by(connection_id=connection_id)
+    if server_key:
+        query = query.filter_by(server_key=server_key)
+
+    groups = {}
+    for deployment in query.order_by(Deployment.id).all():
+        server = get_server(deployment.server_key)
+        if not server or not server.steam_app_id or not deployment.vmid:
+            continue
+        if not _linuxgsm_name(deployment.server_key):
+            continue
+        if steam_app_id and str(server.steam_app_id) != str(steam_app_id):
+            continue
+        key = (deployment.connection_id, deployment.node, str(server.steam_app_id))
+        groups.setdefault(key, []).append(deployment.id)
+
+    return [
+        {'connection_id': conn_id, 'node': node, 'steam_app_id': app_id, 'deployments': ids}
+        for (conn_id, node, app_id), ids in groups.items()
+    ]
+
+
+def _update_one(client: ProxmoxClient, node: str, target: Dict[str, Any],
+                command: str, timeout: int) -> Dict[str, Any]:
+    """Run an update command in one container, then health-check it."""
+    started = time.time()
+    result = client.exec_in_container(node, target['vmid'], command.format(name=target['lgsm']), timeout=timeout)
+    outcome = {'deployment_id': target['id'], 'vmid': target['vmid'], 'staged': target['depot']}
+    if not result['success']:
+        return {**outcome, 'success': False, 'error': (result.get('error') or '').strip()[-500:],
+                'seconds': round(time.time() - started, 1)}
+
+    status = client.get_container_status(node, target['vmid'], 'lxc')
+    health = client.exec_in_container(node, target['vmid'], HEALTH_COMMAND.format(name=target['lgsm']), timeout=120)
+    healthy = status.get('status') == 'running' and health['success']
+    return {
+        **outcome,
+        'success': healthy,
+        'error': None if healthy else 'Health check failed after update',
+        'seconds': round(time.time() - started, 1)
+    }
+
+
+def run_fleet_update(update: FleetUpdate, max_failures: int = 0, timeout: int = 3600) -> FleetUpdate:
+    """
+    Execute a planned fleet update.
+
+    The first deployment with the depot cache mounted (or the first one) is
+    the stager. The rest are updated in waves of update.wave_size, at most
+    update.concurrency at a time. A wave with more than max_failures failed
+    servers halts the rollout.
+
+    Returns:
+        The FleetUpdate, with its per-wave report
+    """
+    plan = [
+        Deployment.query.get(deployment_id)
+        for deployment_id in (update.report or {}).get('deployments', [])
+    ]
+    targets = [
+        {
+            'id': deployment.id,
+            'vmid': deployment.vmid,
+            'lgsm': _linuxgsm_name(deployment.server_key),
+            'depot': bool((deployment.config_snapshot or {}).get('depot_cache')),
+        }
+        for deployment in plan
+        if deployment and deployment.vmid and _linuxgsm_name(deployment.server_key)
+    ]
+    report = {'deployments': [t['id'] for t in targets], 'waves': []}
+    update.status = 'running'
+    update.report = report
+    db.session.commit()
+
+    if not targets:
+        update.status = 'done'
+        update.finished_at = datetime.utcnow()
+        db.session.commit()
+        return update
+
+    connection = detached_connection(update.connection)
+    node = update.node
+    started = time.time()
+
+    # Stage: one download for the whole node
+    stager = next((t for t in targets if t['depot']), targets[0])
+    stage = _update_one(ProxmoxClient(connection), node, stager, STAGE_COMMAND, timeout)
+    report['stage'] = stage
+    if not stage['success']:
+        update.status = 'failed'
+        update.report = {**report, 'total_seconds': round(time.time() - started, 1)}
+        update.finished_at = datetime.utcnow()
+        db.session.commit()
+        return update
+
+    rest = [t for t in targets if t is not stager]
+    halted = False
+    for index in range(0, len(rest), max(1, update.wave_size)):
+        wave = rest[index:index + max(1, update.wave_size)]
+        wave_started = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, update.concurrency)) as pool:
+            results = list(pool.map(
+                lambda t: _update_one(
+                    ProxmoxClient(connection), node, t,
+                    STAGED_UPDATE_COMMAND if t['depot'] else DIRECT_UPDATE_COMMAND, timeout
+                ),
+                wave
+            ))
+        failed = sum(1 for r in results if not r['success'])
+        report['waves'].append({
+            'wave': len(report['waves']) + 1,
+            'seconds': round(time.time() - wave_started, 1),
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'results': results,
+        })
+        update.report = dict(report)
+        db.session.commit()
+        if failed > max_failures:
+            halted = True
+            break
+
+    # Record the outcome on each deployment
+    outcomes = [stage] + [r for wave in report['waves'] for r in wave['results']]
+    for outcome in outcomes:
+        deployment = Deployment.query.get(outcome['deployment_id'])
+        if deployment:
+            deployment.config_snapshot = {
+                **(deployment.config_snapshot or {}),
+                'last_update': {
+                    'fleet_update_id': update.id,
+                    'at': datetime.utcnow().isoformat(),
+                    'success': outcome['success'],
+                    'seconds': outcome['seconds'],
+                }
+            }
+
+    report['total_seconds'] = round(time.time() - started, 1)
+    update.report = report
+    update.status = 'halted' if halted else 'done'
+    update.finished_at = datetime.utcnow()
+    db.session.commit()
+    return update
+
+
+def create_fleet_updates(groups: List[Dict[str, Any]], wave_size: int = 5,
+                         concurrency: int = 2) -> List[FleetUpdate]:
+    """Record one pending FleetUpdate per planned group."""
+    updates = []
+    for group in groups:
+        update = FleetUpdate(
+            connection_id=group['connection_id'],
+            node=group['node'],
+            steam_app_id=group['steam_app_id'],
+            wave_size=wave_size,
+            concurrency=concurrency,
+            status='pending',
+            report={'deployments': group['deployments']}
+        )
+        db.session.add(update)
+        updates.append(update)
+    db.session.commit()
+    return updates
+
+
+def start_fleet_updates(app, update_ids: List[int], max_failures: int = 0) -> threading.Thread:
+    """Run fleet updates one after another on a background thread."""
+    def run():
+        with app.app_context():
+            for update_id in update_ids:
+                update = FleetUpdate.query.get(update_id)
+                try:
+                    run_fleet_update(update, max_failures=max_failures)
+                except Exception as e:
+                    db.session.rollback()
+                    update.status = 'failed'
+                    update.report = {**(update.report or {}), 'error': str(e)}
+                    update.finished_at = datetime.utcnow()
+                    db.session.commit()
+            db.session.remove()
+
+    thread = threading.Thread(target=run, name='fleet-update', daemon=True)
+    thread.start()
+    return thread
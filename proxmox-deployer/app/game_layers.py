@@ -0,0 +1,165 @@
+"""
+Shared Game Install Layers
+A read-only copy of a game's server files on a Proxmox node, mounted into
+every container of that game on the node. Each container overlays its own
+writable upper directory, so replicas share one copy on disk and in the
+page cache.
+"""
+
+from typing import Optional, Dict, Any, Iterable
+
+from sqlalchemy import inspect, select, update, func
+
+from app import db
+from app.models import GameLayer, Deployment, ConfigBlob
+from app.proxmox_client import ProxmoxClient
+from app.depot_cache import depot_path
+
+LAYER_ROOT = '/var/lib/gameserver-layers'
+LAYER_MOUNT_POINT = '/mnt/game-layer'
+
+# Root disk for a container whose game files live in a shared layer
+# (holds the OS, configs, saves and files changed by updates)
+MIN_LAYERED_DISK_SIZE = 8
+
+
+def layer_mount(layer: GameLayer) -> Dict[str, Any]:
+    """Read-only bind mount entry for create_lxc's 'mounts' config."""
+    return {'source': layer.path, 'target': LAYER_MOUNT_POINT, 'read_only': True}
+
+
+def layered_disk_size(disk_size: int, layer: GameLayer) -> int:
+    """Shrink a game's root disk by the size of the files the layer provides."""
+    layer_gb = (layer.size or 0) // (1024 ** 3)
+    return max(MIN_LAYERED_DISK_SIZE, disk_size - layer_gb)
+
+
+def _exec(client: ProxmoxClient, layer: GameLayer, command: str, timeout: int = 60) -> Dict[str, Any]:
+    """Run a command on the layer's node (the connection's host for untracked old layers)."""
+    if layer.node:
+        return client.exec_on_node(layer.node, command, timeout=timeout)
+    return client.exec_on_host(command, timeout=timeout)
+
+
+def get_game_layer(connection_id: int, node: str, steam_app_id: str) -> Optional[GameLayer]:
+    """Get the newest ready layer for a Steam app on a node."""
+    return GameLayer.query.filter_by(
+        connection_id=connection_id,
+        node=node,
+        steam_app_id=str(steam_app_id),
+        status='ready'
+    ).order_by(GameLayer.version.desc()).first()
+
+
+def build_game_layer(connection, node: str, steam_app_id: str) -> GameLayer:
+    """
+    Snapshot an app's completed depot cache on a node into a new read-only layer version.
+
+    Containers keep the version they were created with (an overlay's lower
+    directory must not change underneath it), so a layer is never updated
+    in place.
+
+    Returns:
+        The GameLayer record ('ready' or 'failed')
+    """
+    steam_app_id = str(int(steam_app_id))
+    latest = GameLayer.query.filter_by(
+        connection_id=connection.id, node=node, steam_app_id=steam_app_id
+    ).order_by(GameLayer.version.desc()).first()
+    version = (latest.version + 1) if latest else 1
+
+    layer = GameLayer(
+        connection_id=connection.id,
+        node=node,
+        steam_app_id=steam_app_id,
+        version=version,
+        path=f'{LAYER_ROOT}/{steam_app_id}/v{version}',
+        status='building'
+    )
+    db.session.add(layer)
+    db.session.commit()
+
+    source = depot_path(steam_app_id)
+    client = ProxmoxClient(connection)
+    result = _exec(
+        client, layer,
+        f'[ -f {source}/.complete ] || {{ echo "Depot cache for {steam_app_id} is not seeded" >&2; exit 1; }}; '
+        f'mkdir -p {layer.path} && cp -a --reflink=auto {source}/. {layer.path}/ && '
+        f'rm -f {layer.path}/.complete {layer.path}/.lock && du -sb {layer.path} | cut -f1',
+        timeout=7200
+    )
+    if not result['success']:
+        _exec(client, layer, f'rm -rf {layer.path}')
+        layer.status = 'failed'
+        layer.error_message = (result.get('error') or '').strip() or 'Layer build failed'
+        db.session.commit()
+        return layer
+
+    layer.size = int((result.get('output') or '0').split()[0])
+    layer.status = 'ready'
+    db.session.commit()
+    return layer
+
+
+def layer_user_counts(layer_ids: Iterable[int]) -> Dict[int, int]:
+    """Count the deployments whose containers mount each layer (one indexed query)."""
+    layer_ids = list(layer_ids)
+    if not layer_ids:
+        return {}
+    rows = db.session.query(Deployment.game_layer_id, func.count(Deployment.id)).filter(
+        Deployment.game_layer_id.in_(layer_ids)
+    ).group_by(Deployment.game_layer_id).all()
+    return dict(rows)
+
+
+def delete_game_layer(layer: GameLayer) -> Dict[str, Any]:
+    """Delete a layer version that no container uses any more."""
+    users = layer_user_counts([layer.id]).get(layer.id, 0)
+    if users:
+        return {'success': False, 'error': f'Layer is mounted by {users} deployment(s)'}
+    if layer.path:
+        result = _exec(ProxmoxClient(layer.connection), layer, f'rm -rf {layer.path}')
+        if not result['success']:
+            return result
+    db.session.delete(layer)
+    db.session.commit()
+    return {'success': True}
+
+
+def track_layer_nodes(conn) -> int:
+    """
+    Add game_layers.node and deployments.game_layer_id to existing tables
+    and fill them in from the layer ids in deployment configs.
+
+    Layers built before nodes were tracked live on the connection's host;
+    the node of the deployments mounting one tells which node that is.
+
+    Returns:
+        Deployments linked to their layer
+    """
+    layer_columns = {column['name'] for column in inspect(conn).get_columns('game_layers')}
+    if 'node' not in layer_columns:
+        conn.exec_driver_sql('ALTER TABLE game_layers ADD COLUMN node VARCHAR(100)')
+    conn.exec_driver_sql('CREATE UNIQUE INDEX IF NOT EXISTS uq_game_layers_node_version '
+                         'ON game_layers (connection_id, node, steam_app_id, version)')
+    deployment_columns = {column['name'] for column in inspect(conn).get_columns('deployments')}
+    if 'game_layer_id' not in deployment_columns:
+        conn.exec_driver_sql('ALTER TABLE deployments ADD COLUMN game_layer_id INTEGER '
+                             'REFERENCES game_layers (id)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_deployments_game_layer_id ON deployments (game_layer_id)')
+
+    deployments, layers, blobs = Deployment.__table__, GameLayer.__table__, ConfigBlob.__table__
+    rows = conn.execute(
+        select(deployments.c.id, deployments.c.node, blobs.c.data)
+        .join(blobs, blobs.c.hash == deployments.c.config_hash)
+        .where(deployments.c.game_layer_id.is_(None))
+    ).all()
+    linked = 0
+    for deployment_id, node, data in rows:
+        layer_id = (data or {}).get('game_layer_id')
+        if not layer_id:
+            continue
+        conn.execute(update(deployments).where(deployments.c.id == deployment_id).values(game_layer_id=layer_id))
+        conn.execute(update(layers).where(layers.c.id == layer_id, layers.c.node.is_(None)).values(node=node))
+        linked += 1
+    return linked
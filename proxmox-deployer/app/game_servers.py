@@ -3,6 +3,11 @@ Game Server Definitions for Proxmox Deployer
 Comprehensive catalog of 250+ deployable game servers with configuration templates.
 """
 
+import sys
+from types import MappingProxyType
+
+from app.catalog import CatalogIndex
+
 # Server categories for organization
 CATEGORIES = {
     'source': {'name': 'Source Engine', 'icon': 'cpu', 'color': '#ff9800'},
@@ -21,31 +26,96 @@ CATEGORIES = {
     'voice': {'name': 'Voice & Communication', 'icon': 'mic', 'color': '#6366f1'},
 }
 
+# Shared tuples so identical port/tag lists are stored once
+_SHARED = {}
+
+def _shared(values):
+    """Return a canonical shared tuple for a sequence of values."""
+    value = tuple(sys.intern(v) if isinstance(v, str) else v for v in values)
+    return _SHARED.setdefault(value, value)
+
+def _frozen_env_var(env):
+    """Freeze an env var definition into a read-only mapping."""
+    return MappingProxyType({sys.intern(k): v for k, v in env.items()})
+
+
+class ServerDef:
+    """Immutable game server definition shared by every request and thread."""
+
+    __slots__ = (
+        'name', 'hostname', 'description', 'category', 'deployment_type',
+        'steam_app_id', 'cores', 'memory', 'disk_size', 'ports', 'protocol',
+        'tags', 'icon', 'linuxgsm_name', 'docker_image', 'privileged',
+        'nesting', 'env_vars',
+    )
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            value = fields.pop(field, None)
+            if isinstance(value, str):
+                value = sys.intern(value)
+            object.__setattr__(self, field, value)
+        if fields:
+            raise TypeError(f"Unknown server fields: {', '.join(sorted(fields))}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'ServerDef is immutable (cannot set {name!r})')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'ServerDef is immutable (cannot delete {name!r})')
+
+    def __repr__(self):
+        return f'ServerDef({self.name!r})'
+
+    def __eq__(self, other):
+        if not isinstance(other, ServerDef):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.name, self.hostname, self.category))
+
+    def get(self, field, default=None):
+        """Dict-style field access for code that treats definitions as mappings."""
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def to_dict(self):
+        """Get a plain, JSON-serializable copy of this definition."""
+        result = {field: getattr(self, field) for field in self.__slots__}
+        result['ports'] = list(self.ports)
+        result['tags'] = list(self.tags)
+        result['env_vars'] = [dict(env) for env in self.env_vars]
+        return result
+
+    __json__ = to_dict
+
+
 # Helper function to create standard game server entry
 def _server(name, hostname, description, category, steam_app_id=None, cores=2, memory=4096,
             disk_size=20, ports=None, protocol='UDP/TCP', tags=None, icon='server',
-            linuxgsm_name=None, deployment_type='lxc'):
+            linuxgsm_name=None, deployment_type='lxc', env_vars=None):
     """Create a standard game server configuration."""
-    return {
-        'name': name,
-        'hostname': hostname,
-        'description': description,
-        'category': category,
-        'deployment_type': deployment_type,
-        'steam_app_id': steam_app_id,
-        'cores': cores,
-        'memory': memory,
-        'disk_size': disk_size,
-        'ports': ports or [27015],
-        'protocol': protocol,
-        'tags': tags or [category],
-        'icon': icon,
-        'linuxgsm_name': linuxgsm_name,
-        'docker_image': 'cm2network/steamcmd' if steam_app_id else None,
-        'privileged': False,
-        'nesting': True,
-        'env_vars': [],
-    }
+    return ServerDef(
+        name=name,
+        hostname=hostname,
+        description=description,
+        category=category,
+        deployment_type=deployment_type,
+        steam_app_id=steam_app_id,
+        cores=cores,
+        memory=memory,
+        disk_size=disk_size,
+        ports=_shared(ports or [27015]),
+        protocol=protocol,
+        tags=_shared(tags or [category]),
+        icon=icon,
+        linuxgsm_name=linuxgsm_name,
+        docker_image='cm2network/steamcmd' if steam_app_id else None,
+        privileged=False,
+        nesting=True,
+        env_vars=tuple(_frozen_env_var(env) for env in env_vars or ()),
+    )
 
 # Game server definitions - 250+ games
 GAME_SERVERS = {
@@ -536,39 +606,74 @@ GAME_SERVERS = {
                    cores=2, memory=4096, disk_size=30, ports=[8080]),
 }
 
+class CatalogSnapshot:
+    """A complete, immutable view of the catalog: entries, categories, indexes and stats."""
+
+    __slots__ = ('servers', 'categories', 'index', 'stats', 'version')
+
+    def __init__(self, servers, categories, version='builtin'):
+        self.servers = servers
+        self.categories = categories
+        self.index = CatalogIndex(servers)
+        self.stats = {
+            'total_servers': len(servers),
+            'categories': len(categories),
+            'by_category': self.index.category_counts,
+        }
+        self.version = version
+
+
+# The live catalog. Reloads build a new snapshot and swap this reference in one step.
+_catalog = CatalogSnapshot(GAME_SERVERS, CATEGORIES)
+
+def set_catalog(servers, categories, version):
+    """Atomically replace the live catalog (used by catalog file reloads)."""
+    global _catalog
+    _catalog = CatalogSnapshot(servers, categories, version)
+    return _catalog
+
+def get_catalog_version():
+    """Get the version identifier of the live catalog."""
+    return _catalog.version
+
 def get_server_by_key(key):
     """Get a server configuration by its key."""
-    return GAME_SERVERS.get(key)
+    return _catalog.servers.get(key)
+
+get_server = get_server_by_key
 
 def get_servers_by_category(category):
     """Get all servers in a category."""
-    return {k: v for k, v in GAME_SERVERS.items() if v.get('category') == category}
+    return dict(_catalog.index.by_category.get(category, {}))
+
+def get_servers_by_tag(tag):
+    """Get all servers with a tag."""
+    return dict(_catalog.index.by_tag.get(tag, {}))
+
+def get_servers_by_port(port):
+    """Get all servers listening on a port."""
+    return dict(_catalog.index.by_port.get(port, {}))
 
 def get_all_categories():
     """Get all category definitions."""
-    return CATEGORIES
+    return _catalog.categories
 
 def get_all_servers():
     """Get all server configurations."""
-    return GAME_SERVERS
+    return _catalog.servers
+
+def get_stats():
+    """Get catalog statistics."""
+    return _catalog.stats
 
-def search_servers(query):
-    """Search servers by name or description."""
-    query = query.lower()
-    results = {}
-    for key, server in GAME_SERVERS.items():
-        if query in key.lower() or query in server['name'].lower() or query in server.get('description', '').lower():
-            results[key] = server
-    return results
+def search_servers(query, limit=None):
+    """Search servers by key, name, description or tags, best matches first."""
+    return _catalog.index.search(query, limit=limit)
 
 def get_server_count():
     """Get total number of available servers."""
-    return len(GAME_SERVERS)
+    return len(_catalog.servers)
 
 def get_category_counts():
     """Get count of servers per category."""
-    counts = {}
-    for server in GAME_SERVERS.values():
-        cat = server.get('category', 'other')
-        counts[cat] = counts.get(cat, 0) + 1
-    return counts
+    return dict(_catalog.index.category_counts)
@@ -0,0 +1,293 @@
+"""
+Golden LXC Templates
+Builds pre-provisioned, per-game container archives so deploys restore a ready
+server instead of installing from a bare OS template.
+"""
+
+import threading
+import time
+from typing import Optional, List
+
+from flask import current_app
+from sqlalchemy import inspect
+
+from app import db
+from app.leases import acquire_lease, get_lease
+from app.models import GoldenTemplate
+from app.proxmox_client import ProxmoxClient
+from app.game_servers import get_server
+from app.install_scripts import render_install_script
+
+# Runs inside the build container before it is archived. Provisioning
+# checkpoints are kept on purpose, so deploys from the template skip every
+# step that was already baked in.
+GOLDEN_CLEANUP_SCRIPT = """#!/bin/bash
+set -e
+
+export DEBIAN_FRONTEND=noninteractive
+apt-get clean
+rm -rf /var/lib/apt/lists/* /tmp/* /var/tmp/*
+find /var/log -type f -exec truncate -s 0 {} +
+rm -f /root/.bash_history /home/gameserver/.bash_history
+
+# Give every container restored from this template its own identity
+truncate -s 0 /etc/machine-id
+rm -f /etc/ssh/ssh_host_*
+cat > /etc/systemd/system/regenerate-ssh-host-keys.service << 'EOF'
+[Unit]
+Description=Regenerate SSH host keys
+Before=ssh.service
+ConditionPathExists=!/etc/ssh/ssh_host_ed25519_key
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/ssh-keygen -A
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl enable regenerate-ssh-host-keys.service || true
+
+echo "Golden template cleanup complete"
+"""
+
+
+def get_golden_template(connection_id: int, node: str, server_key: str) -> Optional[GoldenTemplate]:
+    """Get the newest ready golden template for a game on a node."""
+    return GoldenTemplate.query.filter_by(
+        connection_id=connection_id,
+        node=node,
+        server_key=server_key,
+        status='ready'
+    ).order_by(GoldenTemplate.version.desc()).first()
+
+
+def prune_golden_templates(client: ProxmoxClient, connection_id: int, node: str,
+                           server_key: str, keep: int = 2) -> List[int]:
+    """
+    Delete all but the newest ready golden templates for a game on a node.
+
+    Returns:
+        IDs of the pruned template records
+    """
+    ready = GoldenTemplate.query.filter_by(
+        connection_id=connection_id,
+        node=node,
+        server_key=server_key,
+        status='ready'
+    ).order_by(GoldenTemplate.version.desc()).all()
+
+    pruned = []
+    for template in ready[keep:]:
+        result = client.delete_volume(node, template.storage, template.volid)
+        if result['success']:
+            pruned.append(template.id)
+            db.session.delete(template)
+    db.session.commit()
+    return pruned
+
+
+def golden_lease_key(connection_id: int, node: str, server_key: str) -> str:
+    """Lease key held while a game's golden template is built on a node."""
+    return f'golden-template:{int(connection_id)}:{node}:{server_key}'
+
+
+def new_golden_template(connection, node: str, server_key: str, base_template: str,
+                        backup_storage: str = 'local') -> GoldenTemplate:
+    """
+    Record the next golden template version for a game as building.
+
+    Call with the game's golden_lease_key held, so two builds never take
+    the same version number.
+    """
+    rendered = render_install_script(server_key, node=node, connection_id=connection.id)
+    latest = GoldenTemplate.query.filter_by(
+        connection_id=connection.id, node=node, server_key=server_key
+    ).order_by(GoldenTemplate.version.desc()).first()
+
+    template = GoldenTemplate(
+        connection_id=connection.id,
+        server_key=server_key,
+        node=node,
+        version=(latest.version + 1) if latest else 1,
+        base_template=base_template,
+        storage=backup_storage,
+        script_hash=rendered.content_hash if rendered else None,
+        status='building'
+    )
+    db.session.add(template)
+    db.session.commit()
+    return template
+
+
+def run_golden_build(template: GoldenTemplate, storage: str = 'local-lvm', bridge: str = 'vmbr0',
+                     keep: int = 2) -> GoldenTemplate:
+    """
+    Build a recorded golden template version.
+
+    Creates a throwaway container from the base OS template, runs the game's
+    install recipe, cleans it up, archives it with vzdump and destroys it.
+    The container's VMID is kept in build_vmid until it is destroyed.
+
+    Args:
+        template: GoldenTemplate record from new_golden_template
+        storage: Storage for the build container's root disk
+        bridge: Network bridge for the build container
+        keep: Number of ready versions to keep for this game and node
+
+    Returns:
+        The GoldenTemplate record ('ready' or 'failed')
+    """
+    connection, node, server_key = template.connection, template.node, template.server_key
+    backup_storage = template.storage
+    server = get_server(server_key)
+    rendered = render_install_script(server_key, node=node, connection_id=connection.id)
+
+    def fail(message):
+        template.status = 'failed'
+        template.error_message = message
+        db.session.commit()
+        return template
+
+    if not server or not rendered:
+        return fail(f'No install script available for {server_key}')
+    if server.deployment_type != 'lxc':
+        return fail(f'{server_key} is not an LXC game server')
+    if not connection.password:
+        return fail('Password authentication required for provisioning. API tokens cannot use SSH.')
+
+    client = ProxmoxClient(connection)
+    started = time.time()
+    result = client.create_lxc(node, {
+        'hostname': f'golden-{server_key}'.replace('_', '-')[:63],
+        'template': template.base_template,
+        'storage': storage,
+        'disk_size': server.disk_size,
+        'cores': server.cores,
+        'memory': server.memory,
+        'bridge': bridge,
+        'dhcp': True,
+        'start': True,
+        'onboot': False,
+        'privileged': server.privileged,
+        'nesting': server.nesting,
+    })
+    if not result['success']:
+        return fail(f"Create failed: {result.get('error')}")
+    vmid = result['vmid']
+    template.build_vmid = vmid
+    db.session.commit()
+
+    try:
+        # Give the container a moment to fully start
+        time.sleep(5)
+        provision = client.provision_container(node, vmid, rendered.script, timeout=3600)
+        if not provision['success']:
+            return fail(f"Provisioning failed: {provision.get('error')}")
+
+        cleanup = client.provision_container(node, vmid, GOLDEN_CLEANUP_SCRIPT, timeout=300)
+        if not cleanup['success']:
+            return fail(f"Cleanup failed: {cleanup.get('error')}")
+
+        client.stop_container(node, vmid, 'lxc')
+        client.wait_for_status(node, vmid, 'stopped')
+
+        backup = client.vzdump(
+            node, vmid, backup_storage,
+            notes=f'golden-{server_key}-v{template.version} ({rendered.content_hash[:12]})'
+        )
+        if not backup['success']:
+            return fail(f"Backup failed: {backup.get('error')}")
+
+        template.volid = backup['volid']
+        template.size = backup['size']
+        template.status = 'ready'
+        template.build_seconds = round(time.time() - started, 1)
+        db.session.commit()
+    finally:
+        client.stop_container(node, vmid, 'lxc')
+        client.wait_for_status(node, vmid, 'stopped', timeout=60)
+        if client.delete_container(node, vmid, 'lxc')['success']:
+            template.build_vmid = None
+            db.session.commit()
+
+    prune_golden_templates(client, connection.id, node, server_key, keep=keep)
+    return template
+
+
+def build_golden_template(connection, node: str, server_key: str, base_template: str,
+                          storage: str = 'local-lvm', backup_storage: str = 'local',
+                          bridge: str = 'vmbr0', keep: int = 2) -> Optional[GoldenTemplate]:
+    """
+    Build a new golden template version for a game, in the calling thread.
+
+    Args:
+        connection: ProxmoxConnection model instance (must use password auth)
+        node: Proxmox node to build on
+        server_key: Game server key with an install recipe
+        base_template: OS template volid to start from
+        storage: Storage for the build container's root disk
+        backup_storage: Storage that receives the archive
+        bridge: Network bridge for the build container
+        keep: Number of ready versions to keep for this game and node
+
+    Returns:
+        The GoldenTemplate record ('ready' or 'failed'), or None if the game
+        is already being built on this node
+    """
+    lease = acquire_lease(golden_lease_key(connection.id, node, server_key), 'golden-build',
+                          ttl=current_app.config['LEASE_TTL'])
+    if not lease:
+        return None
+    with lease:
+        template = new_golden_template(connection, node, server_key, base_template, backup_storage)
+        return run_golden_build(template, storage=storage, bridge=bridge, keep=keep)
+
+
+def start_golden_build(app, template_id: int, lease, storage: str = 'local-lvm',
+                       bridge: str = 'vmbr0', keep: int = 2) -> threading.Thread:
+    """Run a recorded build on a background thread, releasing its lease when done."""
+    def run():
+        with app.app_context(), lease:
+            template = GoldenTemplate.query.get(template_id)
+            try:
+                run_golden_build(template, storage=storage, bridge=bridge, keep=keep)
+            except Exception as e:
+                db.session.rollback()
+                template.status = 'failed'
+                template.error_message = str(e)
+                db.session.commit()
+            db.session.remove()
+
+    thread = threading.Thread(target=run, name='golden-template', daemon=True)
+    thread.start()
+    return thread
+
+
+def fail_interrupted_builds() -> int:
+    """
+    Mark builds left 'building' by a worker that stopped as failed.
+
+    A running build holds its lease, so only records whose lease has
+    expired are touched. Their build container, if any, is left in
+    build_vmid and destroyed when the record is deleted.
+
+    Returns:
+        Records marked failed
+    """
+    failed = 0
+    for template in GoldenTemplate.query.filter_by(status='building').all():
+        if get_lease(golden_lease_key(template.connection_id, template.node, template.server_key)):
+            continue
+        template.status = 'failed'
+        template.error_message = 'Build interrupted: the worker running it stopped'
+        failed += 1
+    db.session.commit()
+    return failed
+
+
+def track_build_vmids(conn):
+    """Add golden_templates.build_vmid to existing tables."""
+    columns = {column['name'] for column in inspect(conn).get_columns('golden_templates')}
+    if 'build_vmid' not in columns:
+        conn.exec_driver_sql('ALTER TABLE golden_templates ADD COLUMN build_vmid INTEGER')
@@ -0,0 +1,91 @@
+"""
+Pre-serialized HTTP Responses
+JSON payloads that are encoded and compressed once, then served with strong
+ETags and Accept-Encoding negotiation.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Any, Dict
+
+from flask import Response, request
+
+# Try to import brotli for br content-encoding
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+def _json_default(obj):
+    """Serialize objects that provide a __json__ method (e.g. ServerDef)."""
+    if hasattr(obj, '__json__'):
+        return obj.__json__()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class CachedPayload:
+    """A JSON document serialized once, with gzip and brotli variants."""
+
+    __slots__ = ('body', 'etag', 'encoded')
+
+    def __init__(self, data: Any, fast: bool = False):
+        """
+        Serialize and compress a JSON document.
+
+        Args:
+            data: JSON-serializable document
+            fast: Use quicker compression settings (for short-lived payloads)
+        """
+        self.body = json.dumps(data, separators=(',', ':'), default=_json_default).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+
+        # content-encoding -> (compressed body, strong etag of that representation)
+        self.encoded: Dict[str, tuple] = {}
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            if HAS_BROTLI:
+                self.encoded['br'] = (
+                    brotli.compress(self.body, quality=5 if fast else 11),
+                    f'{self.etag}-br'
+                )
+            self.encoded['gzip'] = (
+                gzip.compress(self.body, compresslevel=6 if fast else 9, mtime=0),
+                f'{self.etag}-gz'
+            )
+
+    def _choose_encoding(self):
+        """Pick the best encoding the client accepts, or None for identity."""
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in self.encoded:
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def response(self, status: int = 200) -> Response:
+        """Build a response for the current request, honouring If-None-Match."""
+        encoding = self._choose_encoding()
+        if encoding:
+            body, etag = self.encoded[encoding]
+        else:
+            body, etag = self.body, self.etag
+
+        # Any representation of this document is still current
+        known = [self.etag] + [tag for _, tag in self.encoded.values()]
+        if any(request.if_none_match.contains(tag) for tag in known):
+            response = Response(status=304)
+        else:
+            response = Response(body, status=status, mimetype='application/json')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
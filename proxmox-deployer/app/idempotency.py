@@ -0,0 +1,159 @@
+"""
+Idempotency Keys
+Clients send an Idempotency-Key header with deploys, provisions and other
+mutating requests. The first request with a key runs and its response is
+stored for a while; a retry with the same key and body waits for the
+first one to finish (on any worker) and gets the same response back,
+instead of starting the work on the cluster a second time.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Optional
+
+from flask import current_app, jsonify, request
+from sqlalchemy import delete, select
+
+from app import db
+from app.leases import acquire_lease
+from app.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 200
+
+
+def _request_hash() -> str:
+    """Hash the method, path and (normalized JSON) body of the current request."""
+    body = request.get_json(silent=True)
+    if body is None:
+        payload = request.get_data()
+    else:
+        payload = json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+def _load(key: str):
+    """Read a key's unexpired record on its own connection, outside the request's session."""
+    table = IdempotencyKey.__table__
+    with db.engine.connect() as conn:
+        return conn.execute(
+            select(table).where(table.c.key == key, table.c.expires_at > datetime.utcnow())
+        ).first()
+
+
+def _replay(record):
+    response = current_app.response_class(
+        record.response_body, status=record.response_status, mimetype=record.response_mimetype
+    )
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _mismatch():
+    return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used with a different request'}), 422
+
+
+def _begin(key: str, request_hash: str, ttl: float):
+    """Record the key as in progress, replacing an expired or abandoned record."""
+    table = IdempotencyKey.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.key == key))
+        conn.execute(table.insert().values(
+            key=key, request_hash=request_hash, status='in_progress',
+            created_at=now, expires_at=now + timedelta(seconds=ttl)
+        ))
+
+
+def _finish(key: str, response, ttl: float):
+    """Store the response for retries, or forget the key if it should not be replayed."""
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as conn:
+        # Conflicts and server errors are worth retrying for real
+        if response.status_code == 409 or response.status_code >= 500:
+            conn.execute(delete(table).where(table.c.key == key))
+            return
+        conn.execute(table.update().where(table.c.key == key).values(
+            status='done',
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True),
+            response_mimetype=response.mimetype,
+            expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+        ))
+
+
+def idempotent(view):
+    """
+    Make a route safe to retry with an Idempotency-Key header.
+
+    Without the header the route runs as usual. With it:
+    - a stored response for the key is returned as is (Idempotent-Replayed: true)
+    - a request still running with the key is waited for, up to IDEMPOTENCY_WAIT
+      seconds, then its response is returned
+    - reusing the key for a different request is rejected with 422
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+        config = current_app.config
+        request_hash = _request_hash()
+        record = _load(key)
+        if record and record.request_hash != request_hash:
+            return _mismatch()
+        if record and record.status == 'done':
+            return _replay(record)
+
+        # Whoever holds the lease runs the request; retries queue behind it
+        lease = acquire_lease(f'idempotency:{key}', view.__name__, ttl=config['LEASE_TTL'],
+                              wait=config['IDEMPOTENCY_WAIT'])
+        if not lease:
+            response = jsonify({'error': f'A request with this {IDEMPOTENCY_HEADER} is still running'})
+            response.headers['Retry-After'] = '30'
+            return response, 409
+
+        with lease:
+            record = _load(key)
+            if record and record.request_hash != request_hash:
+                return _mismatch()
+            if record and record.status == 'done':
+                return _replay(record)
+
+            # No record, or one left in progress by a worker that died
+            _begin(key, request_hash, config['IDEMPOTENCY_TTL'])
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except Exception:
+                _finish(key, current_app.response_class(status=500), config['IDEMPOTENCY_TTL'])
+                raise
+            _finish(key, response, config['IDEMPOTENCY_TTL'])
+            return response
+
+    return wrapper
+
+
+def get_idempotency_key(key: str) -> Optional[IdempotencyKey]:
+    """Get a key's unexpired record."""
+    return IdempotencyKey.query.filter(
+        IdempotencyKey.key == key, IdempotencyKey.expires_at > datetime.utcnow()
+    ).first()
+
+
+def purge_expired_keys() -> int:
+    """
+    Delete expired idempotency keys.
+
+    Returns:
+        Keys deleted
+    """
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as conn:
+        return conn.execute(delete(table).where(table.c.expires_at <= datetime.utcnow())).rowcount
@@ -3,6 +3,13 @@ Game Server Installation Scripts for Proxmox Deployer
 Contains bash installation scripts that run inside LXC containers after creation.
 """
 
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
 # Base script for common setup (runs first)
 BASE_SETUP_SCRIPT = """#!/bin/bash
 set -e
@@ -37,8 +44,133 @@ fi
 echo "Base setup complete"
 """
 
-# LinuxGSM installer script template
-LINUXGSM_INSTALL_TEMPLATE = """#!/bin/bash
+# Header for every rendered script. Each provisioning step records the hash of
+# its content in CHECKPOINT_DIR when it succeeds, and is skipped on later runs
+# while that hash is unchanged. Steps run in subshells and may be skipped, so
+# environment every step relies on is exported here rather than in a step.
+CHECKPOINT_HEADER = """#!/bin/bash
+set -e
+
+export DEBIAN_FRONTEND=noninteractive
+export NEEDRESTART_MODE=a
+
+CHECKPOINT_DIR=/var/lib/gameserver-provision
+if [ "${PROVISION_FORCE:-0}" = "1" ]; then
+    rm -rf "$CHECKPOINT_DIR"
+fi
+mkdir -p "$CHECKPOINT_DIR"
+
+step_done() { [ "$(cat "$CHECKPOINT_DIR/$1" 2>/dev/null)" = "$2" ]; }
+mark_step() { echo "$2" > "$CHECKPOINT_DIR/$1"; }
+"""
+
+# Wrapper for one provisioning step; the body runs in a subshell with set -e
+CHECKPOINT_STEP_TEMPLATE = """
+# ---- step: {name} ----
+if step_done {name} {step_hash}; then
+    echo "Step {name} unchanged, skipping"
+else
+(
+{body}
+)
+mark_step {name} {step_hash}
+fi
+"""
+
+# Exported by the script header when the node has a package cache, before any
+# step runs. get.docker.com honours DOWNLOAD_URL, which apt-cacher-ng remaps to
+# download.docker.com, so Docker packages are cached as well.
+PACKAGE_CACHE_HEADER = """
+PACKAGE_CACHE={cache_host}
+if timeout 3 bash -c "exec 3<>/dev/tcp/$PACKAGE_CACHE/3142" 2>/dev/null; then
+    export DOWNLOAD_URL="http://$PACKAGE_CACHE:3142/docker"
+fi
+"""
+
+# First step when the node has a package cache: send apt through apt-cacher-ng
+# (falling back to direct downloads whenever the cache is unreachable) and
+# pull Docker Hub images through the registry mirror
+PACKAGE_CACHE_STEP = """cat > /usr/local/bin/apt-proxy-detect << 'EOF'
+#!/bin/bash
+if timeout 2 bash -c "exec 3<>/dev/tcp/{cache_host}/3142" 2>/dev/null; then
+    echo "http://{cache_host}:3142"
+else
+    echo "DIRECT"
+fi
+EOF
+chmod +x /usr/local/bin/apt-proxy-detect
+
+cat > /etc/apt/apt.conf.d/01gameserver-cache << 'EOF'
+Acquire::http::Proxy-Auto-Detect "/usr/local/bin/apt-proxy-detect";
+Acquire::http::Proxy::{cache_host} "DIRECT";
+EOF
+
+mkdir -p /etc/docker
+cat > /etc/docker/daemon.json << 'EOF'
+{{
+  "registry-mirrors": ["http://{cache_host}:5000"],
+  "insecure-registries": ["{cache_host}:5000"]
+}}
+EOF
+if systemctl is-active --quiet docker; then
+    systemctl restart docker
+fi
+"""
+
+# Node-local SteamCMD depot cache, bind-mounted into the container (see
+# app.depot_cache). The first install of an app on a node seeds it; later
+# installs copy (or reflink) it into place, so SteamCMD only validates.
+DEPOT_RESTORE_STEP = """DEPOT=/mnt/depot-cache
+SERVERFILES=/home/gameserver/serverfiles
+if [ -f "$DEPOT/.complete" ] && [ -z "$(ls -A "$SERVERFILES" 2>/dev/null)" ]; then
+    echo "Copying game files from the node depot cache"
+    mkdir -p "$SERVERFILES"
+    cp -a --reflink=auto "$DEPOT/." "$SERVERFILES/"
+    rm -f "$SERVERFILES/.complete" "$SERVERFILES/.lock"
+    chown -R gameserver:gameserver "$SERVERFILES"
+fi
+"""
+
+DEPOT_SEED_STEP = """DEPOT=/mnt/depot-cache
+SERVERFILES=/home/gameserver/serverfiles
+if [ -d "$DEPOT" ] && [ ! -f "$DEPOT/.complete" ] && [ -d "$SERVERFILES" ]; then
+    (
+        flock -n 9 || exit 0
+        echo "Seeding the node depot cache"
+        cp -a --reflink=auto "$SERVERFILES/." "$DEPOT/"
+        touch "$DEPOT/.complete"
+    ) 9>"$DEPOT/.lock"
+fi
+"""
+
+# Shared read-only game layer (see app.game_layers): overlay the host's copy
+# of the server files, mounted at /mnt/game-layer, with a per-container
+# writable directory. SteamCMD then only writes files that differ.
+GAME_LAYER_STEP = """mkdir -p /home/gameserver/.layer/upper /home/gameserver/.layer/work /home/gameserver/serverfiles
+
+cat > /etc/systemd/system/home-gameserver-serverfiles.mount << 'EOF'
+[Unit]
+Description=Shared game files with a writable overlay
+RequiresMountsFor=/mnt/game-layer
+
+[Mount]
+What=overlay
+Where=/home/gameserver/serverfiles
+Type=overlay
+Options=lowerdir=/mnt/game-layer,upperdir=/home/gameserver/.layer/upper,workdir=/home/gameserver/.layer/work
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+systemctl daemon-reload
+systemctl enable --now home-gameserver-serverfiles.mount
+chown gameserver:gameserver /home/gameserver/serverfiles /home/gameserver/.layer/upper
+"""
+
+# LinuxGSM installer steps
+LINUXGSM_INSTALL_STEPS = (
+    ('linuxgsm', """#!/bin/bash
 set -e
 
 # Switch to gameserver user
@@ -53,8 +185,8 @@ sudo -u gameserver ./linuxgsm.sh {linuxgsm_name}
 
 # Run installation (this downloads the server files via SteamCMD)
 sudo -u gameserver /home/gameserver/{linuxgsm_name} auto-install
-
-# Create systemd service
+"""),
+    ('service', """# Create systemd service
 cat > /etc/systemd/system/{linuxgsm_name}.service << 'EOF'
 [Unit]
 Description={game_name} Server (LinuxGSM)
@@ -78,10 +210,12 @@ systemctl enable {linuxgsm_name}
 systemctl start {linuxgsm_name}
 
 echo "{game_name} installed successfully via LinuxGSM"
-"""
+"""),
+)
 
-# Docker installer script template
-DOCKER_INSTALL_TEMPLATE = """#!/bin/bash
+# Docker installer steps
+DOCKER_INSTALL_STEPS = (
+    ('docker', """#!/bin/bash
 set -e
 
 # Install Docker
@@ -89,8 +223,8 @@ curl -fsSL https://get.docker.com | sh
 usermod -aG docker gameserver
 systemctl enable docker
 systemctl start docker
-
-# Create game server directory
+"""),
+    ('compose', """# Create game server directory
 mkdir -p /opt/gameserver/{server_key}
 chown -R gameserver:gameserver /opt/gameserver
 
@@ -104,7 +238,8 @@ cd /opt/gameserver/{server_key}
 docker compose up -d
 
 echo "{game_name} installed successfully via Docker"
-"""
+"""),
+)
 
 # Game-specific installation scripts
 INSTALL_SCRIPTS = {
@@ -871,62 +1006,266 @@ echo "Default port: 8080"
 }
 
 
-def get_install_script(server_key: str, env_vars: dict = None) -> str:
+# Matches ${VAR} placeholders and the default password marker in docker-compose files
+_PLACEHOLDER_RE = re.compile(r'\$\{([^}]+)\}|changeme')
+
+# Maximum number of rendered scripts kept per worker
+RENDER_CACHE_SIZE = 256
+
+
+def _env_hash(env_vars: dict) -> str:
+    """Stable hash of a set of environment variables."""
+    encoded = json.dumps(env_vars or {}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class RenderedScript:
+    """A fully rendered install script, its content hash and per-step hashes."""
+
+    __slots__ = ('server_key', 'script', 'content_hash', 'steps')
+
+    def __init__(self, server_key: str, script: str, steps: tuple = ()):
+        self.server_key = server_key
+        self.script = script
+        self.content_hash = hashlib.sha256(script.encode('utf-8')).hexdigest()
+        self.steps = steps
+
+
+def _compile_text(text: str) -> tuple:
+    """Split docker-compose text into literal parts and (env var, fallback) slots."""
+    parts = []
+    position = 0
+    for match in _PLACEHOLDER_RE.finditer(text):
+        parts.append(text[position:match.start()])
+        parts.append((match.group(1) or 'SERVER_PASSWORD', match.group(0)))
+        position = match.end()
+    parts.append(text[position:])
+    return tuple(parts)
+
+
+class CompiledRecipe:
     """
-    Generate the complete installation script for a game server.
+    An install recipe split into named provisioning steps, each made of
+    literal text and env var slots.
 
-    Args:
-        server_key: The game server key (e.g., 'valheim', 'minecraft')
-        env_vars: Environment variables to inject into the script
+    Steps without slots (everything but Docker compose files) render to the
+    same text for every set of env vars.
+    """
 
-    Returns:
-        Complete bash script as a string
+    __slots__ = ('steps', 'static')
+
+    def __init__(self, server_key: str, script_config: dict):
+        script_type = script_config.get('type')
+        fields = {
+            'server_key': server_key,
+            'game_name': script_config['name'],
+            'linuxgsm_name': script_config.get('linuxgsm_name'),
+        }
+        steps = [('base', (BASE_SETUP_SCRIPT,))]
+
+        if script_type == 'linuxgsm':
+            for name, template in LINUXGSM_INSTALL_STEPS:
+                steps.append((name, (template.format(**fields),)))
+            if script_config.get('post_install'):
+                steps.append(('post_install', (script_config['post_install'],)))
+
+        elif script_type == 'docker':
+            # Split each template around the compose file, then the compose file around its slots
+            marker = '\0docker_compose\0'
+            for name, template in DOCKER_INSTALL_STEPS:
+                text = template.format(docker_compose=marker, **fields)
+                if marker in text:
+                    before, after = text.split(marker)
+                    compose = _compile_text(script_config['docker_compose'])
+                    parts = (before + compose[0],) + compose[1:-1] + (compose[-1] + after,)
+                else:
+                    parts = (text,)
+                steps.append((name, parts))
+
+        elif script_type == 'custom':
+            steps.append(('custom', (script_config['script'],)))
+
+        self.steps = tuple(steps)
+        self.static = all(len(parts) == 1 for _, parts in self.steps)
+
+    def render(self, env_vars: dict = None, cache_host: str = None,
+               depot_cache: bool = False, game_layer: bool = False) -> Tuple[str, tuple]:
+        """
+        Fill the env var slots and wrap every step in its checkpoint guard.
+
+        Args:
+            env_vars: Environment variables to inject
+            cache_host: Address of the node's package cache, if it has one
+            depot_cache: The container has the node's SteamCMD depot cache mounted
+            game_layer: The container has a shared game layer mounted
+
+        Returns:
+            Tuple of (script, ((step name, step hash), ...))
+        """
+        env_vars = env_vars or {}
+        chunks = [CHECKPOINT_HEADER]
+        step_hashes = []
+        steps = self.steps
+        if cache_host:
+            chunks.append(PACKAGE_CACHE_HEADER.format(cache_host=cache_host))
+            steps = (('cache', (PACKAGE_CACHE_STEP.format(cache_host=cache_host),)),) + steps
+        if (depot_cache or game_layer) and any(name == 'linuxgsm' for name, _ in steps):
+            wrapped = []
+            for name, parts in steps:
+                if name == 'linuxgsm':
+                    if game_layer:
+                        wrapped.append(('game_layer', (GAME_LAYER_STEP,)))
+                    else:
+                        wrapped.append(('depot_restore', (DEPOT_RESTORE_STEP,)))
+                wrapped.append((name, parts))
+                if name == 'linuxgsm' and not game_layer:
+                    wrapped.append(('depot_seed', (DEPOT_SEED_STEP,)))
+            steps = tuple(wrapped)
+        for name, parts in steps:
+            body = ''.join(
+                part if isinstance(part, str)
+                else (str(env_vars[part[0]]) if part[0] in env_vars else part[1])
+                for part in parts
+            )
+            step_hash = hashlib.sha256(body.encode('utf-8')).hexdigest()[:16]
+            chunks.append(CHECKPOINT_STEP_TEMPLATE.format(name=name, step_hash=step_hash, body=body))
+            step_hashes.append((name, step_hash))
+        return ''.join(chunks), tuple(step_hashes)
+
+
+class ScriptRenderer:
+    """Compiles recipes once and memoizes rendered scripts with LRU eviction."""
+
+    def __init__(self, recipes: dict, maxsize: int = RENDER_CACHE_SIZE):
+        """
+        Args:
+            recipes: Mapping of server key to install recipe
+            maxsize: Maximum number of rendered scripts to keep
+        """
+        self.recipes = recipes
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._compiled: Dict[str, CompiledRecipe] = {}
+        self._rendered: 'OrderedDict[tuple, RenderedScript]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compile(self, server_key: str) -> Optional[CompiledRecipe]:
+        compiled = self._compiled.get(server_key)
+        if compiled is None and server_key in self.recipes:
+            compiled = self._compiled[server_key] = CompiledRecipe(server_key, self.recipes[server_key])
+        return compiled
+
+    def render(self, server_key: str, env_vars: dict = None, cache_host: str = None,
+               depot_cache: bool = False, game_layer: bool = False) -> Optional[RenderedScript]:
+        """
+        Render the install script for a server.
+
+        Returns:
+            RenderedScript, or None if there is no recipe for the server
+        """
+        compiled = self._compile(server_key)
+        if compiled is None:
+            return None
+
+        cache_key = (
+            server_key, '' if compiled.static else _env_hash(env_vars), cache_host or '',
+            depot_cache, game_layer
+        )
+        with self._lock:
+            rendered = self._rendered.get(cache_key)
+            if rendered is not None:
+                self._rendered.move_to_end(cache_key)
+                self.hits += 1
+                return rendered
+            self.misses += 1
+
+        rendered = RenderedScript(server_key, *compiled.render(env_vars, cache_host, depot_cache, game_layer))
+        with self._lock:
+            self._rendered[cache_key] = rendered
+            while len(self._rendered) > self.maxsize:
+                self._rendered.popitem(last=False)
+        return rendered
+
+    def stats(self) -> Dict[str, int]:
+        """Cache effectiveness counters."""
+        return {
+            'compiled': len(self._compiled),
+            'cached': len(self._rendered),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# The live renderer (and its recipe set); catalog file reloads swap this reference in one step
+_renderer = ScriptRenderer(INSTALL_SCRIPTS)
+
+
+def get_package_cache(connection_id: int, node: str) -> Optional[str]:
+    """
+    Get the package cache address for a node, if it has a ready one.
+
+    Read from the database on every render, so every worker sees a cache
+    as soon as it is built or removed.
     """
-    if server_key not in INSTALL_SCRIPTS:
+    if not connection_id or not node:
         return None
+    from app.package_cache import get_package_cache_address
+    return get_package_cache_address(connection_id, node)
 
-    script_config = INSTALL_SCRIPTS[server_key]
-    script_type = script_config.get('type')
 
-    # Start with base setup
-    full_script = BASE_SETUP_SCRIPT + "\n"
+def set_install_scripts(scripts: dict):
+    """Atomically replace the live install recipes (used by catalog file reloads)."""
+    global _renderer
+    _renderer = ScriptRenderer(scripts)
 
-    if script_type == 'linuxgsm':
-        # Generate LinuxGSM installation script
-        linuxgsm_name = script_config['linuxgsm_name']
-        game_name = script_config['name']
 
-        full_script += LINUXGSM_INSTALL_TEMPLATE.format(
-            linuxgsm_name=linuxgsm_name,
-            game_name=game_name
-        )
+def get_install_scripts() -> dict:
+    """Get the live install recipes."""
+    return _renderer.recipes
 
-        # Add post-install if any
-        if script_config.get('post_install'):
-            full_script += "\n" + script_config['post_install']
-
-    elif script_type == 'docker':
-        # Generate Docker installation script
-        docker_compose = script_config['docker_compose']
-        game_name = script_config['name']
-
-        # Apply env vars to docker-compose if provided
-        if env_vars:
-            for key, value in env_vars.items():
-                docker_compose = docker_compose.replace(f'${{{key}}}', str(value))
-                docker_compose = docker_compose.replace(f'changeme', str(value) if key == 'SERVER_PASSWORD' else 'changeme')
-
-        full_script += DOCKER_INSTALL_TEMPLATE.format(
-            server_key=server_key,
-            game_name=game_name,
-            docker_compose=docker_compose
-        )
 
-    elif script_type == 'custom':
-        # Use custom script directly
-        full_script += script_config['script']
+def get_render_stats() -> Dict[str, int]:
+    """Get render cache counters for the live recipe set."""
+    return _renderer.stats()
+
+
+def render_install_script(server_key: str, env_vars: dict = None, node: str = None,
+                          depot_cache: bool = False, game_layer: bool = False,
+                          connection_id: int = None) -> Optional[RenderedScript]:
+    """
+    Render the complete installation script for a game server, with its content hash.
+
+    Args:
+        server_key: The game server key (e.g., 'valheim', 'minecraft')
+        env_vars: Environment variables to inject into the script
+        node: Target Proxmox node; scripts use the node's package cache if it has one
+        depot_cache: Restore from / seed the node's SteamCMD depot cache (LinuxGSM games)
+        game_layer: Overlay the server files on a shared game layer (LinuxGSM games)
+        connection_id: Connection (cluster) the node belongs to; needed for the package cache
+
+    Returns:
+        RenderedScript, or None if no install script is available
+    """
+    return _renderer.render(server_key, env_vars, get_package_cache(connection_id, node), depot_cache, game_layer)
+
+
+def get_install_script(server_key: str, env_vars: dict = None, node: str = None,
+                       connection_id: int = None) -> str:
+    """
+    Generate the complete installation script for a game server.
+
+    Args:
+        server_key: The game server key (e.g., 'valheim', 'minecraft')
+        env_vars: Environment variables to inject into the script
+        node: Target Proxmox node; scripts use the node's package cache if it has one
+        connection_id: Connection (cluster) the node belongs to
 
-    return full_script
+    Returns:
+        Complete bash script as a string
+    """
+    rendered = _renderer.render(server_key, env_vars, get_package_cache(connection_id, node))
+    return rendered.script if rendered else None
 
 
 def get_available_scripts() -> dict:
@@ -936,5 +1275,5 @@ def get_available_scripts() -> dict:
             'name': config['name'],
             'type': config['type']
         }
-        for key, config in INSTALL_SCRIPTS.items()
+        for key, config in _renderer.recipes.items()
     }
@@ -0,0 +1,182 @@
+"""
+Cross-Worker Leases
+Expiring locks kept in the database, so gunicorn workers (and hosts) never
+run two deploys, provisions or deletes on the same guest at once. The
+holder renews its lease in the background while the operation runs; if the
+worker dies, the lease expires and the next caller takes it over.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Lease
+
+DEFAULT_TTL = 60
+MAX_WAIT = 600
+
+logger = logging.getLogger(__name__)
+
+
+def guest_lease_key(connection_id: int, vmid: int) -> str:
+    """Lease key for operations on one container/VM."""
+    return f'guest:{int(connection_id)}:{int(vmid)}'
+
+
+class LeaseLost(RuntimeError):
+    """A lease expired or was taken over while its operation was still running."""
+
+
+class LeaseHandle:
+    """
+    A held lease, renewed in the background until released.
+
+    lost turns True once the lease was taken over, or went unrenewed for a
+    whole ttl; the holder should then stop before its next step.
+    """
+
+    def __init__(self, engine, key: str, owner: str, operation: str, ttl: float):
+        self.engine = engine
+        self.key = key
+        self.owner = owner
+        self.operation = operation
+        self.ttl = ttl
+        self.lost = False
+        self.vmid = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name=f'lease-{key}', daemon=True)
+        self._thread.start()
+
+    def renew(self) -> bool:
+        """Push the expiry out by another ttl; False if the lease was taken over."""
+        table = Lease.__table__
+        with self.engine.begin() as conn:
+            renewed = conn.execute(
+                update(table)
+                .where(table.c.key == self.key, table.c.owner == self.owner)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=self.ttl))
+            ).rowcount
+        return bool(renewed)
+
+    def _heartbeat(self):
+        renewed_at = time.monotonic()
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not self.renew():
+                    logger.error('Lease %s (%s) was taken over by another holder', self.key, self.operation)
+                    self.lost = True
+                    return
+                renewed_at = time.monotonic()
+            except Exception as e:
+                # e.g. database briefly locked; the lease is still valid until its ttl runs out
+                logger.warning('Renewing lease %s (%s) failed: %s', self.key, self.operation, e)
+                if time.monotonic() - renewed_at >= self.ttl:
+                    logger.error('Lease %s (%s) expired without a renewal', self.key, self.operation)
+                    self.lost = True
+                    return
+
+    def check(self):
+        """Raise LeaseLost if the lease is no longer held."""
+        if self.lost:
+            raise LeaseLost(f'Lost the lease on {self.key}; another operation may have taken it over')
+
+    def release(self):
+        self._stop.set()
+        table = Lease.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.key == self.key, table.c.owner == self.owner))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _try_acquire(engine, key: str, owner: str, operation: str, ttl: float) -> bool:
+    table = Lease.__table__
+    now = datetime.utcnow()
+    values = {'key': key, 'owner': owner, 'operation': operation,
+              'acquired_at': now, 'expires_at': now + timedelta(seconds=ttl)}
+    # Take over an expired lease (its holder crashed or hung)
+    with engine.begin() as conn:
+        if conn.execute(update(table).where(table.c.key == key, table.c.expires_at < now).values(**values)).rowcount:
+            return True
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.insert().values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def acquire_lease(key: str, operation: str, ttl: float = DEFAULT_TTL, wait: float = 0,
+                  poll: float = 0.5) -> Optional[LeaseHandle]:
+    """
+    Take a lease, optionally waiting for the current holder to finish.
+
+    Args:
+        key: What to lock (see guest_lease_key)
+        operation: Name shown to callers that find it held
+        ttl: Seconds the lease survives without a renewal
+        wait: Seconds to wait for a held lease (0 fails at once)
+        poll: Seconds between attempts while waiting
+
+    Returns:
+        The held lease, or None if it stayed held
+    """
+    engine = db.engine
+    owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    deadline = time.monotonic() + min(max(wait, 0), MAX_WAIT)
+    while True:
+        if _try_acquire(engine, key, owner, operation, ttl):
+            return LeaseHandle(engine, key, owner, operation, ttl)
+        if time.monotonic() + poll > deadline:
+            return None
+        time.sleep(poll)
+
+
+def get_lease(key: str) -> Optional[Dict[str, Any]]:
+    """Get the current holder of a lease, if it has not expired."""
+    lease = db.session.get(Lease, key)
+    if lease and lease.expires_at > datetime.utcnow():
+        return lease.to_dict()
+    return None
+
+
+def list_leases() -> List[Dict[str, Any]]:
+    """Get every unexpired lease."""
+    query = Lease.query.filter(Lease.expires_at > datetime.utcnow()).order_by(Lease.acquired_at)
+    return [lease.to_dict() for lease in query.all()]
+
+
+def lease_free_vmid(client, connection_id: int, operation: str, ttl: float = DEFAULT_TTL,
+                    attempts: int = 20) -> Optional[LeaseHandle]:
+    """
+    Pick a free VMID and lease it.
+
+    Proxmox hands out the same next free VMID to every caller until a guest
+    is created with it, so concurrent deploys would collide. The first free
+    VMID that no other worker holds a lease on is taken instead.
+
+    Returns:
+        The lease, with the VMID in its vmid attribute, or None
+    """
+    vmid = int(client.get_next_vmid())
+    for candidate in range(vmid, vmid + attempts):
+        if candidate != vmid and not client.is_vmid_free(candidate):
+            continue
+        lease = acquire_lease(guest_lease_key(connection_id, candidate), operation, ttl)
+        if lease:
+            lease.vmid = candidate
+            return lease
+    return None
@@ -0,0 +1,156 @@
+"""
+Linked-clone VM Deployments
+Background promotion of linked clones to independent full disks, and
+per-mode deploy time and disk usage figures.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any
+
+from app import db
+from app.models import Deployment
+from app.proxmox_client import ProxmoxClient
+
+CLONE_MODES = ('full', 'linked')
+
+
+def _update_snapshot(deployment: Deployment, commit: bool = True, **values):
+    """
+    Merge values into a deployment's config snapshot and save it.
+
+    When saving, the deployment is re-read first (with its row locked where
+    the database supports it), so keys that a request saved while a
+    promotion ran are kept rather than overwritten.
+    """
+    if commit:
+        db.session.refresh(deployment, with_for_update=True)
+    deployment.config_snapshot = {**(deployment.config_snapshot or {}), **values}
+    if commit:
+        db.session.commit()
+
+
+def record_disk_usage(client: ProxmoxClient, deployment: Deployment, commit: bool = True) -> Dict[str, Any]:
+    """
+    Store a VM deployment's provisioned and used disk space in its config snapshot.
+
+    Args:
+        client: Client for the deployment's connection
+        deployment: VM deployment
+        commit: Commit now, or leave it to the caller's commit
+    """
+    usage = client.get_vm_disk_usage(deployment.node, deployment.vmid)
+    if usage['success']:
+        _update_snapshot(
+            deployment,
+            commit,
+            disk_bytes=usage['size'],
+            disk_used_bytes=usage['used'],
+            linked_disks=usage['linked']
+        )
+    return usage
+
+
+def promote_linked_clone(deployment_id: int, storage: str) -> Dict[str, Any]:
+    """
+    Turn a linked-clone VM into a full clone by moving each disk that is
+    still backed by the template's base volume onto another storage.
+
+    Args:
+        deployment_id: Deployment to promote
+        storage: Target storage (Proxmox cannot move a disk onto the storage it is on)
+
+    Returns:
+        Dict with success status and the time the copy took
+    """
+    deployment = Deployment.query.get(deployment_id)
+    if not deployment or not deployment.vmid:
+        return {'success': False, 'error': 'Deployment not found'}
+
+    client = ProxmoxClient(deployment.connection)
+    started = time.time()
+    _update_snapshot(deployment, promotion={
+        'status': 'running', 'storage': storage, 'started_at': datetime.utcnow().isoformat()
+    })
+
+    usage = client.get_vm_disk_usage(deployment.node, deployment.vmid)
+    result = usage if not usage['success'] else {'success': True}
+    for disk in usage.get('disks', []):
+        if not disk['linked']:
+            continue
+        result = client.move_vm_disk(deployment.node, deployment.vmid, disk['disk'], storage)
+        if not result['success']:
+            break
+
+    promotion = {
+        'status': 'done' if result['success'] else 'failed',
+        'storage': storage,
+        'seconds': round(time.time() - started, 1)
+    }
+    if not result['success']:
+        promotion['error'] = result.get('error')
+    _update_snapshot(deployment, promotion=promotion)
+
+    if result['success']:
+        _update_snapshot(deployment, clone_mode='promoted')
+        record_disk_usage(client, deployment)
+    return {'success': result['success'], 'error': result.get('error'), **promotion}
+
+
+def start_promotion(app, deployment_id: int, storage: str, delay: int = 0) -> threading.Thread:
+    """
+    Promote a linked clone on a background thread.
+
+    Args:
+        app: Flask application (the thread needs its own app context)
+        deployment_id: Deployment to promote
+        storage: Target storage for the full copy
+        delay: Seconds to wait first, so the copy runs after the deploy rush
+    """
+    def run():
+        if delay:
+            time.sleep(delay)
+        with app.app_context():
+            try:
+                promote_linked_clone(deployment_id, storage)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning('Promoting deployment %s failed: %s', deployment_id, e)
+                deployment = Deployment.query.get(deployment_id)
+                if deployment:
+                    _update_snapshot(deployment, promotion={'status': 'failed', 'storage': storage, 'error': str(e)})
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name=f'promote-{deployment_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def clone_mode_stats() -> Dict[str, Any]:
+    """
+    Compare VM deployments by clone mode.
+
+    Returns:
+        Dict keyed by mode (full, linked, promoted) with deployment count,
+        average and total clone seconds, and provisioned/used disk bytes
+    """
+    stats = {}
+    for deployment in Deployment.query.filter_by(deployment_type='vm').all():
+        snapshot = deployment.config_snapshot or {}
+        if 'clone_seconds' not in snapshot:
+            continue
+        mode = snapshot.get('clone_mode', 'full')
+        entry = stats.setdefault(mode, {
+            'count': 0, 'clone_seconds_total': 0.0, 'disk_bytes': 0, 'disk_used_bytes': 0
+        })
+        entry['count'] += 1
+        entry['clone_seconds_total'] += snapshot['clone_seconds']
+        entry['disk_bytes'] += snapshot.get('disk_bytes', 0)
+        entry['disk_used_bytes'] += snapshot.get('disk_used_bytes', 0)
+
+    for entry in stats.values():
+        entry['clone_seconds_total'] = round(entry['clone_seconds_total'], 1)
+        entry['clone_seconds_avg'] = round(entry['clone_seconds_total'] / entry['count'], 1)
+    return stats
@@ -0,0 +1,148 @@
+"""
+Schema Migrations
+Ordered, numbered changes to existing databases. db.create_all() only
+creates missing tables, so anything added to a table that already exists
+(indexes, columns) needs a migration here. Each one runs once and is
+recorded in the schema_migrations table.
+
+Table creation and migrations run together under a database lock, so when
+several gunicorn workers start on an old database at once, one upgrades it
+and the others wait, then find nothing left to do.
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+MIGRATION_LOCK_TIMEOUT = 600
+POSTGRES_LOCK_KEY = 7130417  # Advisory lock id for schema changes
+
+
+def create_deployment_indexes(conn):
+    """Index the deployment columns used for filtering, sorting and vmid lookups."""
+    for name, columns in (
+        ('ix_deployments_status', 'status'),
+        ('ix_deployments_created_at', 'created_at'),
+        ('ix_deployments_server_key', 'server_key'),
+        ('ix_deployments_node_vmid', 'node, vmid'),
+    ):
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON deployments ({columns})'))
+
+
+def backfill_deployment_counts(conn):
+    """Count existing deployments into the dashboard aggregates."""
+    from app.aggregates import rebuild_deployment_counts
+    rebuild_deployment_counts(conn)
+
+
+def move_config_snapshots(conn):
+    """Store deployment configs once per distinct content in config_blobs."""
+    from app.config_blobs import move_snapshots_to_blobs
+    move_snapshots_to_blobs(conn)
+
+
+def track_layer_nodes(conn):
+    """Record each game layer's node and index the deployments mounting it."""
+    from app.game_layers import track_layer_nodes as link_layers
+    link_layers(conn)
+
+
+def track_golden_build_vmids(conn):
+    """Record the build container of each golden template build."""
+    from app.golden_templates import track_build_vmids
+    track_build_vmids(conn)
+
+
+# (version, description, function taking a SQLAlchemy connection)
+MIGRATIONS = [
+    (1, 'Index deployment status, created_at, server_key and (node, vmid)', create_deployment_indexes),
+    (2, 'Backfill dashboard deployment counts', backfill_deployment_counts),
+    (3, 'Move deployment config snapshots into content-addressed blobs', move_config_snapshots),
+    (4, 'Add game layer nodes and index deployments by game layer', track_layer_nodes),
+    (5, 'Add golden template build container VMIDs', track_golden_build_vmids),
+]
+
+
+def _ensure_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(255), applied_at TIMESTAMP)'
+    ))
+
+
+@contextmanager
+def schema_lock(engine, timeout: float = MIGRATION_LOCK_TIMEOUT):
+    """
+    Hold the database-wide schema lock on one connection until the block commits.
+
+    SQLite takes its write lock with BEGIN IMMEDIATE, retried while another
+    process holds it; PostgreSQL takes a transaction-scoped advisory lock.
+
+    Yields:
+        The connection holding the lock; do all the work on it
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == 'sqlite':
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    conn.exec_driver_sql('BEGIN IMMEDIATE')
+                    break
+                except OperationalError as e:
+                    if 'locked' not in str(e) or time.monotonic() > deadline:
+                        raise
+                    conn.rollback()
+                    time.sleep(0.5)
+        elif conn.dialect.name == 'postgresql':
+            conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': POSTGRES_LOCK_KEY})
+        yield conn
+        conn.commit()
+
+
+def get_migration_status(engine) -> List[Dict[str, Any]]:
+    """List every migration and when it was applied (None if pending)."""
+    with engine.begin() as conn:
+        _ensure_table(conn)
+        applied = dict(conn.execute(text('SELECT version, applied_at FROM schema_migrations')).all())
+    return [
+        {'version': version, 'description': description, 'applied_at': applied.get(version)}
+        for version, description, _ in MIGRATIONS
+    ]
+
+
+def run_migrations(engine, metadata=None) -> List[int]:
+    """
+    Create missing tables and apply pending migrations in order.
+
+    Everything runs in one transaction under the schema lock, and the
+    applied versions are read after taking it, so concurrent callers never
+    apply a migration twice. A failed migration leaves the database as it was.
+
+    Args:
+        engine: SQLAlchemy engine
+        metadata: Tables to create first (db.metadata), if any
+
+    Returns:
+        Versions applied by this call
+    """
+    applied = []
+    with schema_lock(engine) as conn:
+        if metadata is not None:
+            metadata.create_all(conn)
+        _ensure_table(conn)
+        done = {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(conn)
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+            applied.append(version)
+    return applied
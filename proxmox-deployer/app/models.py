@@ -2,6 +2,7 @@
 Database models for the Game Server Deployer
 """
 
+import copy
 from datetime import datetime
 from app import db
 
@@ -44,21 +45,50 @@ class ProxmoxConnection(db.Model):
 class Deployment(db.Model):
     """Record of a game server deployment."""
     __tablename__ = 'deployments'
+    __table_args__ = (db.Index('ix_deployments_node_vmid', 'node', 'vmid'),)
 
     id = db.Column(db.Integer, primary_key=True)
     connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
-    server_key = db.Column(db.String(100), nullable=False)
+    server_key = db.Column(db.String(100), nullable=False, index=True)
     server_name = db.Column(db.String(200), nullable=False)
     deployment_type = db.Column(db.String(20), nullable=False)  # 'lxc' or 'vm'
     node = db.Column(db.String(100), nullable=False)
     vmid = db.Column(db.Integer, nullable=True)
     ip_address = db.Column(db.String(50), nullable=True)
-    status = db.Column(db.String(50), default='pending')  # pending, running, stopped, failed
+    status = db.Column(db.String(50), default='pending', index=True)  # pending, running, stopped, failed
     error_message = db.Column(db.Text, nullable=True)
-    config_snapshot = db.Column(db.JSON, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    config_hash = db.Column(db.String(64), db.ForeignKey('config_blobs.hash'), nullable=True, index=True)
+    game_layer_id = db.Column(db.Integer, db.ForeignKey('game_layers.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    config_blob = db.relationship('ConfigBlob', viewonly=True)
+
+    @property
+    def config_snapshot(self):
+        """
+        Config the deployment was created with.
+
+        Stored once per distinct content in config_blobs; assign a new dict
+        to change it (the blob is written on flush, see app.config_blobs).
+        """
+        pending = self.__dict__.get('_pending_config')
+        if pending and pending[0] == self.config_hash:
+            return copy.deepcopy(pending[1])
+        blob = self.config_blob if self.config_hash else None
+        return copy.deepcopy(blob.data) if blob else None
+
+    @config_snapshot.setter
+    def config_snapshot(self, config):
+        from app.config_blobs import normalize_config
+        if config is None:
+            self.config_hash = None
+            self.__dict__.pop('_pending_config', None)
+            return
+        config_hash, data, size = normalize_config(config)
+        self.config_hash = config_hash
+        self.__dict__['_pending_config'] = (config_hash, data, size)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -71,12 +101,34 @@ class Deployment(db.Model):
             'ip_address': self.ip_address,
             'status': self.status,
             'error_message': self.error_message,
+            'config_hash': self.config_hash,
+            'game_layer_id': self.game_layer_id,
             'config_snapshot': self.config_snapshot,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 
+class ConfigBlob(db.Model):
+    """A distinct deployment config, keyed by the SHA-256 of its normalized JSON."""
+    __tablename__ = 'config_blobs'
+
+    hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    size = db.Column(db.Integer, nullable=False, default=0)  # Bytes of normalized JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'hash': self.hash,
+            'config': self.data,
+            'size': self.size,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_used_at': self.last_used_at.isoformat() if self.last_used_at else None
+        }
+
+
 class Credential(db.Model):
     """Stored credentials for game servers (Steam tokens, passwords, etc.)."""
     __tablename__ = 'credentials'
@@ -101,3 +153,341 @@ class Credential(db.Model):
         if include_value:
             result['value'] = self.value
         return result
+
+
+class TemplateChecksum(db.Model):
+    """A template file on a node that passed its checksum, at the size and ctime it had then."""
+    __tablename__ = 'template_checksums'
+    __table_args__ = (db.UniqueConstraint('connection_id', 'node', 'volid'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    volid = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=True)
+    ctime = db.Column(db.BigInteger, nullable=True)
+    algorithm = db.Column(db.String(20), nullable=False)
+    checksum = db.Column(db.String(128), nullable=False)
+    verified_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class GoldenTemplate(db.Model):
+    """A pre-provisioned vzdump archive of a game server, used as an LXC template."""
+    __tablename__ = 'golden_templates'
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    server_key = db.Column(db.String(100), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    base_template = db.Column(db.String(255), nullable=False)
+    storage = db.Column(db.String(100), nullable=True)  # backup storage holding the archive
+    volid = db.Column(db.String(255), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    script_hash = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(50), default='building')  # building, ready, failed
+    error_message = db.Column(db.Text, nullable=True)
+    build_seconds = db.Column(db.Float, nullable=True)
+    build_vmid = db.Column(db.Integer, nullable=True)  # build container, until it is destroyed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    connection = db.relationship('ProxmoxConnection', backref=db.backref('golden_templates', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'connection_id': self.connection_id,
+            'server_key': self.server_key,
+            'node': self.node,
+            'version': self.version,
+            'base_template': self.base_template,
+            'storage': self.storage,
+            'volid': self.volid,
+            'size': self.size,
+            'script_hash': self.script_hash,
+            'status': self.status,
+            'error_message': self.error_message,
+            'build_seconds': self.build_seconds,
+            'build_vmid': self.build_vmid,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class WarmPool(db.Model):
+    """Target number of idle, pre-provisioned containers for a game on a node."""
+    __tablename__ = 'warm_pools'
+    __table_args__ = (db.UniqueConstraint('connection_id', 'node', 'server_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    server_key = db.Column(db.String(100), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Integer, nullable=False, default=1)
+    template = db.Column(db.String(255), nullable=True)  # base OS template when no golden template exists
+    storage = db.Column(db.String(100), default='local-lvm')
+    bridge = db.Column(db.String(50), default='vmbr0')
+    enabled = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    connection = db.relationship('ProxmoxConnection', backref=db.backref('warm_pools', lazy=True))
+    members = db.relationship('PoolMember', backref='pool', lazy=True, cascade='all, delete-orphan')
+
+    def to_dict(self):
+        counts = {}
+        for member in self.members:
+            counts[member.status] = counts.get(member.status, 0) + 1
+        return {
+            'id': self.id,
+            'connection_id': self.connection_id,
+            'server_key': self.server_key,
+            'node': self.node,
+            'size': self.size,
+            'template': self.template,
+            'storage': self.storage,
+            'bridge': self.bridge,
+            'enabled': self.enabled,
+            'members': counts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class PoolMember(db.Model):
+    """A stopped container waiting in a warm pool."""
+    __tablename__ = 'pool_members'
+
+    id = db.Column(db.Integer, primary_key=True)
+    pool_id = db.Column(db.Integer, db.ForeignKey('warm_pools.id'), nullable=False)
+    vmid = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(50), default='building')  # building, ready, claimed, failed
+    script_hash = db.Column(db.String(64), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    ready_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'pool_id': self.pool_id,
+            'vmid': self.vmid,
+            'status': self.status,
+            'script_hash': self.script_hash,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'ready_at': self.ready_at.isoformat() if self.ready_at else None
+        }
+
+
+class PackageCache(db.Model):
+    """The apt/container-image caching proxy container serving one Proxmox node."""
+    __tablename__ = 'package_caches'
+    __table_args__ = (db.UniqueConstraint('connection_id', 'node'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    vmid = db.Column(db.Integer, nullable=True)
+    ip_address = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(50), default='building')  # building, ready, failed
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    connection = db.relationship('ProxmoxConnection', backref=db.backref('package_caches', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'connection_id': self.connection_id,
+            'node': self.node,
+            'vmid': self.vmid,
+            'ip_address': self.ip_address,
+            'status': self.status,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class GameLayer(db.Model):
+    """A read-only copy of a game's server files on a node, shared by its containers."""
+    __tablename__ = 'game_layers'
+    __table_args__ = (
+        db.Index('uq_game_layers_node_version', 'connection_id', 'node', 'steam_app_id', 'version', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    node = db.Column(db.String(100), nullable=True)  # None only for layers built before nodes were tracked
+    steam_app_id = db.Column(db.String(20), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    path = db.Column(db.String(255), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    status = db.Column(db.String(50), default='building')  # building, ready, failed
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    connection = db.relationship('ProxmoxConnection', backref=db.backref('game_layers', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'connection_id': self.connection_id,
+            'node': self.node,
+            'steam_app_id': self.steam_app_id,
+            'version': self.version,
+            'path': self.path,
+            'size': self.size,
+            'status': self.status,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class FleetUpdate(db.Model):
+    """A rolling game update across every deployment of one Steam app on a node."""
+    __tablename__ = 'fleet_updates'
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('proxmox_connections.id'), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    steam_app_id = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(50), default='pending')  # pending, running, done, halted, failed
+    wave_size = db.Column(db.Integer, default=5)
+    concurrency = db.Column(db.Integer, default=2)
+    report = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    connection = db.relationship('ProxmoxConnection', backref=db.backref('fleet_updates', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'connection_id': self.connection_id,
+            'node': self.node,
+            'steam_app_id': self.steam_app_id,
+            'status': self.status,
+            'wave_size': self.wave_size,
+            'concurrency': self.concurrency,
+            'report': self.report,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class DeploymentCount(db.Model):
+    """Running count of deployments per status, overall and per server, node and connection."""
+    __tablename__ = 'deployment_counts'
+    __table_args__ = (db.UniqueConstraint('dimension', 'value', 'status'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)  # all, server_key, node, connection_id
+    value = db.Column(db.String(100), nullable=False, default='')
+    status = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DeploymentSummary(db.Model):
+    """Deployments compacted out of the deployments table, counted per month."""
+    __tablename__ = 'deployment_summaries'
+    __table_args__ = (
+        db.UniqueConstraint('month', 'connection_id', 'server_key', 'node', 'deployment_type', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM the deployments were created
+    connection_id = db.Column(db.Integer, nullable=False)
+    server_key = db.Column(db.String(100), nullable=False)
+    node = db.Column(db.String(100), nullable=False)
+    deployment_type = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    first_created_at = db.Column(db.DateTime, nullable=True)
+    last_created_at = db.Column(db.DateTime, nullable=True)
+    archive = db.Column(db.String(255), nullable=True)  # Last archive file holding these records
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'connection_id': self.connection_id,
+            'server_key': self.server_key,
+            'node': self.node,
+            'deployment_type': self.deployment_type,
+            'status': self.status,
+            'count': self.count,
+            'first_created_at': self.first_created_at.isoformat() if self.first_created_at else None,
+            'last_created_at': self.last_created_at.isoformat() if self.last_created_at else None,
+            'archive': self.archive
+        }
+
+
+class Lease(db.Model):
+    """Expiring claim on an operation, shared by every worker through the database."""
+    __tablename__ = 'leases'
+
+    key = db.Column(db.String(200), primary_key=True)  # e.g. guest:<connection_id>:<vmid>
+    owner = db.Column(db.String(200), nullable=False)  # host:pid:token of the holder
+    operation = db.Column(db.String(50), nullable=False)  # deploy, provision, delete
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'owner': self.owner,
+            'operation': self.operation,
+            'acquired_at': self.acquired_at.isoformat() if self.acquired_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
+class IdempotencyKey(db.Model):
+    """A mutating request's Idempotency-Key and, once it finished, its response."""
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(200), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of method, path and body
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # in_progress, done
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'request_hash': self.request_hash,
+            'status': self.status,
+            'response_status': self.response_status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
+class DeploymentEvent(db.Model):
+    """Append-only record of something that happened to a deployment."""
+    __tablename__ = 'deployment_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    deployment_id = db.Column(db.Integer, nullable=False, index=True)  # kept after the deployment is deleted
+    event = db.Column(db.String(50), nullable=False)  # status, create, provision, ...
+    from_status = db.Column(db.String(50), nullable=True)
+    to_status = db.Column(db.String(50), nullable=True)
+    message = db.Column(db.Text, nullable=True)
+    payload = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'deployment_id': self.deployment_id,
+            'event': self.event,
+            'from_status': self.from_status,
+            'to_status': self.to_status,
+            'message': self.message,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
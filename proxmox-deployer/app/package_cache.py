@@ -0,0 +1,205 @@
+"""
+Per-node Package Caches
+Manages one caching proxy container per Proxmox node: apt-cacher-ng for apt
+and Docker packages, and a Docker Hub pull-through registry for images.
+Install scripts rendered for a node with a ready cache download through it.
+Caches belong to a (connection, node) pair, so clusters with the same node
+names never share one.
+"""
+
+import json
+from typing import Optional, Dict, Any
+
+from app import db
+from app.models import PackageCache
+from app.proxmox_client import ProxmoxClient
+
+APT_CACHE_PORT = 3142
+REGISTRY_MIRROR_PORT = 5000
+
+# Runs inside the cache container
+CACHE_SETUP_SCRIPT = """#!/bin/bash
+set -e
+
+export DEBIAN_FRONTEND=noninteractive
+apt-get update
+apt-get install -y apt-cacher-ng curl ca-certificates
+
+# Cache download.docker.com under /docker, allow its unversioned key file, and
+# tunnel (without caching) any other HTTPS traffic
+cat > /etc/apt-cacher-ng/zz-gameserver.conf << 'EOF'
+Port: 3142
+Remap-docker: /docker ; https://download.docker.com
+VfilePatternEx: (/gpg|\\.asc)$
+PassThroughPattern: .*
+EOF
+systemctl enable apt-cacher-ng
+systemctl restart apt-cacher-ng
+
+# Docker Hub pull-through cache
+curl -fsSL https://get.docker.com | sh
+systemctl enable docker
+systemctl start docker
+mkdir -p /var/lib/registry
+docker rm -f registry 2>/dev/null || true
+docker run -d --restart always --name registry \\
+    -p 5000:5000 \\
+    -v /var/lib/registry:/var/lib/registry \\
+    -e REGISTRY_PROXY_REMOTEURL=https://registry-1.docker.io \\
+    registry:2
+
+# Bytes served to clients vs. fetched upstream, as JSON
+cat > /usr/local/bin/cache-stats << 'EOF'
+#!/bin/bash
+read apt_in apt_out < <(zcat -f /var/log/apt-cacher-ng/apt-cacher.log* 2>/dev/null |
+    awk -F'|' '$2 == "I" {i += $3} $2 == "O" {o += $3} END {printf "%d %d\\n", i, o}')
+registry_out=$(docker logs registry 2>&1 |
+    grep -oE '"GET /v2/[^"]*/blobs/[^"]*" 200 [0-9]+' | awk '{s += $NF} END {printf "%d", s}')
+registry_in=$(du -sb /var/lib/registry 2>/dev/null | cut -f1)
+echo "{\\"apt_in\\": ${apt_in:-0}, \\"apt_out\\": ${apt_out:-0}, \\"registry_in\\": ${registry_in:-0}, \\"registry_out\\": ${registry_out:-0}}"
+EOF
+chmod +x /usr/local/bin/cache-stats
+
+echo "Package cache ready"
+"""
+
+
+def get_package_cache_address(connection_id: int, node: str) -> Optional[str]:
+    """Get the address of a node's ready package cache (used when rendering scripts)."""
+    row = db.session.query(PackageCache.ip_address).filter_by(
+        connection_id=connection_id, node=node, status='ready'
+    ).first()
+    return row.ip_address if row else None
+
+
+def get_package_cache_record(connection_id: int, node: str) -> Optional[PackageCache]:
+    """Get the package cache record for a node."""
+    return PackageCache.query.filter_by(connection_id=connection_id, node=node).first()
+
+
+def deploy_package_cache(connection, node: str, template: str, storage: str = 'local-lvm',
+                         disk_size: int = 100, bridge: str = 'vmbr0', ip_address: str = None,
+                         cidr: int = 24, gateway: str = None) -> PackageCache:
+    """
+    Create and provision the package cache container for a node.
+
+    A static IP is recommended, since every script rendered for the node
+    refers to the cache by address.
+
+    Args:
+        connection: ProxmoxConnection model instance (must use password auth)
+        node: Proxmox node the cache serves
+        template: OS template volid (Debian or Ubuntu)
+        storage: Storage for the cache's root disk
+        disk_size: Root disk size in GB (holds cached packages and images)
+        bridge: Network bridge
+        ip_address: Static IP (DHCP when omitted)
+        cidr: Prefix length for the static IP
+        gateway: Gateway for the static IP
+
+    Returns:
+        The PackageCache record ('ready' or 'failed')
+    """
+    cache = get_package_cache_record(connection.id, node)
+    if not cache:
+        cache = PackageCache(connection_id=connection.id, node=node)
+        db.session.add(cache)
+    cache.status = 'building'
+    cache.error_message = None
+    db.session.commit()
+
+    def fail(message):
+        cache.status = 'failed'
+        cache.error_message = message
+        db.session.commit()
+        return cache
+
+    if not connection.password:
+        return fail('Password authentication required for provisioning. API tokens cannot use SSH.')
+
+    client = ProxmoxClient(connection)
+    if cache.vmid:
+        client.stop_container(node, cache.vmid, 'lxc')
+        client.wait_for_status(node, cache.vmid, 'stopped', timeout=60)
+        client.delete_container(node, cache.vmid, 'lxc')
+        cache.vmid = None
+
+    result = client.create_lxc(node, {
+        'hostname': f'package-cache-{node}'[:63],
+        'template': template,
+        'storage': storage,
+        'disk_size': disk_size,
+        'cores': 2,
+        'memory': 1024,
+        'bridge': bridge,
+        'dhcp': not ip_address,
+        'ip_address': ip_address,
+        'cidr': cidr,
+        'gateway': gateway,
+        'start': True,
+        'onboot': True,
+        'nesting': True,
+    })
+    if not result['success']:
+        return fail(f"Create failed: {result.get('error')}")
+    cache.vmid = result['vmid']
+    db.session.commit()
+
+    client.wait_for_status(node, cache.vmid, 'running')
+    provision = client.provision_container(node, cache.vmid, CACHE_SETUP_SCRIPT, timeout=1800)
+    if not provision['success']:
+        return fail(f"Provisioning failed: {provision.get('error')}")
+
+    if not ip_address:
+        address = client.exec_in_container(node, cache.vmid, 'hostname -I')
+        ip_address = (address.get('output') or '').split()[0] if address['success'] else None
+        if not ip_address:
+            return fail('Could not determine the cache container address')
+
+    cache.ip_address = ip_address
+    cache.status = 'ready'
+    db.session.commit()
+    return cache
+
+
+def remove_package_cache(cache: PackageCache) -> Dict[str, Any]:
+    """Destroy a node's package cache; scripts go back to downloading directly."""
+    if cache.vmid:
+        client = ProxmoxClient(cache.connection)
+        client.stop_container(cache.node, cache.vmid, 'lxc')
+        client.wait_for_status(cache.node, cache.vmid, 'stopped', timeout=60)
+        result = client.delete_container(cache.node, cache.vmid, 'lxc')
+        if not result['success']:
+            return result
+    db.session.delete(cache)
+    db.session.commit()
+    return {'success': True}
+
+
+def get_bandwidth_stats(cache: PackageCache) -> Dict[str, Any]:
+    """
+    Report how much upstream bandwidth a package cache saved.
+
+    Returns:
+        Dict with bytes served to containers, bytes fetched upstream and the
+        difference, for apt and for container images
+    """
+    client = ProxmoxClient(cache.connection)
+    result = client.exec_in_container(cache.node, cache.vmid, '/usr/local/bin/cache-stats')
+    if not result['success']:
+        return {'success': False, 'error': result.get('error')}
+    try:
+        raw = json.loads(result['output'])
+    except ValueError:
+        return {'success': False, 'error': 'Unreadable cache statistics'}
+
+    stats = {'success': True, 'node': cache.node}
+    for kind in ('apt', 'registry'):
+        served, fetched = raw[f'{kind}_out'], raw[f'{kind}_in']
+        stats[kind] = {
+            'served_bytes': served,
+            'upstream_bytes': fetched,
+            'saved_bytes': max(0, served - fetched),
+        }
+    stats['saved_bytes'] = stats['apt']['saved_bytes'] + stats['registry']['saved_bytes']
+    return stats
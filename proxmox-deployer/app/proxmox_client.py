@@ -5,12 +5,19 @@ Handles LXC container and VM creation, management, and monitoring.
 
 import time
 import urllib3
+from types import SimpleNamespace
 from typing import Optional, Dict, Any, List
 from proxmoxer import ProxmoxAPI
 
+from app.task_throttle import get_task_throttle
+
 # Disable SSL warnings for self-signed certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Storage types that can back linked clones (file storages need qcow2 disks)
+LINKED_CLONE_STORAGE_TYPES = {'zfspool', 'lvmthin', 'rbd'}
+VM_DISK_PREFIXES = ('scsi', 'virtio', 'sata', 'ide', 'efidisk', 'tpmstate')
+
 # Try to import paramiko for SSH provisioning
 try:
     import paramiko
@@ -19,6 +26,14 @@ except ImportError:
     HAS_PARAMIKO = False
 
 
+def detached_connection(connection) -> SimpleNamespace:
+    """Copy a connection's credentials so worker threads never touch the DB session."""
+    return SimpleNamespace(**{
+        field: getattr(connection, field)
+        for field in ('host', 'port', 'username', 'password', 'token_name', 'token_value', 'verify_ssl')
+    })
+
+
 class ProxmoxClient:
     """Client for interacting with Proxmox VE API."""
 
@@ -100,6 +115,7 @@ class ProxmoxClient:
                                 'volid': item['volid'],
                                 'name': item.get('volid', '').split('/')[-1],
                                 'size': item.get('size', 0),
+                                'ctime': item.get('ctime'),
                                 'storage': storage['storage']
                             })
                 except Exception:
@@ -120,6 +136,37 @@ class ProxmoxClient:
 
         return templates
 
+    def get_appliance_index(self, node: str) -> List[Dict[str, Any]]:
+        """Get the node's index of downloadable LXC templates (pveam available)."""
+        try:
+            return [
+                item for item in self.api.nodes(node).aplinfo.get()
+                if item.get('type', 'lxc') == 'lxc'
+            ]
+        except Exception:
+            return []
+
+    def download_template(self, node: str, storage: str, template: str,
+                          timeout: int = 1800) -> Dict[str, Any]:
+        """
+        Download an LXC template from the appliance index (pveam download).
+
+        Args:
+            node: Proxmox node name
+            storage: Storage with 'vztmpl' content
+            template: Template file name from the appliance index
+            timeout: Seconds to wait for the download task
+
+        Returns:
+            Dict with success status and the template's volid
+        """
+        try:
+            task = self.api.nodes(node).aplinfo.post(storage=storage, template=template)
+            self._wait_for_task(node, task, timeout=timeout)
+            return {'success': True, 'volid': f'{storage}:vztmpl/{template}'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
     def get_storage_pools(self, node: str) -> List[Dict[str, Any]]:
         """Get available storage pools on a node."""
         storages = self.api.nodes(node).storage.get()
@@ -157,10 +204,39 @@ class ProxmoxClient:
         """Get the next available VMID."""
         return self.api.cluster.nextid.get()
 
+    def is_vmid_free(self, vmid: int) -> bool:
+        """Check that no container or VM uses a VMID."""
+        try:
+            # Proxmox rejects a taken VMID here
+            self.api.cluster.nextid.get(vmid=vmid)
+            return True
+        except Exception:
+            return False
+
+    def get_guests(self) -> List[Dict[str, Any]]:
+        """Get every LXC container and VM in the cluster."""
+        resources = self.api.cluster.resources.get(type='vm')
+        return [{
+            'vmid': int(r['vmid']),
+            'node': r.get('node', ''),
+            'type': r.get('type', ''),  # 'lxc' or 'qemu'
+            'name': r.get('name', ''),
+            'status': r.get('status', 'unknown')
+        } for r in resources]
+
     def _netmask_to_cidr(self, netmask: str) -> int:
         """Convert netmask to CIDR notation."""
         return sum([bin(int(x)).count('1') for x in netmask.split('.')])
 
+    def _lxc_net_config(self, config: Dict[str, Any]) -> str:
+        """Build the net0 string for an LXC container."""
+        if config.get('dhcp', True):
+            return f"name=eth0,bridge={config.get('bridge', 'vmbr0')},ip=dhcp"
+        ip = config.get('ip_address', '')
+        cidr = config.get('cidr', 24)
+        gw = config.get('gateway', '')
+        return f"name=eth0,bridge={config.get('bridge', 'vmbr0')},ip={ip}/{cidr},gw={gw}"
+
     def create_lxc(self, node: str, config: Dict[str, Any]) -> Dict[str, Any]:
         """
         Create an LXC container.
@@ -173,15 +249,7 @@ class ProxmoxClient:
             Dict with vmid and status
         """
         vmid = config.get('vmid') or self.get_next_vmid()
-
-        # Build network string
-        if config.get('dhcp', True):
-            net_config = f"name=eth0,bridge={config.get('bridge', 'vmbr0')},ip=dhcp"
-        else:
-            ip = config.get('ip_address', '')
-            cidr = config.get('cidr', 24)
-            gw = config.get('gateway', '')
-            net_config = f"name=eth0,bridge={config.get('bridge', 'vmbr0')},ip={ip}/{cidr},gw={gw}"
+        net_config = self._lxc_net_config(config)
 
         # Container parameters
         params = {
@@ -220,13 +288,22 @@ class ProxmoxClient:
         if config.get('mounts'):
             for i, mount in enumerate(config['mounts']):
                 params[f'mp{i}'] = f"{mount['source']},mp={mount['target']}"
+                if mount.get('read_only'):
+                    params[f'mp{i}'] += ',ro=1'
+
+        # Restore from a vzdump archive (e.g. a golden template) instead of a bare OS template
+        if config.get('restore'):
+            params['restore'] = 1
+            params['unique'] = 1
 
         try:
-            # Create the container
-            task = self.api.nodes(node).lxc.create(**params)
+            # Create the container, queueing behind other heavy tasks on this node/storage
+            kind = 'lxc_restore' if config.get('restore') else 'lxc_create'
+            with get_task_throttle().slot(node, params['storage'], kind):
+                task = self.api.nodes(node).lxc.create(**params)
 
-            # Wait for task completion
-            self._wait_for_task(node, task)
+                # Wait for task completion
+                self._wait_for_task(node, task)
 
             return {
                 'success': True,
@@ -253,21 +330,26 @@ class ProxmoxClient:
         """
         vmid = config.get('vmid') or self.get_next_vmid()
         template_vmid = config['template_vmid']
+        linked = config.get('clone_mode') == 'linked'
 
         try:
-            # Clone the template
+            # Clone the template (linked clones share the template's base disk)
             clone_params = {
                 'newid': vmid,
                 'name': config.get('hostname', f'gameserver-{vmid}'),
-                'full': True,
+                'full': not linked,
                 'target': node,
             }
 
-            if config.get('storage'):
+            if config.get('storage') and not linked:
                 clone_params['storage'] = config['storage']
 
-            task = self.api.nodes(node).qemu(template_vmid).clone.create(**clone_params)
-            self._wait_for_task(node, task)
+            kind = 'vm_clone_linked' if linked else 'vm_clone_full'
+            with get_task_throttle().slot(node, clone_params.get('storage'), kind):
+                clone_started = time.time()
+                task = self.api.nodes(node).qemu(template_vmid).clone.create(**clone_params)
+                self._wait_for_task(node, task, timeout=config.get('clone_timeout', 300 if linked else 3600))
+                clone_seconds = round(time.time() - clone_started, 1)
 
             # Configure the cloned VM
             vm_config = {}
@@ -308,7 +390,9 @@ class ProxmoxClient:
             return {
                 'success': True,
                 'vmid': vmid,
-                'type': 'vm'
+                'type': 'vm',
+                'clone_mode': 'linked' if linked else 'full',
+                'clone_seconds': clone_seconds
             }
         except Exception as e:
             return {
@@ -317,6 +401,221 @@ class ProxmoxClient:
                 'vmid': vmid
             }
 
+    def _vm_disks(self, node: str, vmid: int) -> Dict[str, str]:
+        """Map disk keys (scsi0, efidisk0, ...) to volume IDs for a VM."""
+        vm_config = self.api.nodes(node).qemu(vmid).config.get()
+        disks = {}
+        for key, value in vm_config.items():
+            if key.startswith(VM_DISK_PREFIXES) and isinstance(value, str) and 'media=cdrom' not in value:
+                volid = value.split(',')[0]
+                if ':' in volid:
+                    disks[key] = volid
+        return disks
+
+    def supports_linked_clone(self, node: str, template_vmid: int) -> bool:
+        """Check whether every disk of a VM template sits on storage that can do linked clones."""
+        try:
+            disks = self._vm_disks(node, template_vmid)
+            if not disks:
+                return False
+            for volid in disks.values():
+                storage = volid.split(':')[0]
+                storage_type = self.api.storage(storage).get().get('type')
+                if storage_type not in LINKED_CLONE_STORAGE_TYPES and not volid.endswith('.qcow2'):
+                    return False
+            return True
+        except Exception:
+            return False
+
+    def get_vm_disk_usage(self, node: str, vmid: int) -> Dict[str, Any]:
+        """
+        Get provisioned and actually used space for a VM's disks.
+
+        Returns:
+            Dict with per-disk details, totals in bytes, and whether any
+            disk is still backed by a template base volume (linked clone)
+        """
+        try:
+            disks = []
+            for key, volid in self._vm_disks(node, vmid).items():
+                storage = volid.split(':')[0]
+                info = self.api.nodes(node).storage(storage).content(volid).get()
+                disks.append({
+                    'disk': key,
+                    'volid': volid,
+                    'size': info.get('size', 0),
+                    'used': info.get('used', info.get('size', 0)),
+                    'linked': 'base-' in volid
+                })
+            return {
+                'success': True,
+                'disks': disks,
+                'size': sum(d['size'] for d in disks),
+                'used': sum(d['used'] for d in disks),
+                'linked': any(d['linked'] for d in disks)
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def move_vm_disk(self, node: str, vmid: int, disk: str, storage: str,
+                     timeout: int = 3600) -> Dict[str, Any]:
+        """
+        Move a VM disk to another storage, deleting the source volume.
+
+        Moving a linked clone's disk copies every block, so the disk no
+        longer depends on the template's base volume.
+        """
+        try:
+            with get_task_throttle().slot(node, storage, 'vm_move_disk'):
+                task = self.api.nodes(node).qemu(vmid).move_disk.post(disk=disk, storage=storage, delete=1)
+                self._wait_for_task(node, task, timeout=timeout)
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def wait_for_status(self, node: str, vmid: int, status: str, container_type: str = 'lxc',
+                        timeout: int = 120) -> bool:
+        """Poll a container or VM until it reaches a status (e.g. 'stopped')."""
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            result = self.get_container_status(node, vmid, container_type)
+            if result.get('success') and result.get('status') == status:
+                return True
+            time.sleep(2)
+        return False
+
+    def vzdump(self, node: str, vmid: int, storage: str, compress: str = 'zstd',
+               notes: str = None, timeout: int = 3600) -> Dict[str, Any]:
+        """
+        Back up a guest with vzdump and return the resulting archive.
+
+        Args:
+            node: Proxmox node name
+            vmid: Guest VMID
+            storage: Storage that accepts 'backup' content
+            compress: Compression algorithm (zstd, gzip, lzo or 0)
+            notes: Notes template stored with the backup
+            timeout: Seconds to wait for the backup task
+
+        Returns:
+            Dict with success status and the archive volid and size
+        """
+        try:
+            params = {'vmid': vmid, 'storage': storage, 'compress': compress, 'mode': 'stop'}
+            if notes:
+                params['notes-template'] = notes
+            with get_task_throttle().slot(node, storage, 'vzdump'):
+                task = self.api.nodes(node).vzdump.create(**params)
+                self._wait_for_task(node, task, timeout=timeout)
+
+            backups = [
+                item for item in self.api.nodes(node).storage(storage).content.get(content='backup')
+                if str(item.get('vmid')) == str(vmid)
+            ]
+            if not backups:
+                return {'success': False, 'error': 'Backup finished but no archive was found'}
+            newest = max(backups, key=lambda item: item.get('ctime', 0))
+            return {
+                'success': True,
+                'volid': newest['volid'],
+                'size': newest.get('size', 0)
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def delete_volume(self, node: str, storage: str, volid: str) -> Dict[str, Any]:
+        """Delete a volume (e.g. a backup archive) from a storage."""
+        try:
+            self.api.nodes(node).storage(storage).content(volid).delete()
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def snapshot_container(self, node: str, vmid: int, snapname: str,
+                           description: str = None) -> Dict[str, Any]:
+        """Take a snapshot of an LXC container."""
+        try:
+            params = {'snapname': snapname}
+            if description:
+                params['description'] = description
+            task = self.api.nodes(node).lxc(vmid).snapshot.create(**params)
+            self._wait_for_task(node, task)
+            return {'success': True, 'snapname': snapname}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def delete_snapshot(self, node: str, vmid: int, snapname: str) -> Dict[str, Any]:
+        """Delete a snapshot of an LXC container."""
+        try:
+            task = self.api.nodes(node).lxc(vmid).snapshot(snapname).delete()
+            self._wait_for_task(node, task)
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def clone_lxc(self, node: str, vmid: int, newid: int, hostname: str, full: bool = True,
+                  snapname: str = None, storage: str = None, timeout: int = 1800) -> Dict[str, Any]:
+        """
+        Clone an LXC container.
+
+        Args:
+            node: Proxmox node name
+            vmid: Source container (must be a template for linked clones)
+            newid: VMID for the clone
+            hostname: Hostname for the clone
+            full: Full copy instead of a linked clone
+            snapname: Snapshot to clone from (full clones of a live container)
+            storage: Target storage (full clones only)
+            timeout: Seconds to wait for the clone task
+
+        Returns:
+            Dict with success status and the new vmid
+        """
+        try:
+            params = {'newid': newid, 'hostname': hostname, 'full': 1 if full else 0}
+            if snapname:
+                params['snapname'] = snapname
+            if storage and full:
+                params['storage'] = storage
+            kind = 'lxc_clone_full' if full else 'lxc_clone_linked'
+            with get_task_throttle().slot(node, params.get('storage'), kind):
+                task = self.api.nodes(node).lxc(vmid).clone.create(**params)
+                self._wait_for_task(node, task, timeout=timeout)
+            return {'success': True, 'vmid': newid, 'type': 'lxc'}
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'vmid': newid}
+
+    def convert_to_template(self, node: str, vmid: int) -> Dict[str, Any]:
+        """Convert a stopped LXC container into a template."""
+        try:
+            self.api.nodes(node).lxc(vmid).template.post()
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def update_lxc_config(self, node: str, vmid: int, config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Apply resource and network overrides to an existing container.
+
+        Args:
+            config: Any of hostname, cores, memory, swap, onboot and the
+                network keys accepted by create_lxc (dhcp, ip_address, ...)
+        """
+        params = {}
+        for key in ('hostname', 'cores', 'memory', 'swap'):
+            if config.get(key):
+                params[key] = config[key]
+        if 'onboot' in config:
+            params['onboot'] = 1 if config['onboot'] else 0
+        if 'dhcp' in config or config.get('ip_address'):
+            params['net0'] = self._lxc_net_config(config)
+        try:
+            if params:
+                self.api.nodes(node).lxc(vmid).config.put(**params)
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
     def _wait_for_task(self, node: str, task: str, timeout: int = 300):
         """Wait for a Proxmox task to complete."""
         start_time = time.time()
@@ -352,12 +651,14 @@ class ProxmoxClient:
             return {'success': False, 'error': str(e)}
 
     def delete_container(self, node: str, vmid: int, container_type: str = 'lxc') -> Dict[str, Any]:
-        """Delete an LXC container or VM."""
+        """Delete an LXC container or VM and wait for its disks to be freed."""
         try:
-            if container_type == 'lxc':
-                self.api.nodes(node).lxc(vmid).delete()
-            else:
-                self.api.nodes(node).qemu(vmid).delete()
+            with get_task_throttle().slot(node, kind=f'{container_type}_delete'):
+                if container_type == 'lxc':
+                    task = self.api.nodes(node).lxc(vmid).delete()
+                else:
+                    task = self.api.nodes(node).qemu(vmid).delete()
+                self._wait_for_task(node, task)
             return {'success': True}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -384,18 +685,21 @@ class ProxmoxClient:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def provision_container(self, node: str, vmid: int, script: str, timeout: int = 600) -> Dict[str, Any]:
+    def provision_container(self, node: str, vmid: int, script: str, timeout: int = 600,
+                            force: bool = False) -> Dict[str, Any]:
         """
         Provision an LXC container by running an installation script inside it.
 
         Uses SSH to connect to the Proxmox host and runs 'pct exec' to execute
-        the script inside the container.
+        the script inside the container. Steps already completed by an earlier
+        run are skipped unless force is set.
 
         Args:
             node: Proxmox node name
             vmid: Container VMID
             script: Bash script to execute inside the container
             timeout: SSH command timeout in seconds
+            force: Discard provisioning checkpoints and rerun every step
 
         Returns:
             Dict with success status and output/error
@@ -443,8 +747,9 @@ class ProxmoxClient:
 
             # Execute script inside the container using pct exec
             # Use bash -c to run the script
+            env_prefix = 'env PROVISION_FORCE=1 ' if force else ''
             stdin, stdout, stderr = ssh.exec_command(
-                f'pct exec {vmid} -- bash /tmp/provision.sh',
+                f'pct exec {vmid} -- {env_prefix}bash /tmp/provision.sh',
                 timeout=timeout
             )
 
@@ -495,6 +800,33 @@ class ProxmoxClient:
             vmid: Container VMID
             command: Command to execute
 
+        Returns:
+            Dict with success status and output/error
+        """
+        return self.exec_on_host(f'pct exec {vmid} -- {command}', timeout=timeout)
+
+    def exec_on_node(self, node: str, command: str, timeout: int = 60) -> Dict[str, Any]:
+        """
+        Execute a shell command on a specific cluster node.
+
+        Runs directly when the connection's host is that node, otherwise hops
+        over the cluster's own root SSH trust.
+        """
+        quoted = command.replace("'", "'\\''")
+        return self.exec_on_host(
+            f'if [ "$(hostname)" = "{node}" ]; then bash -c \'{quoted}\'; '
+            f'else ssh -o BatchMode=yes root@{node} \'{quoted}\'; fi',
+            timeout=timeout
+        )
+
+    def exec_on_host(self, command: str, timeout: int = 60) -> Dict[str, Any]:
+        """
+        Execute a shell command on the Proxmox host over SSH.
+
+        Args:
+            command: Command to execute
+            timeout: SSH command timeout in seconds
+
         Returns:
             Dict with success status and output/error
         """
@@ -521,10 +853,7 @@ class ProxmoxClient:
                 timeout=30
             )
 
-            stdin, stdout, stderr = ssh.exec_command(
-                f'pct exec {vmid} -- {command}',
-                timeout=timeout
-            )
+            stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
 
             output = stdout.read().decode('utf-8', errors='replace')
             error = stderr.read().decode('utf-8', errors='replace')
@@ -0,0 +1,418 @@
+"""
+Deployment History Retention
+Deployments whose guest is gone, and deploys that failed, stay in the
+deployments table long after anyone looks at them. Retention archives those
+older than the policy's age to compressed NDJSON files (with their event
+history), replaces them with per-month summary counts, and vacuums the
+database once enough space has been freed.
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import select, delete, update, func
+
+from app import db
+from app.leases import acquire_lease, get_lease
+from app.models import ProxmoxConnection, Deployment, DeploymentEvent, DeploymentSummary
+from app.proxmox_client import ProxmoxClient
+from app.aggregates import subtract_deployments
+from app.config_blobs import remove_unused_blobs
+from app.events import get_event_writer
+from app.idempotency import purge_expired_keys
+
+# Statuses a guest should exist in; ones missing from the cluster become 'gone'
+LIVE_STATUSES = ('running', 'stopped', 'provision_failed')
+
+SUMMARY_FIELDS = ('connection_id', 'server_key', 'node', 'deployment_type', 'status')
+
+RETENTION_LEASE = 'retention'
+
+_last_report = None
+
+
+def mark_missing_guests(connection: ProxmoxConnection) -> Dict[str, Any]:
+    """
+    Set deployments whose container/VM no longer exists to 'gone'.
+
+    Goes through the ORM, so the dashboard counts and the event log see
+    the change. Nothing is marked if the cluster cannot be listed.
+
+    Returns:
+        Dict with success and the IDs of deployments marked gone
+    """
+    try:
+        vmids = {guest['vmid'] for guest in ProxmoxClient(connection).get_guests()}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+    missing = (
+        Deployment.query
+        .filter(Deployment.connection_id == connection.id,
+                Deployment.status.in_(LIVE_STATUSES),
+                Deployment.vmid.isnot(None))
+        .all()
+    )
+    marked = []
+    for deployment in missing:
+        if deployment.vmid not in vmids:
+            deployment.status = 'gone'
+            deployment.error_message = f'Guest {deployment.vmid} no longer exists on {deployment.node}'
+            marked.append(deployment.id)
+    db.session.commit()
+    return {'success': True, 'marked': marked}
+
+
+def _candidates(statuses: List[str], cutoff: datetime):
+    """Deployments in a retained status, untouched since the cutoff."""
+    return Deployment.query.filter(
+        Deployment.status.in_(statuses),
+        func.coalesce(Deployment.updated_at, Deployment.created_at) < cutoff
+    )
+
+
+def _events_by_deployment(ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    events = defaultdict(list)
+    query = DeploymentEvent.query.filter(DeploymentEvent.deployment_id.in_(ids)).order_by(DeploymentEvent.id)
+    for event in query.all():
+        events[event.deployment_id].append(event.to_dict())
+    return events
+
+
+def _write_archive(path: str, query, batch_size: int) -> List[int]:
+    """
+    Write every matching deployment, with its events, to a gzipped NDJSON file.
+
+    The file is written under a temporary name and renamed once synced, so
+    a finished archive is never partial.
+
+    Returns:
+        IDs of the archived deployments
+    """
+    archived = []
+    partial = path + '.partial'
+    last_id = 0
+    with open(partial, 'wb') as raw:
+        with gzip.open(raw, 'wt', encoding='utf-8') as archive:
+            while True:
+                batch = query.filter(Deployment.id > last_id).order_by(Deployment.id).limit(batch_size).all()
+                if not batch:
+                    break
+                events = _events_by_deployment([d.id for d in batch])
+                for deployment in batch:
+                    record = deployment.to_dict()
+                    record['events'] = events.get(deployment.id, [])
+                    archive.write(json.dumps(record) + '\n')
+                    archived.append(deployment.id)
+                last_id = batch[-1].id
+                db.session.expunge_all()
+        raw.flush()
+        os.fsync(raw.fileno())
+    if not archived:
+        os.remove(partial)
+        return archived
+    os.replace(partial, path)
+    return archived
+
+
+def _add_to_summaries(conn, rows, archive_name: str):
+    """Add deleted deployment rows to the per-month summary counts."""
+    groups = {}
+    for row in rows:
+        created_at = row['created_at']
+        key = (created_at.strftime('%Y-%m') if created_at else '',) + tuple(row[field] for field in SUMMARY_FIELDS)
+        group = groups.setdefault(key, {'count': 0, 'first': created_at, 'last': created_at})
+        group['count'] += 1
+        if created_at and (group['first'] is None or created_at < group['first']):
+            group['first'] = created_at
+        if created_at and (group['last'] is None or created_at > group['last']):
+            group['last'] = created_at
+
+    table = DeploymentSummary.__table__
+    for key, group in groups.items():
+        match = dict(zip(('month',) + SUMMARY_FIELDS, key))
+        existing = conn.execute(
+            select(table).where(*[table.c[field] == value for field, value in match.items()])
+        ).first()
+        if existing is None:
+            conn.execute(table.insert().values(
+                **match, count=group['count'], first_created_at=group['first'],
+                last_created_at=group['last'], archive=archive_name
+            ))
+            continue
+        first = min(filter(None, (existing.first_created_at, group['first'])), default=None)
+        last = max(filter(None, (existing.last_created_at, group['last'])), default=None)
+        conn.execute(update(table).where(table.c.id == existing.id).values(
+            count=table.c.count + group['count'], first_created_at=first,
+            last_created_at=last, archive=archive_name
+        ))
+
+
+def _delete_archived(ids: List[int], statuses: List[str], archive_name: str,
+                     batch_size: int) -> Dict[str, int]:
+    """
+    Delete archived deployments in batches, each in one transaction with
+    its summary rows, count adjustments and event deletes, then drop
+    config blobs nothing references any more.
+
+    A batch that another process changed or compacted meanwhile is left
+    for the next run.
+    """
+    deployments = Deployment.__table__
+    events = DeploymentEvent.__table__
+    columns = [deployments.c[field] for field in ('id', 'created_at') + SUMMARY_FIELDS]
+    outcome = {'deleted': 0, 'skipped': 0}
+    db.session.remove()
+
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        with db.engine.connect() as conn:
+            transaction = conn.begin()
+            rows = [row._mapping for row in conn.execute(
+                select(*columns).where(deployments.c.id.in_(chunk), deployments.c.status.in_(statuses))
+            ).all()]
+            deleted = conn.execute(
+                delete(deployments).where(deployments.c.id.in_([row['id'] for row in rows]))
+            ).rowcount
+            if deleted != len(rows):
+                transaction.rollback()
+                outcome['skipped'] += len(chunk)
+                continue
+            conn.execute(delete(events).where(events.c.deployment_id.in_([row['id'] for row in rows])))
+            _add_to_summaries(conn, rows, archive_name)
+            subtract_deployments(conn, rows)
+            transaction.commit()
+            outcome['deleted'] += deleted
+            outcome['skipped'] += len(chunk) - deleted
+
+    # Configs only the deleted deployments used
+    with db.engine.begin() as conn:
+        outcome['blobs_removed'] = remove_unused_blobs(conn)
+    return outcome
+
+
+def compact_deployments(archive_dir: str, days: int, statuses: List[str],
+                        batch_size: int = 1000, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Archive and remove terminal deployments older than the retention age.
+
+    Args:
+        archive_dir: Directory for the gzipped NDJSON archives
+        days: Keep deployments changed within this many days
+        statuses: Statuses that may be compacted (e.g. failed, gone)
+        batch_size: Rows read and deleted per transaction
+        dry_run: Only count what would be compacted
+
+    Returns:
+        Dict with per-status counts, and the archive file and deleted count
+        unless dry_run
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    query = _candidates(statuses, cutoff)
+    by_status = dict(
+        query.with_entities(Deployment.status, func.count()).group_by(Deployment.status).all()
+    )
+    result = {
+        'cutoff': cutoff.isoformat(),
+        'statuses': list(statuses),
+        'by_status': by_status,
+        'candidates': sum(by_status.values()),
+    }
+    if dry_run or not result['candidates']:
+        return result
+
+    writer = get_event_writer()
+    if writer:
+        writer.flush()
+
+    os.makedirs(archive_dir, exist_ok=True)
+    # Unique even when two runs start in the same second; os.replace would overwrite
+    archive_name = f"deployments-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}.ndjson.gz"
+    ids = _write_archive(os.path.join(archive_dir, archive_name), query, batch_size)
+    result['archive'] = archive_name if ids else None
+    result['archived'] = len(ids)
+    result.update(_delete_archived(ids, statuses, archive_name, batch_size))
+    return result
+
+
+def vacuum_database(engine, min_free_ratio: float = 0.1, force: bool = False) -> Dict[str, Any]:
+    """
+    Reclaim space left by deleted rows.
+
+    SQLite is rebuilt with VACUUM, which locks the database while it runs,
+    so it only happens once free pages pass min_free_ratio of the file.
+    PostgreSQL gets a plain VACUUM ANALYZE of the deployment tables, which
+    does not block reads or writes.
+
+    Args:
+        engine: SQLAlchemy engine
+        min_free_ratio: Free page fraction that makes SQLite worth rebuilding
+        force: Vacuum regardless of free space
+
+    Returns:
+        Dict with whether it ran, and SQLite file sizes before and after
+    """
+    started = time.time()
+    result = {'backend': engine.dialect.name, 'vacuumed': False}
+    if engine.dialect.name == 'sqlite':
+        def pages(conn):
+            return {pragma: conn.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+                    for pragma in ('page_size', 'page_count', 'freelist_count')}
+
+        with engine.connect() as conn:
+            before = pages(conn)
+        result['free_ratio'] = round(before['freelist_count'] / before['page_count'], 3) if before['page_count'] else 0
+        result['bytes_before'] = before['page_size'] * before['page_count']
+        if not force and result['free_ratio'] < min_free_ratio:
+            return result
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+            if conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal':
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.exec_driver_sql('PRAGMA optimize')
+            after = pages(conn)
+        result['bytes_after'] = after['page_size'] * after['page_count']
+    elif engine.dialect.name == 'postgresql':
+        tables = ', '.join(model.__tablename__ for model in (Deployment, DeploymentEvent, DeploymentSummary))
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql(f'VACUUM (ANALYZE) {tables}')
+    else:
+        return result
+    result['vacuumed'] = True
+    result['seconds'] = round(time.time() - started, 1)
+    return result
+
+
+def run_retention(config: Dict[str, Any], days: int = None, dry_run: bool = False,
+                  vacuum: bool = True) -> Dict[str, Any]:
+    """
+    Apply the configured retention policy once.
+
+    Marks vanished guests as gone on every connection, compacts old
+    deployments, drops expired idempotency keys and vacuums the database.
+    Holds the retention lease throughout, so only one worker runs it at a
+    time.
+
+    Args:
+        config: App config with the RETENTION_*, ARCHIVE_DIR and VACUUM_FREE_RATIO settings
+        days: Override RETENTION_DAYS
+        dry_run: Only report what would be marked and compacted
+        vacuum: Vacuum after compacting
+
+    Returns:
+        Report of each step
+    """
+    global _last_report
+    lease = acquire_lease(RETENTION_LEASE, 'dry-run' if dry_run else 'retention', ttl=config['LEASE_TTL'])
+    if not lease:
+        raise RuntimeError('Retention is already running')
+    with lease:
+        started = time.time()
+        report = {'dry_run': dry_run, 'gone': {}}
+        if not dry_run:
+            for connection in ProxmoxConnection.query.all():
+                report['gone'][connection.name] = mark_missing_guests(connection)
+
+        report['compaction'] = compact_deployments(
+            config['ARCHIVE_DIR'],
+            config['RETENTION_DAYS'] if days is None else days,
+            config['RETENTION_STATUSES'],
+            dry_run=dry_run
+        )
+        if not dry_run:
+            report['idempotency_keys_purged'] = purge_expired_keys()
+        if vacuum and not dry_run:
+            report['vacuum'] = vacuum_database(db.engine, config['VACUUM_FREE_RATIO'])
+
+        report['seconds'] = round(time.time() - started, 1)
+        report['finished_at'] = datetime.utcnow().isoformat()
+        if not dry_run:
+            _last_report = report
+        return report
+
+
+def is_retention_running() -> bool:
+    """Whether any worker holds the retention lease."""
+    return get_lease(RETENTION_LEASE) is not None
+
+
+def get_retention_report() -> Optional[Dict[str, Any]]:
+    """Get the report of the last retention run in this process."""
+    return _last_report
+
+
+def list_archives(archive_dir: str) -> List[Dict[str, Any]]:
+    """List archive files, newest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    archives = []
+    for name in os.listdir(archive_dir):
+        if not name.endswith('.ndjson.gz'):
+            continue
+        stat = os.stat(os.path.join(archive_dir, name))
+        archives.append({
+            'name': name,
+            'size': stat.st_size,
+            'modified_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+        })
+    return sorted(archives, key=lambda a: a['name'], reverse=True)
+
+
+def get_summaries(month: str = None) -> List[Dict[str, Any]]:
+    """Get compacted deployment summaries, newest month first."""
+    query = DeploymentSummary.query
+    if month:
+        query = query.filter_by(month=month)
+    return [s.to_dict() for s in query.order_by(DeploymentSummary.month.desc(), DeploymentSummary.server_key).all()]
+
+
+def get_compacted_total() -> int:
+    return db.session.query(func.coalesce(func.sum(DeploymentSummary.count), 0)).scalar()
+
+
+def start_retention(app, days: int = None, vacuum: bool = True) -> threading.Thread:
+    """Run retention on a background thread."""
+    def run():
+        with app.app_context():
+            try:
+                run_retention(app.config, days=days, vacuum=vacuum)
+            except Exception as e:
+                app.logger.warning('Retention run failed: %s', e)
+            db.session.remove()
+
+    thread = threading.Thread(target=run, name='retention', daemon=True)
+    thread.start()
+    return thread
+
+
+class RetentionManager:
+    """Background thread that applies the retention policy on a schedule."""
+
+    def __init__(self, app, interval: float = 86400):
+        self.app = app
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    # Another worker's manager got there first
+                    if not is_retention_running():
+                        run_retention(self.app.config)
+                except Exception as e:
+                    self.app.logger.warning('Retention run failed: %s', e)
+                db.session.remove()
@@ -3,15 +3,55 @@ Flask routes for the Game Server Deployer
 Handles web UI and API endpoints for deployment management.
 """
 
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for
+import json
+from functools import lru_cache
+from flask import (
+    Blueprint, render_template, request, jsonify, redirect, url_for, current_app, Response,
+    stream_with_context
+)
 from app import db
-from app.models import ProxmoxConnection, Deployment, Credential
+from app.models import (
+    ProxmoxConnection, Deployment, Credential, GoldenTemplate, WarmPool, PackageCache, GameLayer,
+    FleetUpdate
+)
 from app.proxmox_client import ProxmoxClient
 from app.game_servers import (
-    GAME_SERVERS, CATEGORIES, STATS,
-    get_servers_by_category, get_server, search_servers
+    get_all_servers, get_all_categories, get_stats, get_catalog_version,
+    get_servers_by_category, get_servers_by_tag, get_servers_by_port,
+    get_server, search_servers
+)
+from app.install_scripts import render_install_script, get_available_scripts, get_render_stats
+from app.http_cache import CachedPayload
+from app.golden_templates import (
+    get_golden_template, golden_lease_key, new_golden_template, start_golden_build
+)
+from app.scale_out import scale_out_deployment
+from app.linked_clones import CLONE_MODES, record_disk_usage, start_promotion, clone_mode_stats
+from app.package_cache import deploy_package_cache, remove_package_cache, get_bandwidth_stats
+from app.depot_cache import prepare_depot_cache, depot_mount, list_depot_caches, purge_depot_cache
+from app.game_layers import (
+    get_game_layer, layer_mount, layered_disk_size, build_game_layer, delete_game_layer, layer_user_counts
+)
+from app.fleet_updates import plan_fleet_updates, create_fleet_updates, start_fleet_updates
+from app.template_prefetch import required_templates, get_prefetch_report, start_prefetch
+from app.database import database_info
+from app.task_throttle import get_task_throttle
+from app.aggregates import get_deployment_counts
+from app.events import record_event, record_status, get_events, get_event_writer
+from app.retention import (
+    run_retention, start_retention, is_retention_running, get_retention_report, list_archives,
+    get_summaries, get_compacted_total
+)
+from app.config_blobs import get_config_blob, diff_deployments, get_blob_stats
+from app.leases import acquire_lease, guest_lease_key, get_lease, list_leases, lease_free_vmid
+from app.idempotency import idempotent, get_idempotency_key
+from app.deployment_queries import (
+    FILTER_FIELDS, DEFAULT_PAGE_SIZE, parse_fields, filter_deployments, page_deployments,
+    page_deployment_dicts, iter_deployment_dicts
+)
+from app.warm_pool import (
+    get_pool, claim_pool_member, start_pool_member, get_pool_stats, start_replenish, drain_pool
 )
-from app.install_scripts import get_install_script, get_available_scripts
 
 main_bp = Blueprint('main', __name__)
 
@@ -24,13 +64,14 @@ main_bp = Blueprint('main', __name__)
 def index():
     """Dashboard showing servers, connections, and recent deployments."""
     connections = ProxmoxConnection.query.all()
-    deployments = Deployment.query.order_by(Deployment.created_at.desc()).limit(10).all()
+    deployments, _ = page_deployments(Deployment.query, limit=5)
     credentials = Credential.query.all()
 
     return render_template('index.html',
-                         servers=GAME_SERVERS,
-                         categories=CATEGORIES,
-                         stats=STATS,
+                         servers=get_all_servers(),
+                         categories=get_all_categories(),
+                         stats=get_stats(),
+                         deployment_counts=get_deployment_counts(),
                          connections=connections,
                          deployments=deployments,
                          credentials=credentials)
@@ -47,14 +88,14 @@ def servers():
     elif category:
         filtered_servers = get_servers_by_category(category)
     else:
-        filtered_servers = GAME_SERVERS
+        filtered_servers = get_all_servers()
 
     return render_template('servers.html',
                          servers=filtered_servers,
-                         categories=CATEGORIES,
+                         categories=get_all_categories(),
                          current_category=category,
                          search_query=search,
-                         stats=STATS)
+                         stats=get_stats())
 
 
 @main_bp.route('/server/<server_key>')
@@ -62,7 +103,7 @@ def server_detail(server_key):
     """Detailed view and deployment form for a specific server."""
     server = get_server(server_key)
     if not server:
-        return render_template('error.html', message='Server not found'), 404
+        return render_template('error.html', message='Server not found', categories=get_all_categories()), 404
 
     connections = ProxmoxConnection.query.all()
     credentials = Credential.query.all()
@@ -72,16 +113,25 @@ def server_detail(server_key):
                          server=server,
                          connections=connections,
                          credentials=credentials,
-                         categories=CATEGORIES)
+                         categories=get_all_categories())
 
 
 @main_bp.route('/deployments')
 def deployments():
-    """View deployment history."""
-    all_deployments = Deployment.query.order_by(Deployment.created_at.desc()).all()
+    """View deployment history, one page at a time."""
+    filters = {field: request.args[field] for field in FILTER_FIELDS if request.args.get(field)}
+    try:
+        page, next_cursor = page_deployments(
+            filter_deployments(filters), limit=50, cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return render_template('error.html', message=str(e), categories=get_all_categories()), 400
     return render_template('deployments.html',
-                         deployments=all_deployments,
-                         categories=CATEGORIES)
+                         deployments=page,
+                         filters=filters,
+                         next_cursor=next_cursor,
+                         first_page=not request.args.get('cursor'),
+                         categories=get_all_categories())
 
 
 @main_bp.route('/settings')
@@ -92,7 +142,7 @@ def settings():
     return render_template('settings.html',
                          connections=connections,
                          credentials=credentials,
-                         categories=CATEGORIES)
+                         categories=get_all_categories())
 
 
 # ============================================
@@ -224,6 +274,32 @@ def api_get_templates(connection_id, node):
         return jsonify({'error': str(e)}), 500
 
 
+@main_bp.route('/api/connections/<int:connection_id>/templates/prefetch', methods=['GET'])
+def api_get_template_prefetch(connection_id):
+    """Get the templates this connection needs and the last prefetch report."""
+    ProxmoxConnection.query.get_or_404(connection_id)
+    return jsonify({
+        'templates': required_templates(current_app.config['LXC_TEMPLATES'], connection_id),
+        'report': get_prefetch_report(connection_id)
+    })
+
+
+@main_bp.route('/api/connections/<int:connection_id>/templates/prefetch', methods=['POST'])
+def api_start_template_prefetch(connection_id):
+    """Download missing OS templates to every node in the background."""
+    ProxmoxConnection.query.get_or_404(connection_id)
+    data = request.get_json() or {}
+    names = data.get('templates') or required_templates(current_app.config['LXC_TEMPLATES'], connection_id)
+    if not names:
+        return jsonify({'error': 'No templates to prefetch'}), 400
+
+    start_prefetch(
+        current_app._get_current_object(), connection_id, names,
+        nodes=data.get('nodes'), storage=data.get('storage'), verify=data.get('verify', True)
+    )
+    return jsonify({'success': True, 'templates': names}), 202
+
+
 @main_bp.route('/api/connections/<int:connection_id>/nodes/<node>/storage', methods=['GET'])
 def api_get_storage(connection_id, node):
     """Get available storage pools on a node."""
@@ -252,7 +328,35 @@ def api_get_networks(connection_id, node):
 # DEPLOYMENT API ROUTES
 # ============================================
 
+def _lease_guest(connection_id, vmid, operation, wait=None):
+    """Lease a guest for an operation; None if another request holds it."""
+    config = current_app.config
+    return acquire_lease(guest_lease_key(connection_id, vmid), operation, ttl=config['LEASE_TTL'],
+                         wait=config['LEASE_WAIT'] if wait is None else wait)
+
+
+LEASE_LOST_MESSAGE = 'Lost the lease on guest {vmid} before finishing; another operation may have taken it over'
+
+
+def _lease_lost(connection_id, vmid, **extra):
+    """409 response when a guest's lease was lost partway through an operation."""
+    return jsonify({
+        'error': LEASE_LOST_MESSAGE.format(vmid=vmid),
+        'lease': get_lease(guest_lease_key(connection_id, vmid)),
+        **extra
+    }), 409
+
+
+def _guest_busy(connection_id, vmid):
+    """409 response naming the operation that holds a guest's lease."""
+    return jsonify({
+        'error': f'Guest {vmid} is busy with another operation',
+        'lease': get_lease(guest_lease_key(connection_id, vmid))
+    }), 409
+
+
 @main_bp.route('/api/deploy', methods=['POST'])
+@idempotent
 def api_deploy():
     """Deploy a game server."""
     data = request.get_json()
@@ -275,10 +379,10 @@ def api_deploy():
 
     # Build deployment configuration
     config = {
-        'hostname': data.get('hostname', server['hostname']),
-        'cores': data.get('cores', server['cores']),
-        'memory': data.get('memory', server['memory']),
-        'disk_size': data.get('disk_size', server['disk_size']),
+        'hostname': data.get('hostname', server.hostname),
+        'cores': data.get('cores', server.cores),
+        'memory': data.get('memory', server.memory),
+        'disk_size': data.get('disk_size', server.disk_size),
         'storage': data.get('storage', 'local-lvm'),
         'bridge': data.get('bridge', 'vmbr0'),
         'dhcp': data.get('dhcp', True),
@@ -287,100 +391,265 @@ def api_deploy():
         'gateway': data.get('gateway'),
         'start': data.get('start', True),
         'onboot': data.get('onboot', True),
-        'privileged': server.get('privileged', False),
-        'nesting': server.get('nesting', False),
+        'privileged': server.privileged,
+        'nesting': server.nesting,
         'env_vars': data.get('env_vars', {}),
     }
 
     # Add template for LXC or template_vmid for VM
-    if server['deployment_type'] == 'lxc':
-        if not data.get('template'):
+    pool, pool_member = None, None
+    if server.deployment_type == 'lxc':
+        # Prefer the newest golden template for this game on the target node
+        golden = None
+        if data.get('use_golden', True):
+            golden = get_golden_template(connection.id, data['node'], data['server_key'])
+        if golden:
+            config['template'] = golden.volid
+            config['restore'] = True
+            config['golden_template_id'] = golden.id
+        elif data.get('template'):
+            config['template'] = data['template']
+
+        # A warm pool container skips creation entirely
+        pool = get_pool(connection.id, data['node'], data['server_key']) if data.get('use_pool', True) else None
+        if pool:
+            pool_member = claim_pool_member(pool)
+        if not pool_member and not config.get('template'):
             return jsonify({'error': 'LXC template required'}), 400
-        config['template'] = data['template']
     else:
         if not data.get('template_vmid'):
             return jsonify({'error': 'VM template VMID required'}), 400
         config['template_vmid'] = data['template_vmid']
+        config['clone_mode'] = data.get('clone_mode', 'full')
+        if config['clone_mode'] not in CLONE_MODES:
+            return jsonify({'error': 'clone_mode must be "full" or "linked"'}), 400
 
     # Add SSH keys if provided
     if data.get('ssh_public_keys'):
         config['ssh_public_keys'] = data['ssh_public_keys']
 
+    # Render the install script now so its hash is recorded with the deployment (LXC only)
+    rendered = None
+    if server.deployment_type == 'lxc':
+        # Overlay the game files on a shared read-only layer instead of a private copy
+        if data.get('shared_layer') and not pool_member:
+            layer = get_game_layer(connection.id, data['node'], server.steam_app_id) if server.linuxgsm_name else None
+            if not layer:
+                return jsonify({'error': 'No shared game layer built for this game on this node'}), 400
+            config['mounts'] = [layer_mount(layer)]
+            config['game_layer_id'] = layer.id
+            if 'disk_size' not in data:
+                config['disk_size'] = layered_disk_size(server.disk_size, layer)
+
+        # Otherwise mount the node's SteamCMD depot cache for fresh LinuxGSM installs
+        use_depot = (
+            not pool_member and not config.get('game_layer_id')
+            and server.steam_app_id and server.linuxgsm_name and connection.password
+            and data.get('depot_cache', current_app.config['DEPOT_CACHE'])
+        )
+        if use_depot and prepare_depot_cache(
+                ProxmoxClient(connection), data['node'], server.steam_app_id, server.privileged)['success']:
+            config['mounts'] = [depot_mount(server.steam_app_id)]
+            config['depot_cache'] = True
+
+        rendered = render_install_script(
+            data['server_key'], env_vars=config['env_vars'], node=data['node'], connection_id=connection.id,
+            depot_cache=config.get('depot_cache', False),
+            game_layer=bool(config.get('game_layer_id'))
+        )
+        if rendered:
+            config['install_script_hash'] = rendered.content_hash
+            config['install_steps'] = dict(rendered.steps)
+
+    # Lease the VMID, so no other worker creates, provisions or deletes it meanwhile
+    client = ProxmoxClient(connection)
+    if pool_member:
+        lease = _lease_guest(connection.id, pool_member.vmid, 'deploy')
+        if not lease:
+            pool_member.status = 'ready'
+            db.session.commit()
+            return _guest_busy(connection.id, pool_member.vmid)
+        lease.vmid = pool_member.vmid
+    else:
+        try:
+            lease = lease_free_vmid(client, connection.id, 'deploy', current_app.config['LEASE_TTL'])
+        except Exception as e:
+            return jsonify({'error': f'Could not get a VMID: {e}'}), 500
+        if not lease:
+            return jsonify({'error': 'No free VMID could be leased, try again'}), 409
+
     # Create deployment record
     deployment = Deployment(
         connection_id=connection.id,
         server_key=data['server_key'],
-        server_name=server['name'],
-        deployment_type=server['deployment_type'],
+        server_name=server.name,
+        deployment_type=server.deployment_type,
         node=data['node'],
         status='pending',
+        game_layer_id=config.get('game_layer_id'),
         config_snapshot=config
     )
     db.session.add(deployment)
     db.session.commit()
 
-    # Execute deployment
-    client = ProxmoxClient(connection)
+    # Execute deployment. Progress goes to the event log; the deployment row is
+    # written once, when the deploy finishes
+    snapshot, vmid = config, None
     try:
-        if server['deployment_type'] == 'lxc':
-            result = client.create_lxc(data['node'], config)
+        if server.deployment_type == 'lxc':
+            result = None
+            if pool_member:
+                result = start_pool_member(
+                    client, pool_member, data['node'], config,
+                    script_hash=rendered.content_hash if rendered else None
+                )
+                if result['success']:
+                    snapshot = {**config, 'from_pool': True}
+                elif config.get('template'):
+                    result = None  # fall back to a normal deploy
+                warm_pool = current_app.extensions.get('warm_pool')
+                if warm_pool:
+                    warm_pool.trigger()
+            if pool:
+                record_event(deployment.id, 'pool_claim', pool_id=pool.id, server_key=pool.server_key,
+                             hit=bool(pool_member), seconds=result.get('claim_seconds') if result else None)
+            if result is None:
+                if pool_member:
+                    # The pool container is unusable; deploy a new one under a fresh VMID
+                    lease.release()
+                    lease = lease_free_vmid(client, connection.id, 'deploy', current_app.config['LEASE_TTL'])
+                    if not lease:
+                        raise RuntimeError('No free VMID could be leased')
+                result = client.create_lxc(data['node'], {**config, 'vmid': lease.vmid})
         else:
-            result = client.create_vm(data['node'], config)
-
+            # Fall back to a full clone when the template's storage can't do linked clones
+            if config['clone_mode'] == 'linked' and not client.supports_linked_clone(
+                    data['node'], config['template_vmid']):
+                config['clone_mode'] = 'full'
+                config['clone_mode_fallback'] = True
+            result = client.create_vm(data['node'], {**config, 'vmid': lease.vmid})
+            if result['success']:
+                snapshot = {
+                    **config,
+                    'clone_mode': result['clone_mode'],
+                    'clone_seconds': result['clone_seconds']
+                }
+
+        record_event(deployment.id, 'create', message=result.get('error'), success=result['success'],
+                     vmid=result.get('vmid'), from_pool=bool(result.get('from_pool')))
+        error = None
         if result['success']:
-            deployment.vmid = result['vmid']
-            deployment.status = 'provisioning'
-            if not config.get('dhcp') and config.get('ip_address'):
-                deployment.ip_address = config['ip_address']
-            db.session.commit()
-
-            # Auto-provision if install script is available (LXC only)
-            if server['deployment_type'] == 'lxc':
-                install_script = get_install_script(
-                    data['server_key'],
-                    env_vars=data.get('env_vars', {})
+            vmid = result['vmid']
+            record_status(deployment, 'provisioning', vmid=vmid)
+            status = 'running' if config.get('start') else 'stopped'
+
+            # Auto-provision if install script is available (LXC only; VMs don't auto-provision)
+            if server.deployment_type == 'lxc' and rendered and not result.get('provisioned'):
+                # Give the container a moment to fully start
+                import time
+                time.sleep(5)
+                lease.check()
+
+                provision_result = client.provision_container(
+                    data['node'],
+                    result['vmid'],
+                    rendered.script
                 )
-                if install_script:
-                    # Give the container a moment to fully start
-                    import time
-                    time.sleep(5)
-
-                    provision_result = client.provision_container(
-                        data['node'],
-                        result['vmid'],
-                        install_script
-                    )
-
-                    if provision_result['success']:
-                        deployment.status = 'running' if config.get('start') else 'stopped'
-                    else:
-                        deployment.status = 'provision_failed'
-                        deployment.error_message = provision_result.get('error', 'Provisioning failed')
-                else:
-                    # No install script available, just mark as running
-                    deployment.status = 'running' if config.get('start') else 'stopped'
-            else:
-                # VMs don't auto-provision
-                deployment.status = 'running' if config.get('start') else 'stopped'
+                record_event(deployment.id, 'provision', message=provision_result.get('error'),
+                             success=provision_result['success'], script_hash=rendered.content_hash)
+                if not provision_result['success']:
+                    status = 'provision_failed'
+                    error = provision_result.get('error', 'Provisioning failed')
         else:
-            deployment.status = 'failed'
-            deployment.error_message = result.get('error', 'Unknown error')
-
+            status = 'failed'
+            error = result.get('error', 'Unknown error')
+
+        lease.check()
+        deployment.vmid = vmid
+        deployment.config_snapshot = snapshot
+        deployment.status = status
+        deployment.error_message = error
+        if vmid and not config.get('dhcp') and config.get('ip_address'):
+            deployment.ip_address = config['ip_address']
+        if vmid and server.deployment_type == 'vm':
+            record_disk_usage(client, deployment, commit=False)
         db.session.commit()
+
+        if vmid and server.deployment_type == 'vm' and result['clone_mode'] == 'linked' \
+                and data.get('promote_storage'):
+            start_promotion(
+                current_app._get_current_object(), deployment.id,
+                data['promote_storage'], delay=data.get('promote_delay', 0)
+            )
         return jsonify(deployment.to_dict())
 
     except Exception as e:
+        db.session.rollback()
+        deployment.vmid = vmid
+        deployment.config_snapshot = snapshot
         deployment.status = 'failed'
         deployment.error_message = str(e)
         db.session.commit()
         return jsonify({'error': str(e), 'deployment': deployment.to_dict()}), 500
 
+    finally:
+        if lease:
+            lease.release()
+
 
 @main_bp.route('/api/deployments', methods=['GET'])
 def api_get_deployments():
-    """Get all deployments."""
-    deployments = Deployment.query.order_by(Deployment.created_at.desc()).all()
-    return jsonify([d.to_dict() for d in deployments])
+    """
+    Get deployments, newest first, one page at a time.
+
+    Query parameters:
+        status, node, server_key, connection_id, deployment_type: filters
+            (comma-separated values match any)
+        fields: comma-separated fields to return (default: all)
+        limit: page size (default 100, max 1000)
+        cursor: X-Next-Cursor value from the previous page
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        rows, next_cursor = page_deployment_dicts(
+            filter_deployments(request.args), fields,
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = jsonify(rows)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("main.api_get_deployments", **args)}>; rel="next"'
+    return response
+
+
+@main_bp.route('/api/deployments/export', methods=['GET'])
+def api_export_deployments():
+    """
+    Stream every matching deployment as NDJSON (one JSON object per line).
+
+    Takes the same filters and fields as /api/deployments.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        query = filter_deployments(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        for row in iter_deployment_dicts(query, fields):
+            yield json.dumps(row) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=deployments.ndjson'}
+    )
 
 
 @main_bp.route('/api/deployments/<int:deployment_id>', methods=['GET'])
@@ -390,7 +659,57 @@ def api_get_deployment(deployment_id):
     return jsonify(deployment.to_dict())
 
 
+@main_bp.route('/api/deployments/<int:deployment_id>/events', methods=['GET'])
+def api_get_deployment_events(deployment_id):
+    """Get a deployment's event history, oldest first (also after it was deleted)."""
+    return jsonify(get_events(
+        deployment_id=deployment_id,
+        after_id=request.args.get('after_id', type=int),
+        limit=request.args.get('limit', 100, type=int)
+    ))
+
+
+@main_bp.route('/api/deployments/<int:deployment_id>/config-diff', methods=['GET'])
+def api_diff_deployment_config(deployment_id):
+    """Diff a deployment's config against another's (?against=<id>)."""
+    deployment = Deployment.query.get_or_404(deployment_id)
+    other_id = request.args.get('against', type=int)
+    if not other_id:
+        return jsonify({'error': 'against is required'}), 400
+    other = Deployment.query.get_or_404(other_id)
+    return jsonify(diff_deployments(other, deployment))
+
+
+@main_bp.route('/api/configs', methods=['GET'])
+def api_get_config_stats():
+    """Get how many distinct configs are stored and the space deduplication saves."""
+    return jsonify(get_blob_stats())
+
+
+@main_bp.route('/api/configs/<config_hash>', methods=['GET'])
+def api_get_config(config_hash):
+    """Get a stored config and how many deployments use it."""
+    blob = get_config_blob(config_hash)
+    if not blob:
+        return jsonify({'error': 'Config not found'}), 404
+    return jsonify({**blob.to_dict(), 'deployments': Deployment.query.filter_by(config_hash=config_hash).count()})
+
+
+@main_bp.route('/api/events', methods=['GET'])
+def api_get_events():
+    """Tail the event log of all deployments (pass the last seen id as after_id)."""
+    writer = get_event_writer()
+    return jsonify({
+        'events': get_events(
+            after_id=request.args.get('after_id', type=int),
+            limit=request.args.get('limit', 100, type=int)
+        ),
+        'writer': writer.stats() if writer else None
+    })
+
+
 @main_bp.route('/api/deployments/<int:deployment_id>/start', methods=['POST'])
+@idempotent
 def api_start_deployment(deployment_id):
     """Start a deployed server."""
     deployment = Deployment.query.get_or_404(deployment_id)
@@ -411,6 +730,7 @@ def api_start_deployment(deployment_id):
 
 
 @main_bp.route('/api/deployments/<int:deployment_id>/stop', methods=['POST'])
+@idempotent
 def api_stop_deployment(deployment_id):
     """Stop a deployed server."""
     deployment = Deployment.query.get_or_404(deployment_id)
@@ -451,6 +771,7 @@ def api_deployment_status(deployment_id):
 
 
 @main_bp.route('/api/deployments/<int:deployment_id>', methods=['DELETE'])
+@idempotent
 def api_delete_deployment(deployment_id):
     """Delete a deployment and its container/VM."""
     deployment = Deployment.query.get_or_404(deployment_id)
@@ -458,12 +779,16 @@ def api_delete_deployment(deployment_id):
 
     # Delete from Proxmox if VMID exists
     if deployment.vmid:
-        client = ProxmoxClient(connection)
-        client.delete_container(
-            deployment.node,
-            deployment.vmid,
-            deployment.deployment_type
-        )
+        lease = _lease_guest(connection.id, deployment.vmid, 'delete')
+        if not lease:
+            return _guest_busy(connection.id, deployment.vmid)
+        with lease:
+            client = ProxmoxClient(connection)
+            client.delete_container(
+                deployment.node,
+                deployment.vmid,
+                deployment.deployment_type
+            )
 
     # Delete from database
     db.session.delete(deployment)
@@ -472,6 +797,312 @@ def api_delete_deployment(deployment_id):
     return jsonify({'success': True})
 
 
+@main_bp.route('/api/deployments/<int:deployment_id>/promote', methods=['POST'])
+@idempotent
+def api_promote_deployment(deployment_id):
+    """Promote a linked-clone VM to a full clone in the background."""
+    deployment = Deployment.query.get_or_404(deployment_id)
+    data = request.get_json() or {}
+
+    snapshot = deployment.config_snapshot or {}
+    if deployment.deployment_type != 'vm' or snapshot.get('clone_mode') != 'linked':
+        return jsonify({'error': 'Only linked-clone VM deployments can be promoted'}), 400
+    if not data.get('storage'):
+        return jsonify({'error': 'Target storage required'}), 400
+    if (snapshot.get('promotion') or {}).get('status') == 'running':
+        return jsonify({'error': 'Promotion already running'}), 409
+
+    start_promotion(current_app._get_current_object(), deployment.id, data['storage'])
+    return jsonify({'success': True, 'status': 'running'}), 202
+
+
+@main_bp.route('/api/deployments/clone-stats', methods=['GET'])
+def api_clone_stats():
+    """Deploy time and disk usage of VM deployments, by clone mode."""
+    return jsonify(clone_mode_stats())
+
+
+@main_bp.route('/api/deployments/<int:deployment_id>/scale-out', methods=['POST'])
+@idempotent
+def api_scale_out_deployment(deployment_id):
+    """Clone a healthy LXC deployment into replicas."""
+    deployment = Deployment.query.get_or_404(deployment_id)
+    data = request.get_json(silent=True) or {}
+
+    if deployment.deployment_type != 'lxc' or not deployment.vmid:
+        return jsonify({'error': 'Scale-out is only supported for deployed LXC containers'}), 400
+
+    mode = data.get('mode', 'full')
+    if mode not in ('full', 'linked'):
+        return jsonify({'error': 'mode must be "full" or "linked"'}), 400
+
+    replicas = data.get('replicas') or []
+    try:
+        count = int(data.get('count', len(replicas) or 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    if not 1 <= count <= 50:
+        return jsonify({'error': 'count must be between 1 and 50'}), 400
+
+    # Only clone from a source that is actually up
+    client = ProxmoxClient(deployment.connection)
+    status = client.get_container_status(deployment.node, deployment.vmid, 'lxc')
+    if not status['success'] or status.get('status') != 'running':
+        return jsonify({'error': 'Source deployment is not running'}), 409
+
+    result = scale_out_deployment(
+        deployment, count,
+        linked=mode == 'linked',
+        replicas=replicas,
+        hostname_prefix=data.get('hostname_prefix'),
+        storage=data.get('storage'),
+        start=data.get('start', True),
+        refresh_template=data.get('refresh_template', False)
+    )
+    if 'replicas' not in result:
+        return jsonify(result), 500
+    return jsonify(result), 201 if result['replicas'] else 500
+
+
+# ============================================
+# WARM POOL API ROUTES
+# ============================================
+
+@main_bp.route('/api/pools', methods=['GET'])
+def api_get_pools():
+    """List warm pools and their fill levels."""
+    return jsonify([pool.to_dict() for pool in WarmPool.query.all()])
+
+
+@main_bp.route('/api/pools', methods=['POST'])
+def api_save_pool():
+    """Create or resize the warm pool for a game on a node."""
+    data = request.get_json() or {}
+
+    for field in ('connection_id', 'node', 'server_key'):
+        if not data.get(field):
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+
+    server = get_server(data['server_key'])
+    if not server or server.deployment_type != 'lxc':
+        return jsonify({'error': 'Warm pools are only supported for LXC game servers'}), 400
+    if not ProxmoxConnection.query.get(data['connection_id']):
+        return jsonify({'error': 'Invalid connection'}), 400
+
+    pool = WarmPool.query.filter_by(
+        connection_id=data['connection_id'], node=data['node'], server_key=data['server_key']
+    ).first()
+    if not pool:
+        pool = WarmPool(connection_id=data['connection_id'], node=data['node'], server_key=data['server_key'])
+        db.session.add(pool)
+
+    for field in ('size', 'template', 'storage', 'bridge', 'enabled'):
+        if field in data:
+            setattr(pool, field, data[field])
+    db.session.commit()
+
+    warm_pool = current_app.extensions.get('warm_pool')
+    if warm_pool:
+        warm_pool.trigger()
+    return jsonify(pool.to_dict())
+
+
+@main_bp.route('/api/pools/<int:pool_id>', methods=['DELETE'])
+def api_delete_pool(pool_id):
+    """Delete a warm pool and destroy its idle containers."""
+    pool = WarmPool.query.get_or_404(pool_id)
+    drained = drain_pool(pool)
+    if drained['failed']:
+        # Keep the pool so the containers that are left stay tracked; stop refilling it
+        pool.enabled = False
+        db.session.commit()
+        return jsonify({
+            'error': f"{len(drained['failed'])} pool containers could not be deleted; "
+                     'the pool is disabled and kept until they are',
+            **drained
+        }), 409
+    db.session.delete(pool)
+    db.session.commit()
+    return jsonify({'success': True, 'removed': drained['removed']})
+
+
+@main_bp.route('/api/pools/<int:pool_id>/replenish', methods=['POST'])
+def api_replenish_pool(pool_id):
+    """Top up a warm pool now, in the background."""
+    pool = WarmPool.query.get_or_404(pool_id)
+    start_replenish(current_app._get_current_object(), pool.id)
+    return jsonify({'success': True, 'pool': pool.to_dict()}), 202
+
+
+@main_bp.route('/api/pools/stats', methods=['GET'])
+def api_pool_stats():
+    """Warm pool hit rate and claim latency."""
+    return jsonify(get_pool_stats())
+
+
+# ============================================
+# PACKAGE CACHE API ROUTES
+# ============================================
+
+@main_bp.route('/api/package-caches', methods=['GET'])
+def api_get_package_caches():
+    """List per-node package caches."""
+    return jsonify([cache.to_dict() for cache in PackageCache.query.all()])
+
+
+@main_bp.route('/api/package-caches', methods=['POST'])
+def api_deploy_package_cache():
+    """Create (or rebuild) the package cache container for a node."""
+    data = request.get_json() or {}
+
+    for field in ('connection_id', 'node', 'template'):
+        if not data.get(field):
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+
+    connection = ProxmoxConnection.query.get(data['connection_id'])
+    if not connection:
+        return jsonify({'error': 'Invalid connection'}), 400
+
+    cache = deploy_package_cache(
+        connection, data['node'], data['template'],
+        storage=data.get('storage', 'local-lvm'),
+        disk_size=data.get('disk_size', 100),
+        bridge=data.get('bridge', 'vmbr0'),
+        ip_address=data.get('ip_address'),
+        cidr=data.get('cidr', 24),
+        gateway=data.get('gateway')
+    )
+    return jsonify(cache.to_dict()), 201 if cache.status == 'ready' else 500
+
+
+@main_bp.route('/api/package-caches/<int:cache_id>', methods=['DELETE'])
+def api_delete_package_cache(cache_id):
+    """Remove a node's package cache."""
+    cache = PackageCache.query.get_or_404(cache_id)
+    return jsonify(remove_package_cache(cache))
+
+
+@main_bp.route('/api/package-caches/<int:cache_id>/stats', methods=['GET'])
+def api_package_cache_stats(cache_id):
+    """Bandwidth saved by a node's package cache."""
+    cache = PackageCache.query.get_or_404(cache_id)
+    if cache.status != 'ready':
+        return jsonify({'error': 'Package cache is not ready'}), 409
+    return jsonify(get_bandwidth_stats(cache))
+
+
+# ============================================
+# DEPOT CACHE API ROUTES
+# ============================================
+
+@main_bp.route('/api/connections/<int:conn_id>/nodes/<node>/depot-caches', methods=['GET'])
+def api_get_depot_caches(conn_id, node):
+    """List SteamCMD depots cached on a node."""
+    connection = ProxmoxConnection.query.get_or_404(conn_id)
+    return jsonify(list_depot_caches(ProxmoxClient(connection), node))
+
+
+@main_bp.route('/api/connections/<int:conn_id>/nodes/<node>/depot-caches/<steam_app_id>', methods=['DELETE'])
+def api_purge_depot_cache(conn_id, node, steam_app_id):
+    """Delete a node's cached depot so the next install there re-seeds it."""
+    connection = ProxmoxConnection.query.get_or_404(conn_id)
+    if not steam_app_id.isdigit():
+        return jsonify({'error': 'Invalid Steam app ID'}), 400
+    return jsonify(purge_depot_cache(ProxmoxClient(connection), node, steam_app_id))
+
+
+# ============================================
+# GAME LAYER API ROUTES
+# ============================================
+
+@main_bp.route('/api/game-layers', methods=['GET'])
+def api_get_game_layers():
+    """List shared game layers and how many containers use each."""
+    query = GameLayer.query
+    for field in ('connection_id', 'node', 'steam_app_id', 'status'):
+        if request.args.get(field):
+            query = query.filter_by(**{field: request.args[field]})
+    layers = query.order_by(GameLayer.created_at.desc()).all()
+    users = layer_user_counts(layer.id for layer in layers)
+    return jsonify([{**layer.to_dict(), 'users': users.get(layer.id, 0)} for layer in layers])
+
+
+@main_bp.route('/api/game-layers/build', methods=['POST'])
+@idempotent
+def api_build_game_layer():
+    """Build a new shared layer version from a game's seeded depot cache."""
+    data = request.get_json() or {}
+
+    connection = ProxmoxConnection.query.get(data.get('connection_id'))
+    if not connection:
+        return jsonify({'error': 'Invalid connection'}), 400
+    if not data.get('node'):
+        return jsonify({'error': 'Missing required field: node'}), 400
+
+    steam_app_id = data.get('steam_app_id')
+    if not steam_app_id and data.get('server_key'):
+        server = get_server(data['server_key'])
+        steam_app_id = server.steam_app_id if server else None
+    if not str(steam_app_id or '').isdigit():
+        return jsonify({'error': 'steam_app_id or a Steam server_key required'}), 400
+
+    layer = build_game_layer(connection, data['node'], steam_app_id)
+    return jsonify(layer.to_dict()), 201 if layer.status == 'ready' else 500
+
+
+@main_bp.route('/api/game-layers/<int:layer_id>', methods=['DELETE'])
+def api_delete_game_layer(layer_id):
+    """Delete a layer version that no container mounts."""
+    layer = GameLayer.query.get_or_404(layer_id)
+    result = delete_game_layer(layer)
+    return jsonify(result), 200 if result['success'] else 409
+
+
+# ============================================
+# FLEET UPDATE API ROUTES
+# ============================================
+
+@main_bp.route('/api/updates', methods=['GET'])
+def api_get_fleet_updates():
+    """List fleet updates, newest first."""
+    updates = FleetUpdate.query.order_by(FleetUpdate.created_at.desc()).limit(50).all()
+    return jsonify([update.to_dict() for update in updates])
+
+
+@main_bp.route('/api/updates/<int:update_id>', methods=['GET'])
+def api_get_fleet_update(update_id):
+    """Get a fleet update and its per-wave report."""
+    return jsonify(FleetUpdate.query.get_or_404(update_id).to_dict())
+
+
+@main_bp.route('/api/updates', methods=['POST'])
+@idempotent
+def api_start_fleet_update():
+    """Roll a Steam update out to running LinuxGSM deployments, grouped by node and app."""
+    data = request.get_json(silent=True) or {}
+
+    groups = plan_fleet_updates(
+        connection_id=data.get('connection_id'),
+        steam_app_id=data.get('steam_app_id'),
+        server_key=data.get('server_key')
+    )
+    if data.get('dry_run'):
+        return jsonify({'groups': groups})
+    if not groups:
+        return jsonify({'error': 'No running deployments to update'}), 404
+
+    try:
+        wave_size = max(1, int(data.get('wave_size', 5)))
+        concurrency = max(1, int(data.get('concurrency', 2)))
+        max_failures = max(0, int(data.get('max_failures', 0)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'wave_size, concurrency and max_failures must be integers'}), 400
+
+    updates = create_fleet_updates(groups, wave_size=wave_size, concurrency=concurrency)
+    start_fleet_updates(current_app._get_current_object(), [u.id for u in updates], max_failures=max_failures)
+    return jsonify([update.to_dict() for update in updates]), 202
+
+
 # ============================================
 # CREDENTIALS API ROUTES
 # ============================================
@@ -549,52 +1180,254 @@ def api_delete_credential(credential_id):
 # SERVER INFO API ROUTES
 # ============================================
 
+def _catalog_payload(kind, value=None, limit=None):
+    """Get the cached payload for a catalog view of the live catalog version."""
+    return _build_catalog_payload(get_catalog_version(), kind, value, limit)
+
+
+@lru_cache(maxsize=512)
+def _build_catalog_payload(version, kind, value=None, limit=None):
+    """Serialize and compress a catalog view once per catalog version."""
+    if kind == 'search':
+        return CachedPayload(search_servers(value, limit=limit), fast=True)
+    if kind == 'category':
+        return CachedPayload(get_servers_by_category(value))
+    if kind == 'tag':
+        return CachedPayload(get_servers_by_tag(value))
+    if kind == 'port':
+        return CachedPayload(get_servers_by_port(value))
+    if kind == 'server':
+        return CachedPayload(get_server(value))
+    if kind == 'categories':
+        return CachedPayload(get_all_categories())
+    return CachedPayload(get_all_servers())
+
+
 @main_bp.route('/api/servers', methods=['GET'])
 def api_get_servers():
     """Get all server definitions."""
     category = request.args.get('category')
     search = request.args.get('search')
+    tag = request.args.get('tag')
+    port = request.args.get('port', type=int)
 
     if search:
-        servers = search_servers(search)
+        query = ' '.join(search.lower().split())
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({'error': 'limit must be at least 1'}), 400
+        payload = _catalog_payload('search', query, limit)
     elif category:
-        servers = get_servers_by_category(category)
+        payload = _catalog_payload('category', category)
+    elif tag:
+        payload = _catalog_payload('tag', tag)
+    elif port:
+        payload = _catalog_payload('port', port)
     else:
-        servers = GAME_SERVERS
+        payload = _catalog_payload('all')
 
-    return jsonify(servers)
+    return payload.response()
 
 
 @main_bp.route('/api/servers/<server_key>', methods=['GET'])
 def api_get_server(server_key):
     """Get a specific server definition."""
-    server = get_server(server_key)
-    if not server:
+    if not get_server(server_key):
         return jsonify({'error': 'Server not found'}), 404
-    return jsonify(server)
+    return _catalog_payload('server', server_key).response()
 
 
 @main_bp.route('/api/categories', methods=['GET'])
 def api_get_categories():
     """Get all categories."""
-    return jsonify(CATEGORIES)
+    return _catalog_payload('categories').response()
 
 
 @main_bp.route('/api/stats', methods=['GET'])
 def api_get_stats():
     """Get deployment statistics."""
+    counts = get_deployment_counts()
     deployment_stats = {
-        'total': Deployment.query.count(),
-        'running': Deployment.query.filter_by(status='running').count(),
-        'stopped': Deployment.query.filter_by(status='stopped').count(),
-        'failed': Deployment.query.filter_by(status='failed').count(),
+        'total': counts['total'],
+        'running': counts['by_status'].get('running', 0),
+        'stopped': counts['by_status'].get('stopped', 0),
+        'failed': counts['by_status'].get('failed', 0),
+        **counts,
+        'compacted': get_compacted_total(),
     }
     return jsonify({
-        'servers': STATS,
+        'servers': get_stats(),
         'deployments': deployment_stats
     })
 
 
+@main_bp.route('/api/database', methods=['GET'])
+def api_get_database_info():
+    """Get the database backend, its tuning and connection pool usage."""
+    return jsonify(database_info(db.engine))
+
+
+@main_bp.route('/api/throttle', methods=['GET'])
+def api_get_throttle():
+    """Get this worker's task limits, queue lengths and observed task durations."""
+    return jsonify(get_task_throttle().stats())
+
+
+@main_bp.route('/api/leases', methods=['GET'])
+def api_get_leases():
+    """Get the guests an operation is running on right now, across all workers."""
+    return jsonify(list_leases())
+
+
+@main_bp.route('/api/idempotency-keys/<path:key>', methods=['GET'])
+def api_get_idempotency_key(key):
+    """Check whether a request with an Idempotency-Key is running or done."""
+    record = get_idempotency_key(key)
+    if not record:
+        return jsonify({'error': 'Unknown or expired key'}), 404
+    return jsonify(record.to_dict())
+
+
+@main_bp.route('/api/retention', methods=['GET'])
+def api_get_retention():
+    """Get the retention policy, the last run, archives and compacted summaries."""
+    config = current_app.config
+    return jsonify({
+        'policy': {
+            'days': config['RETENTION_DAYS'],
+            'statuses': config['RETENTION_STATUSES'],
+            'interval': config['RETENTION_INTERVAL'],
+            'vacuum_free_ratio': config['VACUUM_FREE_RATIO'],
+        },
+        'running': is_retention_running(),
+        'last_run': get_retention_report(),
+        'archives': list_archives(config['ARCHIVE_DIR']),
+        'summaries': get_summaries(request.args.get('month')),
+    })
+
+
+@main_bp.route('/api/retention/run', methods=['POST'])
+def api_run_retention():
+    """Apply the retention policy now (in the background unless dry_run)."""
+    data = request.get_json(silent=True) or {}
+    days = data.get('days')
+    if days is not None and (not isinstance(days, int) or days < 0):
+        return jsonify({'error': 'days must be a non-negative integer'}), 400
+    if is_retention_running():
+        return jsonify({'error': 'Retention is already running'}), 409
+
+    if data.get('dry_run'):
+        return jsonify(run_retention(current_app.config, days=days, dry_run=True))
+    start_retention(current_app._get_current_object(), days=days, vacuum=data.get('vacuum', True))
+    return jsonify({'success': True}), 202
+
+
+@main_bp.route('/api/catalog', methods=['GET'])
+def api_get_catalog_status():
+    """Get the loaded catalog version and external catalog file status."""
+    reloader = current_app.extensions.get('catalog_reloader')
+    if not reloader:
+        return jsonify({'version': get_catalog_version(), 'directory': None})
+    return jsonify(reloader.status())
+
+
+@main_bp.route('/api/catalog/reload', methods=['POST'])
+def api_reload_catalog():
+    """Reload external catalog files now."""
+    reloader = current_app.extensions.get('catalog_reloader')
+    if not reloader:
+        return jsonify({'error': 'No catalog directory configured (set CATALOG_DIR)'}), 400
+    result = reloader.reload()
+    if result['error']:
+        return jsonify(result), 400
+    return jsonify(result)
+
+
+# ============================================
+# GOLDEN TEMPLATE API ROUTES
+# ============================================
+
+@main_bp.route('/api/golden-templates', methods=['GET'])
+def api_get_golden_templates():
+    """Get golden templates, optionally filtered by connection, node and server."""
+    query = GoldenTemplate.query
+    for field in ('connection_id', 'node', 'server_key', 'status'):
+        if request.args.get(field):
+            query = query.filter(getattr(GoldenTemplate, field) == request.args.get(field))
+    templates = query.order_by(GoldenTemplate.server_key, GoldenTemplate.version.desc()).all()
+    return jsonify([t.to_dict() for t in templates])
+
+
+@main_bp.route('/api/golden-templates/build', methods=['POST'])
+@idempotent
+def api_build_golden_template():
+    """
+    Build a new golden template version for a game server in the background.
+
+    Returns 202 with the 'building' record; poll GET /api/golden-templates
+    for its status.
+
+    Request body:
+    {
+        "connection_id": 1,
+        "node": "proxmox-node",
+        "server_key": "valheim",
+        "template": "local:vztmpl/ubuntu-22.04-standard_22.04-1_amd64.tar.zst",
+        "storage": "local-lvm",     // optional, build container root disk
+        "backup_storage": "local",  // optional, where the archive is stored
+        "bridge": "vmbr0",          // optional
+        "keep": 2                   // optional, ready versions to keep
+    }
+    """
+    data = request.get_json()
+
+    required = ['connection_id', 'node', 'server_key', 'template']
+    for field in required:
+        if not data.get(field):
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+
+    connection = ProxmoxConnection.query.get(data['connection_id'])
+    if not connection:
+        return jsonify({'error': 'Invalid connection'}), 400
+
+    lease = acquire_lease(golden_lease_key(connection.id, data['node'], data['server_key']), 'golden-build',
+                          ttl=current_app.config['LEASE_TTL'])
+    if not lease:
+        return jsonify({'error': f"{data['server_key']} is already being built on {data['node']}"}), 409
+
+    try:
+        template = new_golden_template(
+            connection, data['node'], data['server_key'], data['template'],
+            backup_storage=data.get('backup_storage', 'local')
+        )
+    except Exception:
+        lease.release()
+        raise
+    start_golden_build(
+        current_app._get_current_object(), template.id, lease,
+        storage=data.get('storage', 'local-lvm'),
+        bridge=data.get('bridge', 'vmbr0'),
+        keep=data.get('keep', 2)
+    )
+    return jsonify(template.to_dict()), 202
+
+
+@main_bp.route('/api/golden-templates/<int:template_id>', methods=['DELETE'])
+def api_delete_golden_template(template_id):
+    """Delete a golden template, its archive and any build container it left behind."""
+    template = GoldenTemplate.query.get_or_404(template_id)
+    if template.status == 'building':
+        return jsonify({'error': 'Template is still building'}), 409
+    client = ProxmoxClient(template.connection)
+    if template.volid:
+        client.delete_volume(template.node, template.storage, template.volid)
+    if template.build_vmid:
+        client.delete_container(template.node, template.build_vmid, 'lxc')
+    db.session.delete(template)
+    db.session.commit()
+    return jsonify({'success': True})
+
+
 # ============================================
 # PROVISIONING API ROUTES
 # ============================================
@@ -608,16 +1441,26 @@ def api_get_install_scripts():
 @main_bp.route('/api/install-scripts/<server_key>', methods=['GET'])
 def api_get_install_script(server_key):
     """Get the installation script for a specific server."""
-    script = get_install_script(server_key)
-    if not script:
+    rendered = render_install_script(server_key, node=request.args.get('node'),
+                                     connection_id=request.args.get('connection_id', type=int))
+    if not rendered:
         return jsonify({'error': f'No install script available for {server_key}'}), 404
     return jsonify({
         'server_key': server_key,
-        'script': script
+        'script': rendered.script,
+        'content_hash': rendered.content_hash,
+        'steps': dict(rendered.steps)
     })
 
 
+@main_bp.route('/api/install-scripts/cache', methods=['GET'])
+def api_get_install_script_cache():
+    """Get install script render cache counters for this worker."""
+    return jsonify(get_render_stats())
+
+
 @main_bp.route('/api/manage/provision', methods=['POST'])
+@idempotent
 def api_provision_container():
     """
     Provision (or re-provision) an existing container with a game server.
@@ -628,7 +1471,9 @@ def api_provision_container():
         "node": "proxmox-node",
         "vmid": 100,
         "server_key": "valheim",
-        "env_vars": {}  // optional
+        "env_vars": {},  // optional
+        "force": false,  // optional, rerun steps that already completed
+        "wait": 0        // optional, seconds to wait if the container is busy
     }
     """
     data = request.get_json()
@@ -638,6 +1483,8 @@ def api_provision_container():
     for field in required:
         if not data.get(field):
             return jsonify({'error': f'Missing required field: {field}'}), 400
+    if not str(data['vmid']).isdigit():
+        return jsonify({'error': 'vmid must be a number'}), 400
 
     # Get connection
     connection = ProxmoxConnection.query.get(data['connection_id'])
@@ -650,63 +1497,96 @@ def api_provision_container():
             'error': 'Password authentication required for provisioning. API tokens cannot use SSH.'
         }), 400
 
+    # A container deployed here keeps the depot cache or game layer mount it was created with
+    deployment = Deployment.query.filter_by(
+        connection_id=connection.id,
+        vmid=data['vmid'],
+        node=data['node']
+    ).first()
+    snapshot = (deployment.config_snapshot if deployment else None) or {}
+
     # Get install script
-    install_script = get_install_script(
+    rendered = render_install_script(
         data['server_key'],
-        env_vars=data.get('env_vars', {})
+        env_vars=data.get('env_vars', {}),
+        node=data['node'],
+        connection_id=connection.id,
+        depot_cache=snapshot.get('depot_cache', False),
+        game_layer=bool(snapshot.get('game_layer_id'))
     )
-    if not install_script:
+    if not rendered:
         return jsonify({
             'error': f'No install script available for {data["server_key"]}'
         }), 404
 
-    # Execute provisioning
-    client = ProxmoxClient(connection)
+    # Only one provision (or deploy/delete) per container at a time, across workers
+    wait = data.get('wait')
+    if wait is not None and (not isinstance(wait, (int, float)) or wait < 0):
+        return jsonify({'error': 'wait must be a non-negative number of seconds'}), 400
+    lease = _lease_guest(connection.id, data['vmid'], 'provision', wait)
+    if not lease:
+        return _guest_busy(connection.id, data['vmid'])
 
-    # First check if container is running
-    status_result = client.get_container_status(data['node'], data['vmid'], 'lxc')
-    if not status_result.get('success'):
-        return jsonify({
-            'error': f'Could not get container status: {status_result.get("error")}'
-        }), 500
+    with lease:
+        # Execute provisioning
+        client = ProxmoxClient(connection)
 
-    if status_result.get('status') != 'running':
-        # Try to start the container
-        start_result = client.start_container(data['node'], data['vmid'], 'lxc')
-        if not start_result.get('success'):
+        # First check if container is running
+        status_result = client.get_container_status(data['node'], data['vmid'], 'lxc')
+        if not status_result.get('success'):
             return jsonify({
-                'error': f'Container is not running and could not be started: {start_result.get("error")}'
+                'error': f'Could not get container status: {status_result.get("error")}'
             }), 500
-        # Wait for container to start
-        import time
-        time.sleep(5)
 
-    # Run provisioning
-    result = client.provision_container(
-        data['node'],
-        data['vmid'],
-        install_script,
-        timeout=data.get('timeout', 600)
-    )
-
-    # Update deployment record if it exists
-    deployment = Deployment.query.filter_by(
-        vmid=data['vmid'],
-        node=data['node']
-    ).first()
-    if deployment:
-        if result['success']:
-            deployment.status = 'running'
-            deployment.error_message = None
-        else:
-            deployment.status = 'provision_failed'
-            deployment.error_message = result.get('error')
-        db.session.commit()
+        if status_result.get('status') != 'running':
+            # Try to start the container
+            start_result = client.start_container(data['node'], data['vmid'], 'lxc')
+            if not start_result.get('success'):
+                return jsonify({
+                    'error': f'Container is not running and could not be started: {start_result.get("error")}'
+                }), 500
+            # Wait for container to start
+            import time
+            time.sleep(5)
+
+        if lease.lost:
+            return _lease_lost(connection.id, data['vmid'])
+
+        # Run provisioning
+        result = client.provision_container(
+            data['node'],
+            data['vmid'],
+            rendered.script,
+            timeout=data.get('timeout', 600),
+            force=bool(data.get('force'))
+        )
+        result['script_hash'] = rendered.content_hash
+
+        # Update deployment record if it exists
+        if deployment:
+            record_event(deployment.id, 'provision', message=result.get('error'), success=result['success'],
+                         script_hash=rendered.content_hash)
+        if lease.lost:
+            return _lease_lost(connection.id, data['vmid'], provision_result=result)
+        if deployment:
+            if result['success']:
+                deployment.status = 'running'
+                deployment.error_message = None
+                deployment.config_snapshot = {
+                    **(deployment.config_snapshot or {}),
+                    'install_script_hash': rendered.content_hash,
+                    'install_steps': dict(rendered.steps)
+                }
+            else:
+                deployment.status = 'provision_failed'
+                deployment.error_message = result.get('error')
+            db.session.commit()
 
-    return jsonify(result)
+        return jsonify(result)
 
 
 @main_bp.route('/api/manage/exec', methods=['POST'])
+@idempotent
 def api_exec_in_container():
     """
     Execute a command inside a container.
@@ -747,45 +1627,84 @@ def api_exec_in_container():
 
 
 @main_bp.route('/api/deployments/<int:deployment_id>/provision', methods=['POST'])
+@idempotent
 def api_provision_deployment(deployment_id):
-    """Re-provision an existing deployment."""
+    """Re-provision an existing deployment, skipping steps that are unchanged."""
     deployment = Deployment.query.get_or_404(deployment_id)
     connection = deployment.connection
+    data = request.get_json(silent=True) or {}
 
     if not connection.password:
         return jsonify({
             'error': 'Password authentication required for provisioning.'
         }), 400
-
-    # Get install script for this server
-    install_script = get_install_script(deployment.server_key)
-    if not install_script:
+    if not deployment.vmid:
+        return jsonify({'error': 'Deployment has no container'}), 400
+
+    # Get install script for this server, with the env vars it was deployed with
+    snapshot = deployment.config_snapshot or {}
+    rendered = render_install_script(deployment.server_key, env_vars=snapshot.get('env_vars'),
+                                     node=deployment.node, depot_cache=snapshot.get('depot_cache', False),
+                                     game_layer=bool(snapshot.get('game_layer_id')),
+                                     connection_id=deployment.connection_id)
+    if not rendered:
         return jsonify({
             'error': f'No install script available for {deployment.server_key}'
         }), 404
 
-    client = ProxmoxClient(connection)
+    wait = data.get('wait')
+    if wait is not None and (not isinstance(wait, (int, float)) or wait < 0):
+        return jsonify({'error': 'wait must be a non-negative number of seconds'}), 400
+    lease = _lease_guest(connection.id, deployment.vmid, 'provision', wait)
+    if not lease:
+        return _guest_busy(connection.id, deployment.vmid)
 
-    # Update status
-    deployment.status = 'provisioning'
-    db.session.commit()
+    with lease:
+        client = ProxmoxClient(connection)
+        if lease.lost:
+            return _lease_lost(connection.id, deployment.vmid)
 
-    # Run provisioning
-    result = client.provision_container(
-        deployment.node,
-        deployment.vmid,
-        install_script
-    )
+        # Update status
+        deployment.status = 'provisioning'
+        db.session.commit()
 
-    if result['success']:
-        deployment.status = 'running'
-        deployment.error_message = None
-    else:
-        deployment.status = 'provision_failed'
-        deployment.error_message = result.get('error')
+        # Run provisioning
+        result = client.provision_container(
+            deployment.node,
+            deployment.vmid,
+            rendered.script,
+            force=bool(data.get('force'))
+        )
+        previous_steps = snapshot.get('install_steps') or {}
+        result['script_hash'] = rendered.content_hash
+        result['script_changed'] = rendered.content_hash != snapshot.get('install_script_hash')
+        result['changed_steps'] = [name for name, step_hash in rendered.steps
+                                   if previous_steps.get(name) != step_hash]
+        record_event(deployment.id, 'provision', message=result.get('error'), success=result['success'],
+                     script_hash=rendered.content_hash, changed_steps=result['changed_steps'])
+
+        if lease.lost:
+            # Another operation owns the guest now; don't claim the provision succeeded
+            deployment.status = 'provision_failed'
+            deployment.error_message = LEASE_LOST_MESSAGE.format(vmid=deployment.vmid)
+            db.session.commit()
+            return _lease_lost(connection.id, deployment.vmid, provision_result=result,
+                               deployment=deployment.to_dict())
 
-    db.session.commit()
-    return jsonify({
-        'provision_result': result,
-        'deployment': deployment.to_dict()
-    })
+        if result['success']:
+            deployment.status = 'running'
+            deployment.error_message = None
+            deployment.config_snapshot = {
+                **snapshot,
+                'install_script_hash': rendered.content_hash,
+                'install_steps': dict(rendered.steps)
+            }
+        else:
+            deployment.status = 'provision_failed'
+            deployment.error_message = result.get('error')
+
+        db.session.commit()
+        return jsonify({
+            'provision_result': result,
+            'deployment': deployment.to_dict()
+        })
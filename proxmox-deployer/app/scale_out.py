@@ -0,0 +1,220 @@
+"""
+Scale-out by Cloning
+Creates LXC replicas of a healthy deployment with 'pct clone' instead of
+running the full create-and-provision cycle for every new server.
+"""
+
+import time
+from typing import Dict, Any, List
+
+from app import db
+from app.models import Deployment
+from app.proxmox_client import ProxmoxClient
+from app.install_scripts import render_install_script
+
+
+def _delete_retired_templates(client: ProxmoxClient, deployment: Deployment, retired: List[int]) -> List[int]:
+    """
+    Delete replaced clone templates. A template cannot be deleted while
+    linked clones use it, so the ones that fail are returned to try again
+    on a later scale-out.
+    """
+    return [
+        vmid for vmid in retired
+        if not client.delete_container(deployment.node, vmid, 'lxc')['success']
+    ]
+
+
+def _clone_template(client: ProxmoxClient, deployment: Deployment, snapname: str,
+                    refresh: bool = False) -> Dict[str, Any]:
+    """
+    Get (or build) a template container made from a deployment, for linked clones.
+
+    The deployment keeps running: the template is a full clone of its snapshot,
+    converted to a template. Its VMID is remembered in the deployment's
+    config snapshot so later scale-outs reuse it. A template it replaces
+    stays listed in retired_clone_templates until it has been deleted.
+    """
+    snapshot = deployment.config_snapshot or {}
+    template_vmid = snapshot.get('clone_template_vmid')
+    retired = list(snapshot.get('retired_clone_templates') or [])
+    if retired:
+        remaining = _delete_retired_templates(client, deployment, retired)
+        if remaining != retired:
+            snapshot = {**snapshot, 'retired_clone_templates': remaining}
+            deployment.config_snapshot = snapshot
+            db.session.commit()
+            retired = remaining
+    if template_vmid and not refresh:
+        status = client.get_container_status(deployment.node, template_vmid, 'lxc')
+        if status.get('success'):
+            return {'success': True, 'vmid': template_vmid}
+
+    newid = client.get_next_vmid()
+    result = client.clone_lxc(
+        deployment.node, deployment.vmid, newid,
+        hostname=f"{snapshot.get('hostname', deployment.server_key)}-base"[:63],
+        full=True, snapname=snapname
+    )
+    if not result['success']:
+        return result
+    converted = client.convert_to_template(deployment.node, newid)
+    if not converted['success']:
+        client.delete_container(deployment.node, newid, 'lxc')
+        return converted
+
+    if template_vmid and template_vmid != newid:
+        retired = _delete_retired_templates(client, deployment, retired + [template_vmid])
+    deployment.config_snapshot = {**snapshot, 'clone_template_vmid': newid, 'retired_clone_templates': retired}
+    db.session.commit()
+    return {'success': True, 'vmid': newid}
+
+
+def scale_out_deployment(deployment: Deployment, count: int, linked: bool = False,
+                         replicas: List[Dict[str, Any]] = None, hostname_prefix: str = None,
+                         storage: str = None, start: bool = True,
+                         refresh_template: bool = False) -> Dict[str, Any]:
+    """
+    Clone a deployment into N replicas.
+
+    Args:
+        deployment: Healthy LXC deployment to copy
+        count: Number of replicas to create
+        linked: Use linked clones of a template made from the deployment
+            (needs ZFS, LVM-thin, Ceph or another snapshot-capable storage)
+        replicas: Per-replica overrides: hostname, ip_address, cidr, gateway,
+            dhcp, cores, memory and env_vars
+        hostname_prefix: Hostname prefix for replicas without an explicit hostname
+        storage: Target storage for full clones
+        start: Start each replica after cloning
+        refresh_template: Rebuild the linked-clone template from the current state
+
+    Returns:
+        Dict with the created replica deployments and any per-replica errors
+    """
+    client = ProxmoxClient(deployment.connection)
+    snapshot = deployment.config_snapshot or {}
+    replicas = replicas or []
+    prefix = hostname_prefix or snapshot.get('hostname') or deployment.server_key
+    started = time.time()
+
+    snapname = f'scaleout{int(started)}'
+    result = client.snapshot_container(deployment.node, deployment.vmid, snapname,
+                                       description='Scale-out source')
+    if not result['success']:
+        return {'success': False, 'error': f"Snapshot failed: {result.get('error')}"}
+
+    created, errors = [], []
+    try:
+        source_vmid = deployment.vmid
+        if linked:
+            base = _clone_template(client, deployment, snapname, refresh=refresh_template)
+            if not base['success']:
+                return {'success': False, 'error': f"Template build failed: {base.get('error')}"}
+            source_vmid = base['vmid']
+
+        for index in range(count):
+            overrides = replicas[index] if index < len(replicas) else {}
+            hostname = overrides.get('hostname') or f'{prefix}-{index + 1}'
+            config = {**snapshot, **{k: v for k, v in overrides.items() if k != 'env_vars'}}
+            config['hostname'] = hostname
+            config['env_vars'] = {**(snapshot.get('env_vars') or {}), **(overrides.get('env_vars') or {})}
+            if overrides.get('ip_address') and 'dhcp' not in overrides:
+                config['dhcp'] = False
+            config['cloned_from'] = deployment.id
+            config['clone_mode'] = 'linked' if linked else 'full'
+            config.pop('clone_template_vmid', None)
+            config.pop('retired_clone_templates', None)
+
+            replica = Deployment(
+                connection_id=deployment.connection_id,
+                server_key=deployment.server_key,
+                server_name=deployment.server_name,
+                deployment_type='lxc',
+                node=deployment.node,
+                status='pending',
+                game_layer_id=deployment.game_layer_id,
+                config_snapshot=config
+            )
+            db.session.add(replica)
+            db.session.commit()
+
+            clone_started = time.time()
+            newid = client.get_next_vmid()
+            clone = client.clone_lxc(
+                deployment.node, source_vmid, newid, hostname,
+                full=not linked,
+                snapname=None if linked else snapname,
+                storage=storage
+            )
+            replica.vmid = newid
+            if not clone['success']:
+                replica.status = 'failed'
+                replica.error_message = clone.get('error', 'Clone failed')
+                db.session.commit()
+                errors.append({'index': index, 'error': replica.error_message})
+                continue
+
+            def fail(message):
+                replica.status = 'failed'
+                replica.error_message = message
+                db.session.commit()
+                errors.append({'index': index, 'error': message, 'deployment_id': replica.id, 'vmid': newid})
+
+            # Apply hostname/network/resource overrides to the clone
+            configured = client.update_lxc_config(deployment.node, newid, {
+                key: config[key]
+                for key in ('hostname', 'cores', 'memory', 'dhcp', 'ip_address', 'cidr', 'gateway',
+                            'bridge', 'onboot')
+                if key in config
+            })
+            if not configured['success']:
+                fail(f"Config update failed: {configured.get('error')}")
+                continue
+            if not config.get('dhcp', True) and config.get('ip_address'):
+                replica.ip_address = config['ip_address']
+
+            replica.status = 'stopped'
+            if start:
+                started_result = client.start_container(deployment.node, newid, 'lxc')
+                if not started_result['success']:
+                    fail(f"Start failed: {started_result.get('error')}")
+                    continue
+                replica.status = 'running'
+
+                # Re-apply the install recipe when this replica has its own env vars;
+                # checkpoints from the source mean only the changed steps run
+                if overrides.get('env_vars') and deployment.connection.password:
+                    client.wait_for_status(deployment.node, newid, 'running', timeout=60)
+                    rendered = render_install_script(deployment.server_key, env_vars=config['env_vars'],
+                                                     node=deployment.node,
+                                                     connection_id=deployment.connection_id,
+                                                     depot_cache=config.get('depot_cache', False),
+                                                     game_layer=bool(config.get('game_layer_id')))
+                    if rendered:
+                        provision = client.provision_container(deployment.node, newid, rendered.script)
+                        if provision['success']:
+                            replica.config_snapshot = {
+                                **config,
+                                'install_script_hash': rendered.content_hash,
+                                'install_steps': dict(rendered.steps)
+                            }
+                        else:
+                            replica.status = 'provision_failed'
+                            replica.error_message = provision.get('error')
+
+            replica.config_snapshot = {
+                **(replica.config_snapshot or config),
+                'clone_seconds': round(time.time() - clone_started, 1)
+            }
+            db.session.commit()
+            created.append(replica)
+    finally:
+        client.delete_snapshot(deployment.node, deployment.vmid, snapname)
+
+    return {
+        'success': not errors,
+        'replicas': [r.to_dict() for r in created],
+        'errors': errors,
+        'total_seconds': round(time.time() - started, 1)
+    }
@@ -0,0 +1,271 @@
+"""
+Proxmox Task Throttling
+Container creates, VM clones and deletes are disk-heavy Proxmox tasks.
+Starting many at once on one node makes them all slower, and the batch
+takes longer overall. Each node and storage gets a concurrency limit that
+adapts to how long tasks take: it grows while durations stay near the best
+seen, and shrinks once extra tasks only make the others slower.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple
+
+
+class ThrottleTimeout(Exception):
+    """No slot freed up in time."""
+
+
+class AdaptiveLimit:
+    """Concurrency limit for one node or storage, adapted from task durations."""
+
+    def __init__(self, maximum: int, minimum: int = 1, adaptive: bool = True,
+                 tolerance: float = 1.5, smoothing: float = 0.2):
+        """
+        Args:
+            maximum: Hard cap on concurrent tasks
+            minimum: Lowest the limit adapts down to
+            adaptive: Adapt the limit; otherwise it stays at maximum
+            tolerance: Slowdown over the best duration accepted before shrinking
+            smoothing: Weight of each new sample in the limit and duration averages
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.limit = float(min(self.maximum, max(self.minimum, 2)) if adaptive else self.maximum)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.durations = {}  # kind -> {'recent': EWMA seconds, 'best': baseline seconds}
+        self._cond = threading.Condition()
+
+    @property
+    def slots(self) -> int:
+        return max(self.minimum, int(self.limit))
+
+    def acquire(self, deadline: float) -> bool:
+        """Wait for a free slot until the deadline (time.monotonic())."""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.slots:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, kind: str = 'task', seconds: Optional[float] = None):
+        """
+        Free a slot, learning from the task's duration.
+
+        Args:
+            kind: Task kind; durations are only compared within a kind
+            seconds: How long the task ran, or None if it failed
+        """
+        with self._cond:
+            saturated = self.in_flight >= self.slots
+            self.in_flight -= 1
+            if seconds is not None:
+                self.completed += 1
+                if self.adaptive:
+                    self._adapt(kind, seconds, saturated)
+            self._cond.notify_all()
+
+    def _adapt(self, kind: str, seconds: float, saturated: bool):
+        seconds = max(seconds, 0.001)
+        stats = self.durations.get(kind)
+        if stats is None:
+            self.durations[kind] = {'recent': seconds, 'best': seconds}
+            return
+        stats['recent'] += self.smoothing * (seconds - stats['recent'])
+        # Let the baseline drift up slowly, so a storage that got slower for good is relearned
+        stats['best'] = min(stats['recent'], stats['best'] * 1.002)
+
+        gradient = max(0.5, min(1.0, self.tolerance * stats['best'] / stats['recent']))
+        if gradient < 1.0:
+            # Tasks take longer than the storage needs on its own: back off in proportion
+            self.limit *= 1 - self.smoothing * (1 - gradient)
+        elif saturated:
+            # No slowdown yet and tasks had to queue: one more slot per full round of tasks
+            self.limit += 1 / self.slots
+        self.limit = max(float(self.minimum), min(float(self.maximum), self.limit))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': self.slots,
+                'maximum': self.maximum,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'completed': self.completed,
+                'durations': {
+                    kind: {'recent': round(d['recent'], 2), 'best': round(d['best'], 2)}
+                    for kind, d in self.durations.items()
+                },
+            }
+
+
+class TaskThrottle:
+    """Per-node and per-storage limits in front of heavy Proxmox tasks."""
+
+    def __init__(self, node_limit: int = 4, storage_limit: int = 2, adaptive: bool = True,
+                 wait_timeout: float = 1800):
+        self.node_limit = node_limit
+        self.storage_limit = storage_limit
+        self.adaptive = adaptive
+        self.wait_timeout = wait_timeout
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, maximum: int) -> AdaptiveLimit:
+        with self._lock:
+            if key not in self._limits:
+                self._limits[key] = AdaptiveLimit(maximum, adaptive=self.adaptive)
+            return self._limits[key]
+
+    def _limits_for(self, node: str, storage: Optional[str]) -> List[Tuple[str, AdaptiveLimit]]:
+        # Always node before storage, so two tasks can never wait on each other
+        limits = []
+        if self.node_limit > 0:
+            limits.append((node, self._get(f'node:{node}', self.node_limit)))
+        if storage and self.storage_limit > 0:
+            limits.append((f'{node}/{storage}', self._get(f'storage:{node}/{storage}', self.storage_limit)))
+        return limits
+
+    @contextmanager
+    def slot(self, node: str, storage: str = None, kind: str = 'task'):
+        """
+        Hold a node (and storage) slot while running a task.
+
+        Raises:
+            ThrottleTimeout: If no slot frees up within wait_timeout
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        held = []
+        for where, limit in self._limits_for(node, storage):
+            if not limit.acquire(deadline):
+                for acquired in held:
+                    acquired.release(kind)
+                raise ThrottleTimeout(f'Timed out after {self.wait_timeout:.0f}s waiting for a task slot on {where}')
+            held.append(limit)
+
+        started = time.monotonic()
+        seconds = None
+        try:
+            yield
+            seconds = time.monotonic() - started
+        finally:
+            for limit in held:
+                limit.release(kind, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limits = dict(self._limits)
+        return {
+            'node_limit': self.node_limit,
+            'storage_limit': self.storage_limit,
+            'adaptive': self.adaptive,
+            'limits': {key: limit.stats() for key, limit in sorted(limits.items())},
+        }
+
+
+_throttle = TaskThrottle()
+
+
+def configure_task_throttle(node_limit: int = 4, storage_limit: int = 2, adaptive: bool = True,
+                            wait_timeout: float = 1800) -> TaskThrottle:
+    """Replace the process-wide throttle (limits of 0 disable that level)."""
+    global _throttle
+    _throttle = TaskThrottle(node_limit, storage_limit, adaptive, wait_timeout)
+    return _throttle
+
+
+def get_task_throttle() -> TaskThrottle:
+    return _throttle
+
+
+class _SimulatedStorage:
+    """
+    Storage with a few parallel lanes; beyond them tasks share bandwidth and
+    lose some to contention (seeks, cache thrashing).
+    """
+
+    def __init__(self, lanes: int, contention: float):
+        self.lanes = lanes
+        self.contention = contention
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def run(self, seconds_alone: float, tick: float = 0.005):
+        with self._lock:
+            self.active += 1
+        try:
+            done = 0.0
+            while done < seconds_alone:
+                time.sleep(tick)
+                with self._lock:
+                    n = self.active
+                share = min(1.0, self.lanes / n) / (1 + self.contention * max(0, n - self.lanes))
+                done += tick * share
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def simulate_batch(tasks: int = 24, seconds_alone: float = 0.2, lanes: int = 3,
+                   contention: float = 0.15, node_limit: int = 8, storage_limit: int = 8) -> Dict[str, Any]:
+    """
+    Time a batch of creates on a simulated storage, all at once against
+    through an adaptive throttle.
+
+    Args:
+        tasks: Creates in the batch, all submitted together
+        seconds_alone: Duration of one create with the storage to itself
+        lanes: Tasks the storage runs at full speed in parallel
+        contention: Extra slowdown per task beyond the lanes
+        node_limit: Throttle cap per node
+        storage_limit: Throttle cap per storage
+
+    Returns:
+        Dict with total seconds per mode and the limit the throttle settled on
+    """
+    def run(throttle: Optional[TaskThrottle]) -> float:
+        storage = _SimulatedStorage(lanes, contention)
+
+        def task():
+            if throttle is None:
+                storage.run(seconds_alone)
+                return
+            with throttle.slot('sim', 'storage', 'lxc_create'):
+                storage.run(seconds_alone)
+
+        threads = [threading.Thread(target=task) for _ in range(tasks)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return round(time.monotonic() - started, 2)
+
+    unthrottled = run(None)
+    fixed = TaskThrottle(node_limit, storage_limit, adaptive=False)
+    fixed_seconds = run(fixed)
+    adaptive = TaskThrottle(node_limit, storage_limit, adaptive=True)
+    # Warm up so the throttle has a baseline, as it would after the first deploys
+    run(adaptive)
+    adaptive_seconds = run(adaptive)
+    return {
+        'tasks': tasks,
+        'ideal_seconds': round(tasks * seconds_alone / lanes, 2),
+        'unthrottled_seconds': unthrottled,
+        'fixed_limit_seconds': fixed_seconds,
+        'adaptive_seconds': adaptive_seconds,
+        'adaptive_limit': adaptive.stats()['limits']['storage:sim/storage']['limit'],
+    }
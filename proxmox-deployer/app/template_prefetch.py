@@ -0,0 +1,358 @@
+"""
+OS Template Prefetch
+Makes sure every node has the LXC OS templates deployments need before a
+deploy asks for them: missing templates are downloaded from the appliance
+index (pveam download) on all nodes in parallel, and local copies are
+checked against the index's checksums. A copy is only checked again when
+its size or ctime changes.
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from flask import current_app
+
+from app import db
+from app.leases import acquire_lease
+from app.models import ProxmoxConnection, Deployment, WarmPool, ConfigBlob, TemplateChecksum
+from app.proxmox_client import ProxmoxClient, detached_connection
+
+# Checksums the appliance index publishes, strongest first
+CHECKSUM_TOOLS = (('sha512sum', 'sha512sum'), ('md5sum', 'md5sum'))
+
+_VERSION_RE = re.compile(r'\d+')
+
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def _template_name(template: str) -> str:
+    """File name of a template volid ('local:vztmpl/debian-12-...tar.zst')."""
+    return template.split('/')[-1]
+
+
+def required_templates(configured: List[str] = None, connection_id: int = None) -> List[str]:
+    """
+    Collect the OS templates deployments need.
+
+    Args:
+        configured: Template names or package prefixes (e.g. 'debian-12-standard')
+        connection_id: Only count templates used on this connection
+
+    Returns:
+        Sorted template names: the configured ones plus the base templates of
+        warm pools and of deployments not created from a golden template
+    """
+    names = {name.strip() for name in (configured or []) if name.strip()}
+
+    pools = WarmPool.query
+    deployments = Deployment.query.filter_by(deployment_type='lxc')
+    if connection_id:
+        pools = pools.filter_by(connection_id=connection_id)
+        deployments = deployments.filter_by(connection_id=connection_id)
+
+    names.update(_template_name(pool.template) for pool in pools.all() if pool.template)
+    # Each distinct config once, however many deployments share it
+    configs = ConfigBlob.query.filter(ConfigBlob.hash.in_(deployments.with_entities(Deployment.config_hash)))
+    for blob in configs.all():
+        snapshot = blob.data or {}
+        template = snapshot.get('template') or ''
+        if ':vztmpl/' in template and not snapshot.get('restore'):
+            names.add(_template_name(template))
+    return sorted(names)
+
+
+def _version_key(entry: Dict[str, Any]) -> tuple:
+    return tuple(int(part) for part in _VERSION_RE.findall(entry.get('version') or entry.get('template', '')))
+
+
+def resolve_template(name: str, index: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Find a template in the appliance index by file name, or the newest
+    version of a package (e.g. 'debian-12-standard').
+    """
+    for entry in index:
+        if entry.get('template') == name:
+            return entry
+    candidates = [
+        entry for entry in index
+        if entry.get('package') == name or entry.get('template', '').startswith(f'{name}_')
+    ]
+    return max(candidates, key=_version_key) if candidates else None
+
+
+def _template_storage(client: ProxmoxClient, node: str, storage: str = None) -> Optional[str]:
+    """Pick the storage to download templates to ('local' when it holds templates)."""
+    pools = [pool['storage'] for pool in client.get_storage_pools(node) if 'vztmpl' in pool['content']]
+    if storage:
+        return storage if storage in pools else None
+    return 'local' if 'local' in pools else (pools[0] if pools else None)
+
+
+def verify_template(client: ProxmoxClient, node: str, volid: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Check a downloaded template against the appliance index checksum.
+
+    Returns:
+        Dict with 'verified': True or False, or None when it could not be
+        checked (no published checksum, or no SSH access to the node)
+    """
+    for field, tool in CHECKSUM_TOOLS:
+        expected = (entry.get(field) or '').lower()
+        if not expected:
+            continue
+        result = client.exec_on_node(node, f'{tool} "$(pvesm path {volid})" | cut -d" " -f1', timeout=600)
+        if not result['success']:
+            return {'verified': None, 'error': (result.get('error') or '').strip()}
+        actual = (result.get('output') or '').strip().lower()
+        return {'verified': actual == expected, 'algorithm': field, 'checksum': actual}
+    return {'verified': None, 'error': 'No checksum published for this template'}
+
+
+def _checked_before(existing: Dict[str, Any], entry: Dict[str, Any], known: Dict[str, tuple]) -> bool:
+    """Whether a local copy passed this index entry's checksum at its current size and ctime."""
+    previous = known.get(existing['volid'])
+    if not previous or previous[:2] != (existing.get('size'), existing.get('ctime')):
+        return False
+    return any((entry.get(field) or '').lower() == previous[2] for field, _ in CHECKSUM_TOOLS)
+
+
+def prefetch_node(client: ProxmoxClient, node: str, names: List[str], storage: str = None,
+                  verify: bool = True, known: Dict[str, tuple] = None) -> List[Dict[str, Any]]:
+    """
+    Make one node hold every named template.
+
+    A local copy that fails its checksum is deleted and downloaded again once.
+    Copies listed in known are only checked again when their size or ctime
+    changed.
+
+    Args:
+        known: volid -> (size, ctime, checksum) of copies that passed before
+
+    Returns:
+        One result per template: status 'present', 'downloaded' or 'failed';
+        checked copies also get 'checksum', 'algorithm', 'size' and 'ctime'
+    """
+    known = known or {}
+    try:
+        index = client.get_appliance_index(node)
+        local = {item['name']: item for item in client.get_templates(node)['lxc']}
+        target = _template_storage(client, node, storage)
+    except Exception as e:
+        return [{'name': name, 'status': 'failed', 'error': str(e)} for name in names]
+
+    results = []
+    for name in names:
+        started = time.time()
+        entry = resolve_template(name, index)
+        filename = entry['template'] if entry else name
+        outcome = {'name': name, 'template': filename}
+
+        existing = local.get(filename)
+        if not existing and not entry:
+            # Custom templates have to be uploaded; accept any version of a package
+            existing = next((item for item in local.values() if item['name'].startswith(f'{name}_')), None)
+        if existing:
+            outcome.update(status='present', volid=existing['volid'])
+            if verify and entry and _checked_before(existing, entry, known):
+                outcome.update(verified=True, unchanged=True)
+            elif verify and entry:
+                check = verify_template(client, node, existing['volid'], entry)
+                outcome['verified'] = check['verified']
+                if check['verified']:
+                    outcome.update(checksum=check['checksum'], algorithm=check['algorithm'],
+                                   size=existing.get('size'), ctime=existing.get('ctime'))
+                if check['verified'] is False:
+                    client.delete_volume(node, existing['storage'], existing['volid'])
+                    existing = None
+            if existing:
+                results.append(outcome)
+                continue
+
+        if not entry:
+            results.append({**outcome, 'status': 'failed', 'error': 'Not in the appliance index'})
+            continue
+        if not target:
+            results.append({**outcome, 'status': 'failed', 'error': 'No storage for container templates'})
+            continue
+
+        download = client.download_template(node, target, filename)
+        if not download['success']:
+            results.append({**outcome, 'status': 'failed', 'error': download.get('error')})
+            continue
+        outcome.update(status='downloaded', volid=download['volid'])
+        if verify:
+            check = verify_template(client, node, download['volid'], entry)
+            outcome['verified'] = check['verified']
+            if check['verified']:
+                outcome.update(checksum=check['checksum'], algorithm=check['algorithm'])
+            if check['verified'] is False:
+                client.delete_volume(node, target, download['volid'])
+                outcome.update(status='failed', error='Checksum mismatch after download')
+        outcome['seconds'] = round(time.time() - started, 1)
+        results.append(outcome)
+
+    # Record the size and ctime the new copies were verified at
+    fresh = [r for r in results if r['status'] == 'downloaded' and r.get('checksum')]
+    if fresh:
+        try:
+            listed = {item['volid']: item for item in client.get_templates(node)['lxc']}
+        except Exception:
+            listed = {}
+        for outcome in fresh:
+            item = listed.get(outcome['volid'])
+            if item:
+                outcome.update(size=item.get('size'), ctime=item.get('ctime'))
+            else:
+                outcome.pop('checksum')
+    return results
+
+
+def _known_checksums(connection_id: int) -> Dict[str, Dict[str, tuple]]:
+    """node -> volid -> (size, ctime, checksum) of every copy that passed before."""
+    known = {}
+    for row in TemplateChecksum.query.filter_by(connection_id=connection_id).all():
+        known.setdefault(row.node, {})[row.volid] = (row.size, row.ctime, row.checksum)
+    return known
+
+
+def _record_checksums(connection_id: int, results: Dict[str, List[Dict[str, Any]]]):
+    """Remember copies checked in this run; forget those deleted after a mismatch."""
+    for node, node_results in results.items():
+        for outcome in node_results:
+            if not outcome.get('volid') or not (outcome.get('checksum') or outcome.get('verified') is False):
+                continue
+            row = TemplateChecksum.query.filter_by(
+                connection_id=connection_id, node=node, volid=outcome['volid']
+            ).first()
+            if outcome.get('verified') is False:
+                if row:
+                    db.session.delete(row)
+                continue
+            if not row:
+                row = TemplateChecksum(connection_id=connection_id, node=node, volid=outcome['volid'])
+                db.session.add(row)
+            row.size, row.ctime = outcome.get('size'), outcome.get('ctime')
+            row.algorithm, row.checksum = outcome['algorithm'], outcome['checksum']
+            row.verified_at = datetime.utcnow()
+    db.session.commit()
+
+
+def prefetch_templates(connection: ProxmoxConnection, names: List[str], nodes: List[str] = None,
+                       storage: str = None, verify: bool = True, max_workers: int = 8) -> Optional[Dict[str, Any]]:
+    """
+    Prefetch templates on every online node of a connection, in parallel.
+
+    Runs under the connection's template-prefetch:<id> lease, so workers
+    never prefetch the same connection at once.
+
+    Args:
+        connection: ProxmoxConnection model instance
+        names: Template file names or package prefixes
+        nodes: Only these nodes (default: every online node)
+        storage: Storage to download to (default 'local' or the first template storage)
+        verify: Check checksums (needs password auth for SSH)
+        max_workers: Nodes processed at once
+
+    Returns:
+        Report with per-node results and totals, or None if another worker
+        is prefetching for this connection
+    """
+    lease = acquire_lease(f'template-prefetch:{connection.id}', 'prefetch', ttl=current_app.config['LEASE_TTL'])
+    if not lease:
+        return None
+    with lease:
+        return _prefetch(connection, names, nodes, storage, verify, max_workers)
+
+
+def _prefetch(connection: ProxmoxConnection, names: List[str], nodes: Optional[List[str]],
+              storage: Optional[str], verify: bool, max_workers: int) -> Dict[str, Any]:
+    started = time.time()
+    if not nodes:
+        nodes = [n['node'] for n in ProxmoxClient(connection).get_nodes() if n['status'] == 'online']
+
+    known = _known_checksums(connection.id) if verify else {}
+    credentials = detached_connection(connection)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(nodes) or 1))) as pool:
+        results = dict(zip(nodes, pool.map(
+            lambda node: prefetch_node(ProxmoxClient(credentials), node, names, storage, verify,
+                                       known.get(node)),
+            nodes
+        )))
+    if verify:
+        _record_checksums(connection.id, results)
+
+    flat = [result for node_results in results.values() for result in node_results]
+    report = {
+        'connection_id': connection.id,
+        'templates': names,
+        'nodes': results,
+        'downloaded': sum(1 for r in flat if r['status'] == 'downloaded'),
+        'present': sum(1 for r in flat if r['status'] == 'present'),
+        'failed': sum(1 for r in flat if r['status'] == 'failed'),
+        'seconds': round(time.time() - started, 1),
+        'finished_at': datetime.utcnow().isoformat(),
+    }
+    with _reports_lock:
+        _reports[connection.id] = report
+    return report
+
+
+def get_prefetch_report(connection_id: int) -> Optional[Dict[str, Any]]:
+    """Get the last prefetch report for a connection."""
+    with _reports_lock:
+        return _reports.get(connection_id)
+
+
+def start_prefetch(app, connection_id: int, names: List[str], nodes: List[str] = None,
+                   storage: str = None, verify: bool = True) -> threading.Thread:
+    """Run a prefetch on a background thread."""
+    def run():
+        with app.app_context():
+            connection = ProxmoxConnection.query.get(connection_id)
+            try:
+                prefetch_templates(connection, names, nodes=nodes, storage=storage, verify=verify)
+            except Exception as e:
+                app.logger.warning('Template prefetch for connection %s failed: %s', connection_id, e)
+            db.session.remove()
+
+    thread = threading.Thread(target=run, name='template-prefetch', daemon=True)
+    thread.start()
+    return thread
+
+
+class TemplatePrefetcher:
+    """
+    Background thread that keeps every connection's nodes stocked with templates.
+
+    Each worker runs one; the per-connection lease makes the others skip a
+    connection while it is being prefetched.
+    """
+
+    def __init__(self, app, interval: float = 3600):
+        self.app = app
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='template-prefetch', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                for connection in ProxmoxConnection.query.all():
+                    names = required_templates(self.app.config['LXC_TEMPLATES'], connection.id)
+                    if not names:
+                        continue
+                    try:
+                        prefetch_templates(connection, names)
+                    except Exception as e:
+                        self.app.logger.warning('Template prefetch for %s failed: %s', connection.name, e)
+                db.session.remove()
+            time.sleep(self.interval)
@@ -0,0 +1,359 @@
+"""
+Warm Pools
+Keeps stopped, already-provisioned containers ready per game so a deploy
+only has to rename, reconfigure and start one.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+from flask import current_app
+
+from app import db
+from app.events import get_event_writer
+from app.leases import acquire_lease
+from app.models import WarmPool, PoolMember, DeploymentEvent
+from app.proxmox_client import ProxmoxClient
+from app.game_servers import get_server
+from app.install_scripts import render_install_script
+from app.golden_templates import get_golden_template
+
+
+STATS_WINDOW = 1000
+
+
+def _claim_stats(window: int = STATS_WINDOW) -> Dict[str, Any]:
+    """Hit/miss counts and claim latencies from the latest pool_claim events."""
+    writer = get_event_writer()
+    if writer:
+        writer.flush()
+    events = DeploymentEvent.query.filter_by(event='pool_claim').order_by(
+        DeploymentEvent.id.desc()
+    ).limit(window).all()
+
+    keys = {}
+    latencies = []
+    for event in events:
+        payload = event.payload or {}
+        entry = keys.setdefault(payload.get('server_key'), {'hits': 0, 'misses': 0})
+        entry['hits' if payload.get('hit') else 'misses'] += 1
+        if payload.get('seconds') is not None:
+            latencies.append(payload['seconds'])
+    latencies.sort()
+
+    hits = sum(entry['hits'] for entry in keys.values())
+    misses = sum(entry['misses'] for entry in keys.values())
+    for entry in keys.values():
+        total = entry['hits'] + entry['misses']
+        entry['hit_rate'] = round(entry['hits'] / total, 3) if total else 0.0
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        'claim_seconds': {
+            'count': len(latencies),
+            'avg': round(sum(latencies) / len(latencies), 2),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': round(latencies[-1], 2),
+        } if latencies else {'count': 0},
+        'by_server_key': keys,
+    }
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Get pool hit rate, claim latency and current pool fill levels.
+
+    Read from the database, so every worker reports the same numbers: claims
+    are the pool_claim events recorded by deploys, fill levels the members.
+    """
+    stats = _claim_stats()
+    stats['pools'] = [pool.to_dict() for pool in WarmPool.query.all()]
+    return stats
+
+
+def get_pool(connection_id: int, node: str, server_key: str) -> Optional[WarmPool]:
+    """Get the enabled warm pool for a game on a node, if there is one."""
+    return WarmPool.query.filter_by(
+        connection_id=connection_id, node=node, server_key=server_key, enabled=True
+    ).first()
+
+
+def claim_pool_member(pool: WarmPool) -> Optional[PoolMember]:
+    """
+    Take a ready container out of a warm pool, if there is one.
+
+    The claim is a conditional update, so two concurrent deploys never get
+    the same container. The caller records the outcome as a pool_claim event.
+    """
+    candidates = PoolMember.query.filter_by(pool_id=pool.id, status='ready').order_by(PoolMember.ready_at).all()
+    for member in candidates:
+        claimed = PoolMember.query.filter_by(id=member.id, status='ready').update({'status': 'claimed'})
+        db.session.commit()
+        if claimed:
+            db.session.refresh(member)
+            return member
+    return None
+
+
+def start_pool_member(client: ProxmoxClient, member: PoolMember, node: str,
+                      config: Dict[str, Any], script_hash: str = None) -> Dict[str, Any]:
+    """
+    Turn a claimed pool container into a deployment's server.
+
+    Applies the hostname, network and resource overrides, then starts it.
+
+    Returns:
+        Dict like create_lxc's, plus 'provisioned' telling the caller whether
+        the container already runs the recipe it would have provisioned and
+        'claim_seconds'
+    """
+    started = time.time()
+    result = client.update_lxc_config(node, member.vmid, {
+        key: config[key]
+        for key in ('hostname', 'cores', 'memory', 'dhcp', 'ip_address', 'cidr', 'gateway',
+                    'bridge', 'onboot')
+        if key in config
+    })
+    if result['success'] and config.get('start', True):
+        result = client.start_container(node, member.vmid, 'lxc')
+
+    if not result['success']:
+        member.status = 'failed'
+        member.error_message = result.get('error')
+        db.session.commit()
+        return {'success': False, 'error': result.get('error'), 'vmid': member.vmid}
+
+    vmid, member_hash = member.vmid, member.script_hash
+    db.session.delete(member)
+    db.session.commit()
+    return {
+        'success': True,
+        'vmid': vmid,
+        'type': 'lxc',
+        'from_pool': True,
+        'provisioned': bool(script_hash) and member_hash == script_hash,
+        'claim_seconds': round(time.time() - started, 2)
+    }
+
+
+def _build_member(client: ProxmoxClient, pool: WarmPool, member: PoolMember):
+    """Create, provision and stop one pool container."""
+    server = get_server(pool.server_key)
+    rendered = render_install_script(pool.server_key, node=pool.node, connection_id=pool.connection_id)
+
+    def fail(message):
+        # Don't leave a half-provisioned server running; the next refill deletes it
+        if member.vmid:
+            client.stop_container(pool.node, member.vmid, 'lxc')
+        member.status = 'failed'
+        member.error_message = message
+        db.session.commit()
+
+    if not server or server.deployment_type != 'lxc':
+        return fail(f'{pool.server_key} is not an LXC game server')
+    if rendered and not pool.connection.password:
+        return fail('Password authentication required for provisioning. API tokens cannot use SSH.')
+
+    config = {
+        'hostname': f'pool-{pool.server_key}'.replace('_', '-')[:63],
+        'storage': pool.storage,
+        'disk_size': server.disk_size,
+        'cores': server.cores,
+        'memory': server.memory,
+        'bridge': pool.bridge,
+        'dhcp': True,
+        'start': True,
+        'onboot': False,
+        'privileged': server.privileged,
+        'nesting': server.nesting,
+    }
+    golden = get_golden_template(pool.connection_id, pool.node, pool.server_key)
+    if golden:
+        config['template'] = golden.volid
+        config['restore'] = True
+    elif pool.template:
+        config['template'] = pool.template
+    else:
+        return fail('No golden template or base template for this pool')
+
+    result = client.create_lxc(pool.node, config)
+    if not result['success']:
+        return fail(f"Create failed: {result.get('error')}")
+    member.vmid = result['vmid']
+    db.session.commit()
+
+    if rendered:
+        # Give the container a moment to fully start
+        time.sleep(5)
+        provision = client.provision_container(pool.node, member.vmid, rendered.script, timeout=3600)
+        if not provision['success']:
+            return fail(f"Provisioning failed: {provision.get('error')}")
+
+    client.stop_container(pool.node, member.vmid, 'lxc')
+    client.wait_for_status(pool.node, member.vmid, 'stopped')
+    member.script_hash = rendered.content_hash if rendered else None
+    member.status = 'ready'
+    member.ready_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _destroy_member(client: ProxmoxClient, pool: WarmPool, member: PoolMember) -> bool:
+    """
+    Stop and delete a member's container, then its row.
+
+    A container that could not be deleted keeps its row, marked failed with
+    its vmid, so the next refill tries again instead of losing track of it.
+
+    Returns:
+        Whether the member was removed
+    """
+    if member.vmid:
+        client.stop_container(pool.node, member.vmid, 'lxc')
+        client.wait_for_status(pool.node, member.vmid, 'stopped', timeout=60)
+        result = client.delete_container(pool.node, member.vmid, 'lxc')
+        if not result['success']:
+            member.status = 'failed'
+            member.error_message = f"Delete failed: {result.get('error')}"
+            return False
+    db.session.delete(member)
+    return True
+
+
+def replenish_pool(pool: WarmPool) -> Optional[Dict[str, Any]]:
+    """
+    Bring a pool back to its target size.
+
+    Runs under the pool's warm-pool:<id> lease, so only one worker builds
+    for a pool at a time. Members still marked building when the lease is
+    taken were left by a worker that died, and are destroyed along with
+    failed containers, ready ones built from an outdated install recipe and
+    any above the target size. Then new members are built one at a time.
+    Containers that fail to delete stay in the pool as failed members.
+
+    Returns:
+        Dict with the number of members built and removed, or None if
+        another worker is replenishing the pool
+    """
+    lease = acquire_lease(f'warm-pool:{pool.id}', 'replenish', ttl=current_app.config['LEASE_TTL'])
+    if not lease:
+        return None
+    with lease:
+        return _replenish(pool, lease)
+
+
+def _replenish(pool: WarmPool, lease) -> Dict[str, Any]:
+    client = ProxmoxClient(pool.connection)
+    rendered = render_install_script(pool.server_key, node=pool.node, connection_id=pool.connection_id)
+    current_hash = rendered.content_hash if rendered else None
+
+    removed = 0
+    ready = [m for m in pool.members if m.status == 'ready']
+    surplus = {m.id for m in ready[:max(0, len(ready) - pool.size)]}
+    for member in list(pool.members):
+        stale = member.status == 'ready' and member.script_hash != current_hash
+        if member.status in ('failed', 'building') or stale or member.id in surplus or (
+                member.status == 'ready' and not pool.enabled):
+            removed += _destroy_member(client, pool, member)
+    db.session.commit()
+
+    built = 0
+    while pool.enabled and not lease.lost:
+        active = PoolMember.query.filter(
+            PoolMember.pool_id == pool.id,
+            PoolMember.status.in_(('building', 'ready'))
+        ).count()
+        if active >= pool.size:
+            break
+        member = PoolMember(pool_id=pool.id, status='building')
+        db.session.add(member)
+        db.session.commit()
+        _build_member(client, pool, member)
+        if member.status != 'ready':
+            break
+        built += 1
+
+    return {'built': built, 'removed': removed}
+
+
+def start_replenish(app, pool_id: int) -> threading.Thread:
+    """Run a replenish on a background thread."""
+    def run():
+        with app.app_context():
+            pool = WarmPool.query.get(pool_id)
+            try:
+                if pool:
+                    replenish_pool(pool)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning('Warm pool %s replenish failed: %s', pool_id, e)
+            db.session.remove()
+
+    thread = threading.Thread(target=run, name='warm-pool-replenish', daemon=True)
+    thread.start()
+    return thread
+
+
+def drain_pool(pool: WarmPool) -> Dict[str, Any]:
+    """
+    Destroy every container in a pool.
+
+    Returns:
+        Dict with the number of members removed, and the members whose
+        container could not be deleted (kept as failed)
+    """
+    client = ProxmoxClient(pool.connection)
+    removed, failed = 0, []
+    for member in list(pool.members):
+        if member.status == 'claimed':
+            continue
+        if _destroy_member(client, pool, member):
+            removed += 1
+        else:
+            failed.append(member)
+    db.session.commit()
+    return {'removed': removed, 'failed': [member.to_dict() for member in failed]}
+
+
+class WarmPoolManager:
+    """
+    Background thread that keeps every warm pool topped up.
+
+    Each worker runs one; the per-pool lease decides which of them does the
+    building for a pool, and the others skip it.
+    """
+
+    def __init__(self, app, interval: float = 60):
+        self.app = app
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='warm-pool', daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """Replenish now instead of waiting for the next interval (e.g. after a claim)."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                for pool in WarmPool.query.filter_by(enabled=True).all():
+                    try:
+                        replenish_pool(pool)
+                    except Exception as e:
+                        db.session.rollback()
+                        self.app.logger.warning('Warm pool %s replenish failed: %s', pool.id, e)
+                db.session.remove()
+            self._wake.wait(self.interval)
+            self._wake.clear()
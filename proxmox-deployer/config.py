@@ -13,6 +13,34 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f'sqlite:///{BASE_DIR}/deployer.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    EVENT_BATCH_SIZE = int(os.environ.get('EVENT_BATCH_SIZE', 100))
+    EVENT_FLUSH_INTERVAL = float(os.environ.get('EVENT_FLUSH_INTERVAL', 1.0))
+    RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 180))
+    RETENTION_STATUSES = os.environ.get('RETENTION_STATUSES', 'failed,provision_failed,gone').split(',')
+    RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 0))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', f'{BASE_DIR}/archive')
+    VACUUM_FREE_RATIO = float(os.environ.get('VACUUM_FREE_RATIO', 0.1))
+    TASK_NODE_LIMIT = int(os.environ.get('TASK_NODE_LIMIT', 4))
+    TASK_STORAGE_LIMIT = int(os.environ.get('TASK_STORAGE_LIMIT', 2))
+    TASK_THROTTLE_ADAPTIVE = os.environ.get('TASK_THROTTLE_ADAPTIVE', 'true').lower() in ('1', 'true', 'yes')
+    TASK_SLOT_TIMEOUT = float(os.environ.get('TASK_SLOT_TIMEOUT', 1800))
+    LEASE_TTL = float(os.environ.get('LEASE_TTL', 60))
+    LEASE_WAIT = float(os.environ.get('LEASE_WAIT', 0))
+    IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+    IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', 300))
+    CATALOG_DIR = os.environ.get('CATALOG_DIR')
+    CATALOG_RELOAD_INTERVAL = float(os.environ.get('CATALOG_RELOAD_INTERVAL', 5))
+    WARM_POOL_INTERVAL = float(os.environ.get('WARM_POOL_INTERVAL', 0))
+    DEPOT_CACHE = os.environ.get('DEPOT_CACHE', '').lower() in ('1', 'true', 'yes')
+    LXC_TEMPLATES = os.environ.get('LXC_TEMPLATES', 'debian-12-standard').split(',')
+    TEMPLATE_PREFETCH_INTERVAL = float(os.environ.get('TEMPLATE_PREFETCH_INTERVAL', 0))
 
 
 class DevelopmentConfig(Config):
@@ -81,6 +81,9 @@ case "$MODE" in
         echo ""
 
         export FLASK_ENV=production
+
+        # Upgrade the database once, before the workers start
+        flask --app run migrate
         gunicorn --bind 0.0.0.0:5555 --workers 2 run:app
         ;;
 
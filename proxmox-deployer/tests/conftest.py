@@ -0,0 +1,27 @@
+"""
+Shared fixtures: an app on a fresh SQLite database, with the background
+managers turned off.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'deployer.db'}")
+    for key in ('WARM_POOL_INTERVAL', 'TEMPLATE_PREFETCH_INTERVAL', 'RETENTION_INTERVAL'):
+        monkeypatch.setenv(key, '0')
+    monkeypatch.delenv('CATALOG_DIR', raising=False)
+
+    from app import create_app, db
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
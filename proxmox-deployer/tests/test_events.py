@@ -0,0 +1,78 @@
+"""
+Event writer tests: batching, retrying a failed batch, dropping it after the
+retry, and writing what is left at exit.
+"""
+
+import pytest
+
+from app import db
+from app.events import EventWriter, _row
+from app.models import DeploymentEvent
+
+
+class BrokenEngine:
+    """Stands in for an engine whose database rejects every write."""
+
+    def begin(self):
+        raise RuntimeError('database is locked')
+
+
+@pytest.fixture
+def writer(app):
+    return EventWriter(db.engine, batch_size=2)
+
+
+def _events(count):
+    return [_row(1, 'create', message=f'event {n}') for n in range(count)]
+
+
+def _stored():
+    return [e.message for e in DeploymentEvent.query.order_by(DeploymentEvent.id)]
+
+
+def test_flush_writes_in_batches(writer):
+    writer.enqueue(_events(5))
+    writer.flush()
+    assert writer.stats() == {'queued': 0, 'written': 5, 'batches': 3, 'dropped': 0}
+    assert _stored() == [f'event {n}' for n in range(5)]
+
+
+def test_failed_batch_is_retried_on_the_next_flush(writer):
+    engine, writer.engine = writer.engine, BrokenEngine()
+    writer.enqueue(_events(3))
+    writer.flush()
+    # The first batch waits for its retry and the rest stay queued
+    assert writer.stats() == {'queued': 3, 'written': 0, 'batches': 0, 'dropped': 0}
+
+    writer.engine = engine
+    writer.flush()
+    assert writer.stats() == {'queued': 0, 'written': 3, 'batches': 2, 'dropped': 0}
+    assert sorted(_stored()) == [f'event {n}' for n in range(3)]
+
+
+def test_batch_is_dropped_when_the_retry_fails(writer):
+    engine, writer.engine = writer.engine, BrokenEngine()
+    writer.enqueue(_events(3))
+    writer.flush()
+    writer.flush()
+    assert writer.dropped == 2
+
+    writer.engine = engine
+    writer.flush()
+    assert writer.stats() == {'queued': 0, 'written': 1, 'batches': 1, 'dropped': 2}
+
+
+def test_close_writes_everything_queued(writer):
+    writer.enqueue(_events(5))
+    writer.close()
+    assert writer.stats()['queued'] == 0
+    assert len(_stored()) == 5
+
+
+def test_close_retries_a_failed_batch_at_once(writer):
+    writer.engine = BrokenEngine()
+    writer.enqueue(_events(3))
+    writer.close()
+    # One batch failed twice and is dropped; the other could not be written either
+    assert writer.dropped == 2
+    assert writer.stats()['queued'] == 1
@@ -0,0 +1,102 @@
+"""
+Idempotency-Key tests: replays, key reuse, requests still in flight, and
+responses that must not be stored.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from flask import jsonify, request
+
+from app.idempotency import IDEMPOTENCY_HEADER, get_idempotency_key, idempotent
+from app.leases import acquire_lease
+
+
+@pytest.fixture
+def view(app):
+    """An idempotent route that records its calls and returns queued responses."""
+    view = SimpleNamespace(calls=[], responses=[])
+
+    def create():
+        view.calls.append(request.get_json())
+        if view.responses:
+            response = view.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return jsonify({'created': len(view.calls)}), 201
+
+    app.add_url_rule('/test/create', 'test_create', idempotent(create), methods=['POST'])
+    return view
+
+
+def _post(client, body, key='key-1'):
+    headers = {IDEMPOTENCY_HEADER: key} if key else {}
+    return client.post('/test/create', json=body, headers=headers)
+
+
+def test_without_a_key_every_request_runs(client, view):
+    assert _post(client, {'n': 1}, key=None).status_code == 201
+    assert _post(client, {'n': 1}, key=None).status_code == 201
+    assert len(view.calls) == 2
+
+
+def test_retry_replays_the_stored_response(client, view):
+    first = _post(client, {'n': 1})
+    retry = _post(client, {'n': 1})
+    assert len(view.calls) == 1
+    assert retry.status_code == first.status_code == 201
+    assert retry.get_json() == first.get_json() == {'created': 1}
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert get_idempotency_key('key-1').status == 'done'
+
+
+def test_key_reused_with_a_different_body_is_rejected(client, view):
+    _post(client, {'n': 1})
+    response = _post(client, {'n': 2})
+    assert response.status_code == 422
+    assert len(view.calls) == 1
+
+
+def test_request_still_in_flight_gets_409(app, client, view):
+    app.config['IDEMPOTENCY_WAIT'] = 0
+    with acquire_lease('idempotency:key-1', 'create'):
+        response = _post(client, {'n': 1})
+    assert response.status_code == 409
+    assert response.headers['Retry-After']
+    assert view.calls == []
+
+
+@pytest.mark.parametrize('status', [409, 500, 503])
+def test_conflicts_and_server_errors_are_not_stored(client, view, status):
+    view.responses.append((jsonify({'error': 'try again'}), status))
+    assert _post(client, {'n': 1}).status_code == status
+    assert get_idempotency_key('key-1') is None
+
+    retry = _post(client, {'n': 1})
+    assert retry.status_code == 201
+    assert 'Idempotent-Replayed' not in retry.headers
+    assert len(view.calls) == 2
+
+
+def test_client_errors_are_stored(client, view):
+    view.responses.append((jsonify({'error': 'bad request'}), 400))
+    assert _post(client, {'n': 1}).status_code == 400
+    retry = _post(client, {'n': 1})
+    assert retry.status_code == 400
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(view.calls) == 1
+
+
+def test_exception_forgets_the_key(app, client, view):
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    view.responses.append(RuntimeError('cluster unreachable'))
+    assert _post(client, {'n': 1}).status_code == 500
+    assert get_idempotency_key('key-1') is None
+    assert _post(client, {'n': 1}).status_code == 201
+
+
+def test_overlong_key_is_rejected(client, view):
+    assert _post(client, {'n': 1}, key='k' * 201).status_code == 400
+    assert view.calls == []
@@ -0,0 +1,131 @@
+"""
+Lease tests: taking over expired leases, and noticing a lost one.
+"""
+
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from app import db
+from app.leases import LeaseHandle, LeaseLost, acquire_lease, get_lease
+from app.models import Lease
+
+
+def _wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_held_lease_is_not_acquired_twice(app):
+    with acquire_lease('guest:1:100', 'deploy') as lease:
+        assert acquire_lease('guest:1:100', 'provision') is None
+        assert get_lease('guest:1:100')['owner'] == lease.owner
+    assert get_lease('guest:1:100') is None
+
+
+def test_expired_lease_is_taken_over(app):
+    now = datetime.utcnow()
+    db.session.add(Lease(key='guest:1:100', owner='crashed-worker', operation='deploy',
+                         acquired_at=now - timedelta(minutes=5), expires_at=now - timedelta(seconds=1)))
+    db.session.commit()
+
+    lease = acquire_lease('guest:1:100', 'provision')
+    assert lease is not None
+    try:
+        held = get_lease('guest:1:100')
+        assert held['owner'] == lease.owner
+        assert held['operation'] == 'provision'
+    finally:
+        lease.release()
+
+
+def test_heartbeat_renews_the_lease(app):
+    with acquire_lease('guest:1:100', 'deploy', ttl=0.6) as lease:
+        time.sleep(1.0)
+        assert not lease.lost
+        assert acquire_lease('guest:1:100', 'provision') is None
+
+
+def test_heartbeat_marks_a_taken_over_lease_lost(app):
+    lease = acquire_lease('guest:1:100', 'deploy', ttl=0.6)
+    Lease.query.filter_by(key='guest:1:100').update({'owner': 'another-worker'})
+    db.session.commit()
+
+    assert _wait_for(lambda: lease.lost)
+    with pytest.raises(LeaseLost):
+        lease.check()
+    lease.release()
+    # Releasing a lost lease leaves the new holder's lease alone
+    assert get_lease('guest:1:100')['owner'] == 'another-worker'
+
+
+def test_heartbeat_marks_an_unrenewed_lease_lost(app):
+    lease = acquire_lease('guest:1:100', 'deploy', ttl=0.6)
+    with mock.patch.object(LeaseHandle, 'renew', side_effect=Exception('database is locked')):
+        assert _wait_for(lambda: lease.lost)
+    lease.release()
+
+
+def test_check_passes_while_held(app):
+    with acquire_lease('guest:1:100', 'deploy') as lease:
+        lease.check()
+
+
+@pytest.fixture
+def deployment(app):
+    from app.models import Deployment, ProxmoxConnection
+    connection = ProxmoxConnection(name='lab', host='pve.local', username='root@pam', password='secret')
+    db.session.add(connection)
+    db.session.commit()
+    deployment = Deployment(connection_id=connection.id, server_key='valheim', server_name='Valheim',
+                            deployment_type='lxc', node='pve', vmid=100, status='running', config_snapshot={})
+    db.session.add(deployment)
+    db.session.commit()
+    return deployment
+
+
+def _provision(client, deployment, lose_lease):
+    """Re-provision a deployment, losing its lease at the given point ('before' or 'during')."""
+    from app import routes
+    real_lease_guest = routes._lease_guest
+    leases = []
+
+    def lease_guest(*args, **kwargs):
+        lease = real_lease_guest(*args, **kwargs)
+        lease.lost = lose_lease == 'before'
+        leases.append(lease)
+        return lease
+
+    def provision(*args, **kwargs):
+        leases[0].lost = lose_lease == 'during'
+        return {'success': True, 'output': ''}
+
+    with mock.patch.object(routes, '_lease_guest', side_effect=lease_guest), \
+            mock.patch.object(routes, 'ProxmoxClient') as proxmox:
+        proxmox.return_value.provision_container.side_effect = provision
+        response = client.post(f'/api/deployments/{deployment.id}/provision', json={})
+    return response, proxmox.return_value
+
+
+def test_provision_stops_before_changing_status_without_the_lease(client, deployment):
+    response, proxmox = _provision(client, deployment, 'before')
+    assert response.status_code == 409
+    assert not proxmox.provision_container.called
+    db.session.refresh(deployment)
+    assert deployment.status == 'running'
+
+
+def test_provision_that_lost_its_lease_is_not_recorded_as_done(client, deployment):
+    response, proxmox = _provision(client, deployment, 'during')
+    assert response.status_code == 409
+    assert proxmox.provision_container.called
+    db.session.refresh(deployment)
+    assert deployment.status == 'provision_failed'
+    assert 'Lost the lease' in deployment.error_message
+    assert 'install_script_hash' not in (deployment.config_snapshot or {})
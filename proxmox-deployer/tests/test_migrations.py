@@ -0,0 +1,131 @@
+"""
+Schema migration tests: upgrading a database created by the original
+release, alone and with several workers starting at once.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tables as the first release created them
+BASELINE_SCHEMA = """
+CREATE TABLE proxmox_connections (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE,
+    host VARCHAR(255) NOT NULL,
+    port INTEGER,
+    username VARCHAR(100) NOT NULL,
+    password VARCHAR(255),
+    token_name VARCHAR(100),
+    token_value VARCHAR(255),
+    verify_ssl BOOLEAN,
+    is_default BOOLEAN,
+    created_at DATETIME,
+    updated_at DATETIME
+);
+CREATE TABLE deployments (
+    id INTEGER NOT NULL PRIMARY KEY,
+    connection_id INTEGER NOT NULL REFERENCES proxmox_connections (id),
+    server_key VARCHAR(100) NOT NULL,
+    server_name VARCHAR(200) NOT NULL,
+    deployment_type VARCHAR(20) NOT NULL,
+    node VARCHAR(100) NOT NULL,
+    vmid INTEGER,
+    ip_address VARCHAR(50),
+    status VARCHAR(50),
+    error_message TEXT,
+    config_snapshot JSON,
+    created_at DATETIME,
+    updated_at DATETIME
+);
+CREATE TABLE credentials (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE,
+    credential_type VARCHAR(50) NOT NULL,
+    value TEXT NOT NULL,
+    description VARCHAR(255),
+    created_at DATETIME,
+    updated_at DATETIME
+);
+"""
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A baseline-schema SQLite database with a few deployments."""
+    path = tmp_path / 'deployer.db'
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO proxmox_connections (id, name, host, port, username) "
+                 "VALUES (1, 'lab', 'pve.local', 8006, 'root@pam')")
+    config = json.dumps({'cores': 2, 'memory': 2048, 'storage': 'local-lvm'})
+    for i, status in enumerate(['running', 'running', 'failed']):
+        conn.execute(
+            "INSERT INTO deployments (connection_id, server_key, server_name, deployment_type, node, "
+            "vmid, status, config_snapshot, created_at, updated_at) "
+            "VALUES (1, 'valheim', 'Valheim', 'lxc', 'pve', ?, ?, ?, '2025-01-01', '2025-01-01')",
+            (100 + i, status, config)
+        )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _check_upgraded(path):
+    conn = sqlite3.connect(path)
+    try:
+        versions = [row[0] for row in conn.execute('SELECT version FROM schema_migrations ORDER BY version')]
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(deployments)')}
+        hashes = {row[0] for row in conn.execute('SELECT config_hash FROM deployments')}
+        blobs = conn.execute('SELECT COUNT(*) FROM config_blobs').fetchone()[0]
+        counts = dict(conn.execute(
+            "SELECT status, count FROM deployment_counts WHERE dimension = 'all'"
+        ).fetchall())
+    finally:
+        conn.close()
+    from app.migrations import MIGRATIONS
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    assert 'config_hash' in columns
+    assert len(hashes) == 1 and None not in hashes
+    assert blobs == 1
+    assert counts == {'running': 2, 'failed': 1}
+
+
+def _app_env(path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', WARM_POOL_INTERVAL='0',
+               TEMPLATE_PREFETCH_INTERVAL='0', RETENTION_INTERVAL='0')
+    env.pop('CATALOG_DIR', None)
+    return env
+
+
+def test_upgrade_baseline_database(baseline_db, monkeypatch):
+    for key, value in _app_env(baseline_db).items():
+        monkeypatch.setenv(key, value)
+    from app import create_app, db
+    from app.migrations import run_migrations
+
+    app = create_app()
+    _check_upgraded(baseline_db)
+    with app.app_context():
+        assert run_migrations(db.engine, db.metadata) == []
+        db.engine.dispose()
+
+
+def test_concurrent_startup(baseline_db):
+    workers = [
+        subprocess.Popen(
+            [sys.executable, '-c', 'from app import create_app; create_app()'],
+            cwd=APP_DIR, env=_app_env(baseline_db), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        for _ in range(4)
+    ]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=120)
+        assert worker.returncode == 0, stderr.decode()
+    _check_upgraded(baseline_db)